@@ -0,0 +1,214 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import time
+import threading
+import logging
+from obspy import Stream
+from obspy.clients.seedlink.easyseedlink import EasySeedLinkClient
+
+
+"""
+EasySeedLinkClient that hands every received packet to a callback.
+The client runs in the acquisition thread of seedlinkStream.
+If no packet arrives for timeout seconds the connection is dropped and made again (the network timeout of the connection),
+a stream that keeps sending is never dropped.
+"""
+class streamClient(EasySeedLinkClient):
+    def __init__(self, server_url, on_trace, timeout=60):
+        super().__init__(server_url, autoconnect=False)
+        self.on_trace = on_trace
+        self.connect_timeout = timeout
+        self.conn.netto = timeout
+
+    def connect(self):
+        # SeedLinkConnection.connect can't handle the timeout EasySeedLinkClient leaves as None, but collect() ends the
+        # stream once it has run for that long, so it is only set while connecting.
+        self.conn.timeout = self.connect_timeout
+        try:
+            super().connect()
+        finally:
+            self.conn.timeout = None
+
+    def on_data(self, trace):
+        self.on_trace(trace)
+
+    def on_seedlink_error(self):
+        logging.error("Seedlink stream reported an error.")
+
+    def on_terminate(self):
+        logging.info("Seedlink stream terminated.")
+
+
+"""
+A long lived seedlink connection which runs in its own thread and keeps the last few minutes
+of every station/channel in memory. The per minute processing slices the minute it needs out of
+the buffers instead of opening a new connection every minute.
+The end time of the newest packet of every channel is kept, so the minute is sliced once every channel has sent it.
+If the connection is lost the thread reconnects and asks the server for data from the end of
+the channel that is furthest behind, so the gap of every channel is filled from the server's own buffer.
+A channel that has sent nothing for the whole buffer window is dropped.
+"""
+class seedlinkStream:
+    def __init__(self, address, port, network, station_wildcard, location_wildcard, channels, buffer_minutes=5, reconnect_delay=10):
+        self.server_url = str(address) + ":" + str(port)
+        self.network = network
+        self.station_wildcard = station_wildcard
+        self.selector = location_wildcard + channels
+        self.buffer_seconds = buffer_minutes * 60
+        self.reconnect_delay = reconnect_delay
+
+        self.lock = threading.Condition()#guards self.buffers and self.endtimes, notified on every packet
+        self.buffers = {}#trace id -> list of traces, oldest first
+        self.endtimes = {}#trace id -> end time of the newest packet of the channel
+        self.client = None
+        self.exit = False
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.name = "seedlink_stream_thread"
+        self.thread.daemon = True
+
+
+    def start(self):
+        self.thread.start()
+
+
+    def stop(self):
+        self.exit = True
+
+        if(self.client is not None):
+            self.client.conn.terminate()
+
+
+    """
+    Called from the seedlink client for every packet. Appends the packet to the buffer of its
+    channel and drops the packets of the channel that have fallen out of its buffer window.
+    """
+    def add_trace(self, trace):
+        with self.lock:
+            traces = self.buffers.setdefault(trace.id, [])
+            traces.append(trace)
+
+            if(trace.id not in self.endtimes or trace.stats.endtime > self.endtimes[trace.id]):
+                self.endtimes[trace.id] = trace.stats.endtime
+
+            oldest_allowed = self.endtimes[trace.id] - self.buffer_seconds
+
+            while(len(traces) > 0 and traces[0].stats.endtime < oldest_allowed):
+                traces.pop(0)
+
+            self.lock.notify_all()
+
+
+    """
+    Drops the channels that have sent nothing for the whole buffer window before the newest packet of any channel,
+    so a stalled station doesn't keep its old data, hold up wait_for or make the stream resume from long ago.
+    Called with the lock held.
+    """
+    def drop_stalled(self):
+        if(len(self.endtimes) == 0):
+            return
+
+        oldest_allowed = max(self.endtimes.values()) - self.buffer_seconds
+
+        for trace_id in [trace_id for trace_id in self.endtimes if self.endtimes[trace_id] < oldest_allowed]:
+            logging.info("No data from " + trace_id + " since " + str(self.endtimes[trace_id]) + ", dropping it from the seedlink stream buffers.")
+            del self.endtimes[trace_id]
+            del self.buffers[trace_id]
+
+
+    """
+    The acquisition loop. Connects, selects the streams and streams until the connection
+    terminates or raises, then waits a bit and resumes from the end of the channel that is furthest behind.
+    """
+    def run(self):
+        while(not self.exit):
+            try:
+                logging.info("Connecting to seedlink stream " + self.server_url + "...")
+                self.client = streamClient(self.server_url, self.add_trace)
+
+                resume_time = None
+                with self.lock:
+                    self.drop_stalled()
+                    if(len(self.endtimes) > 0):
+                        resume_time = min(self.endtimes.values())
+
+                if(resume_time is not None):
+                    logging.info("Resuming seedlink stream from " + str(resume_time))
+                    self.client.conn.set_begin_time(resume_time)
+
+                self.client.connect()
+                self.client.select_stream(self.network, self.station_wildcard, self.selector)
+                self.client.run()
+            except Exception as e:
+                logging.error("Seedlink stream connection lost.")
+                logging.info(e)
+
+            try:
+                self.client.close()
+            except Exception:
+                pass
+
+            if(not self.exit):
+                time.sleep(self.reconnect_delay)
+
+
+    """
+    Blocks until every channel in the buffers has a packet ending at or after endtime, or until timeout seconds have passed.
+    Used so the minute is sliced after the last packets of the minute have come in from every station.
+
+    Returns:
+        True if data up to endtime is in the buffer for every channel.
+    """
+    def wait_for(self, endtime, timeout):
+        deadline = time.monotonic() + timeout
+
+        with self.lock:
+            self.drop_stalled()
+
+            while(len(self.endtimes) == 0 or min(self.endtimes.values()) < endtime):
+                remaining = deadline - time.monotonic()
+                if(remaining <= 0):
+                    behind = [trace_id for trace_id in self.endtimes if self.endtimes[trace_id] < endtime]
+                    if(len(behind) > 0):
+                        logging.info("Seedlink stream has no data up to " + str(endtime) + " for " + ", ".join(sorted(behind)))
+                    return(False)
+                self.lock.wait(remaining)
+
+        return(True)
+
+
+    """
+    Returns the data between starttime and endtime as a Stream, the same way the basic seedlink
+    client does, but without any network round-trip. The packets are merged so each channel
+    ends up as a single trace, gaps between packets are interpolated (and logged) so the rsam
+    of the channel is computed from the whole minute and not only from the piece after the gap.
+    """
+    def get_waveforms(self, starttime, endtime):
+        result = Stream()
+
+        with self.lock:
+            buffered = []
+            for traces in self.buffers.values():
+                for trace in traces:
+                    if(trace.stats.endtime >= starttime and trace.stats.starttime <= endtime):
+                        buffered.append(trace)
+
+        for trace in buffered:
+            result.append(trace.slice(starttime, endtime))
+
+        result.merge(method=-1)
+
+        seen = set()
+        gaps = set()
+        for trace in result:
+            if(trace.id in seen):
+                gaps.add(trace.id)
+            seen.add(trace.id)
+
+        if(len(gaps) > 0):
+            logging.info("Interpolating gaps between " + str(starttime) + " and " + str(endtime) + " in " + ", ".join(sorted(gaps)))
+            result.merge(method=1, fill_value="interpolate")
+
+        return(result)
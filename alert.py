@@ -2,7 +2,10 @@
 # Bethany Erin Vanderhoof
 
 import os
+import threading
 import common
+import daystore
+import catalog
 import numpy
 from obspy import UTCDateTime
 
@@ -11,20 +14,22 @@ class ClassAlertInfo:
 
     def __init__(self):
         self.filter_list = []
-        self.lta = {}
-        self.sta = {}
-        self.ramp = {}
-        self.ratio_values = {}
+        self.stations = [] # stations of the rows of the arrays below (filters x stations)
+        self.lta = None
+        self.sta = None
+        self.ratio_values = None
         self.station_trigger = {}
         self.filters_triggered = {}
         self.current_eventID = {}
         self.previous_eventID = {}
-        self.current_velocity = {}
-        self.ramp_buffer = {}
+        self.current_velocity = None
+        self.ramp_buffer = None # filters x stations x ramp intervals
         self.audio_alarm = {}
         self.alert_on = {}
         self.alarm_per_hr = 0
         self.target_hr = ""
+        self.window = None # rollingWindow with the recent RSAM
+        self.catalog = None # catalog.catalogStore, opened by catalog_store()
 
     def alert_on_redefine(self, filters, alert_on):
 
@@ -37,324 +42,376 @@ class ClassAlertInfo:
 AlertInfo = ClassAlertInfo()
 
 
-""" Defines the start and end times of the STA and LTA windows. Returns lists with start & end times for sta and lta.
+""" The number of minutes the alerts look back from the current minute: the STA and LTA windows, or the ramp if that is longer.
 """
-def define_windows(starttime, sta_length, lta_length):
-    # window start and end times
-    sta_window_start = starttime - sta_length
-    sta_window_end = starttime
-    lta_window_end = sta_window_start - 60
-    lta_window_start = lta_window_end - lta_length
+def window_minutes(alert_config):
+    return(max(alert_config["sta_length"] + alert_config["lta_length"], alert_config["ramp_min_avg"] * alert_config["ramp_intervals"]))
 
-    windows = [[sta_window_start, sta_window_end], [lta_window_start, lta_window_end]] # sta and lta windows
-    return(windows)
 
+""" The last few minutes of RSAM of every station for each filter, kept in memory so the alerts don't read the day files
+    every minute. Each filter has a ring buffer of stations x minutes. The logger pushes every minute it writes,
+    and the window is filled from the day files once when it is created. Minutes that were never pushed are 0.0,
+    the same as in the day files, and windows that span midnight are no different from the others.
+"""
+class rollingWindow:
+
+    def __init__(self, minutes, filters, channel):
+        self.minutes = minutes
+        self.filters = filters
+        self.channel = channel
+        self.last = None # newest minute (since the epoch) in the window
+        self.stations = [] # row of each station in the buffers
+        self.station_index = {}
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+        for name in filters:
+            self.buffers[str(name)] = numpy.zeros((0, minutes))
+
+    def matches(self, minutes, filters, channel):
+        return(self.minutes == minutes and self.filters == filters and self.channel == channel)
+
+    def add_station(self, name):
+        self.station_index[name] = len(self.stations)
+        self.stations.append(name)
+
+        for filter_name in self.buffers:
+            self.buffers[filter_name] = numpy.vstack([self.buffers[filter_name], numpy.zeros((1, self.minutes))])
+
+    """ Drops the stations that are not in keep and have no data left in the window, e.g. stations that left the network.
+    """
+    def prune_stations(self, keep):
+        rows = []
+        for i in range(0, len(self.stations)):
+            name = self.stations[i]
+            if(name in keep or any(self.buffers[f][i].any() for f in self.buffers)):
+                rows.append(i)
+
+        if(len(rows) == len(self.stations)):
+            return
+
+        self.stations = [self.stations[i] for i in rows]
+        self.station_index = {}
+        for i in range(0, len(self.stations)):
+            self.station_index[self.stations[i]] = i
+
+        for filter_name in self.buffers:
+            self.buffers[filter_name] = self.buffers[filter_name][rows]
+
+    """ Moves the window forward to minute (since the epoch), clearing the minutes it moves over.
+    """
+    def advance(self, minute):
+        if(self.last is not None and minute <= self.last):
+            return
+
+        if(self.last is None or minute - self.last >= self.minutes):
+            columns = list(range(0, self.minutes))
+        else:
+            columns = [m % self.minutes for m in range(self.last + 1, minute + 1)]
+
+        for filter_name in self.buffers:
+            self.buffers[filter_name][:, columns] = 0.0
+
+        self.last = minute
+
+    """ Sets the values of a minute. Stations that are not in values get 0.0, as in the day files.
+        Minutes older than the window are ignored.
+
+        Parameters:
+            minute: minutes since the epoch.
+            values: list (one per filter) of dictionaries of station -> RSAM, like the logger's rsam_results.
+    """
+    def set_minute(self, minute, values):
+        self.advance(minute)
+
+        if(minute <= self.last - self.minutes):
+            return
+
+        column = minute % self.minutes
+
+        for i in range(0, len(self.filters)):
+            filter_name = str(self.filters[i])
+            self.buffers[filter_name][:, column] = 0.0
+
+            for name in values[i]:
+                if(name not in self.station_index):
+                    self.add_station(name)
+                self.buffers[filter_name][self.station_index[name], column] = values[i][name]
+
+    """ Pushes the RSAM results of the minute that starts at starttime.
+    """
+    def push(self, starttime, rsam_results):
+        with self.lock:
+            self.set_minute(int(starttime.timestamp) // 60, rsam_results)
 
-""" Specifies for which day/s data must be pulled (and thus for which days files should exist).
-    Only accommodates maximum LTA plus STA windows spanning max two days. Returns list of days (data range).
+            keep = set()
+            for values in rsam_results:
+                keep.update(values)
+            self.prune_stations(keep)
+
+    """ Fills the window up to and including the minute that starts at starttime from the day files,
+        the csv files if there are any, else the binary store.
+    """
+    def warm(self, starttime):
+        last = int(starttime.timestamp) // 60
+        first = last - self.minutes + 1
+
+        with self.lock:
+            self.last = None
+            self.advance(last)
+
+            for day in range(first // 1440, last // 1440 + 1):
+                date = UTCDateTime(day * 86400)
+                per_minute = {} # minute -> list (one per filter) of dictionaries of station -> RSAM
+
+                for i in range(0, len(self.filters)):
+                    for minute, values in read_day_minutes(date, self.filters[i], self.channel, max(first, day * 1440), min(last, day * 1440 + 1439)):
+                        per_minute.setdefault(minute, [{} for f in self.filters])[i] = values
+
+                for minute in sorted(per_minute):
+                    self.set_minute(minute, per_minute[minute])
+
+    """ Returns the window up to and including the minute that starts at starttime as an array of
+        filters x stations x minutes, oldest minute first, and the list of the stations of its rows.
+    """
+    def matrix(self, starttime):
+        with self.lock:
+            self.advance(int(starttime.timestamp) // 60)
+            columns = [m % self.minutes for m in range(self.last - self.minutes + 1, self.last + 1)]
+            values = numpy.stack([self.buffers[str(name)][:, columns] for name in self.filters])
+            stations = list(self.stations)
+
+        return(stations, values)
+
+
+""" Reads the minutes first to last (minutes since the epoch, both on the day of date) of a filter from the day files.
+    Returns a list of (minute, dictionary of station -> RSAM).
 """
-def define_data_range(windows, time):
+def read_day_minutes(date, f, channel, first, last):
+    result = []
+    file_path = common.logger_output_path(date) + common.generate_tremvlog_filename(date, f, channel)
+
+    if(os.path.exists(file_path)):
+        data = common.read_tremvlog_file(file_path)
+        timestamps = common.read_tremvlog_timestamps(file_path)
 
-    sta_window_start = windows[0][0]
-    lta_window_start = windows[1][0]
+        for i in range(0, len(timestamps)):
+            minute = int(UTCDateTime(timestamps[i]).timestamp) // 60
 
-    data_range = [] # list of time range with relevant data. Only more than len=1 if windows overlap day boundary
-    if(str(lta_window_start)[8:10] != str(time)[8:10]):
-        data_range.append(lta_window_start)
-    elif(str(sta_window_start)[8:10] != str(time)[8:10]):
-        data_range.append(lta_window_start)
+            if(first <= minute <= last):
+                values = {}
+                for name in data:
+                    values[name] = data[name][i]
+                result.append((minute, values))
 
-    data_range.append(time) # appending time here so that an older date would be first in the list
-    return(data_range)
+        return(result)
 
+    day_first = int(date.timestamp) // 60
+    data = daystore.read_tremvlog_day(date, f, channel, first - day_first, last - day_first + 1)
 
-""" Reads csv files and returns two dictionaries -- one for the sta window and one for the lta window.
-    Dictionaries span the time of windows (in min) defined in the alert_config.json configuration file.
-    Returns dictionaries in relevant time range for each filter.
+    if(data is not None):
+        for minute in range(first, last + 1):
+            values = {}
+            for name in data:
+                if(minute - first < len(data[name])):
+                    values[name] = data[name][minute - first]
+            result.append((minute, values))
+
+    return(result)
+
+
+""" Returns the rolling window for the filters and channel, sized for alert_config. A new window is made and filled
+    from the day files up to starttime when there is none yet, or when the filters, channel or window lengths changed.
+    Returns (window, True if the window was just made and filled).
 """
-def read_data(filters, data_range, station_channel):
+def rolling_window(alert_config, filters, channel, starttime):
+    minutes = window_minutes(alert_config)
 
-    data_dicts = {}
+    if(AlertInfo.window is None or not AlertInfo.window.matches(minutes, filters, channel)):
+        window = rollingWindow(minutes, filters, channel)
+        window.warm(starttime)
+        AlertInfo.window = window
+        return(window, True)
+
+    return(AlertInfo.window, False)
 
-    # reads csv files...
-    for i in range(0, len(filters)):
-        filter_name = str(filters[i])
 
-        data = {}
-        for j in range(0, len(data_range)): # one or two days worth of data
-            path = common.logger_output_path(data_range[j])
-            file = common.generate_tremvlog_filename(data_range[j], filters[i], station_channel)
-            file_path = path+file
-
-            min_past_midnight = int(str(data_range[j])[11:13]) * 60 + int(str(data_range[j])[14:16]) + 1
-
-            data1 = {}
-            station_names1 = []
-
-            if(os.path.exists(file_path)):
-                if(len(data_range) == 1): # if only one day for data
-                    all_data = common.read_tremvlog_file(file_path)
-                    data = {}
-
-                    for name in all_data:
-                        data[name] = all_data[name][0:min_past_midnight]
-
-                else: # if two days for data
-                    if(j == 0):
-                        timestamps1 = common.read_tremvlog_timestamps(file_path) # reads prev day file timestamps
-                        station_names1 = common.read_tremvlog_stations(file_path) # reads prev day file stations
-                        missing_min = 1440 - len(timestamps1) # notes how many mins of data are missing from first file
-                        data1 = common.read_tremvlog_file(file_path)
-
-                        # Assuming that the file has all timestamps from start of day until a single stopping minute...
-                        for k in range(0,missing_min):
-                            for name in station_names1:
-                                data1[name].append(0.0)
-
-                    if(j > 0): # if averaging window/s span two days
-                        timestamps2 = common.read_tremvlog_timestamps(file_path) # reads prev day file timestamps
-                        station_names2 = common.read_tremvlog_stations(file_path)
-
-                        # only reads first x minutes of second (current day) file (up to current starttime)
-                        all_data2 = common.read_tremvlog_file(file_path)
-                        data2 = {}
-
-                        for name in all_data2:
-                            data2[name] = all_data2[name][0:min_past_midnight]
-
-                        # checks if stations are same for both days, if not, add empty data for first day missing stat
-                        for name in station_names1:
-                            if(name not in station_names2):
-                                add_zero_data = []
-                                for r in range(0, len(timestamps2)):
-                                    add_zero_data.append(0.0)
-                                data2[name] = add_zero_data
-
-                        # checks if stations are same for both days, if not, add empty data for second day missing stat
-                        for name in station_names2:
-                            if(name not in station_names1):
-                                add_zero_data = []
-                                for r in range(0, 1440):
-                                    add_zero_data.append(0.0)
-                                data1[name] = add_zero_data
-
-                        # combine dictionaries for first and second days
-                        data = {}
-                        for k in data1.keys():
-                            data.update({k: []})
-                            for m in data1[k]:
-                                data[k].append(m)
-                            for n in data2[k]:
-                                data[k].append(n)
-
-        data_dicts[filter_name] = data
-
-    return(data_dicts)
+""" Pushes a minute of RSAM results into the rolling window, if there is one for the filters and channel.
+    Used for minutes that are written outside the minute loop, e.g. by the backfill.
+"""
+def push_minute(starttime, filters, channel, rsam_results):
+    window = AlertInfo.window
+
+    if(window is not None and window.filters == filters and window.channel == channel):
+        window.push(starttime, rsam_results)
 
 
 """ Removes stations specified in remove_stations variable in config file so they aren't included in data processing.
-    Returns a dictionary of data with specified stations removed.
+    Returns the stations and the rows of values (filters x stations x minutes) that are left.
 """
-def remove_stat(filters, data_dict, remove_stat):
+def remove_stat(stations, values, remove_stat):
 
-    for i in range(0, len(filters)):
-        filter_name = str(filters[i])
+    removed = set(remove_stat)
+    rows = [i for i in range(0, len(stations)) if stations[i] not in removed]
+
+    return([stations[i] for i in rows], values[:, rows])
 
-        for name in remove_stat:
-            try:
-                data_dict[filter_name].pop(name)
-            except:
-                pass
 
-    return(data_dict)
+""" The kernels below work on RSAM with the minutes on the last axis (e.g. filters x stations x minutes, oldest minute first)
+    and evaluate the alerts for each of the last count minutes, the minutes before them being their history.
+    The live alerts run them for the current minute (count 1) and sweep.py for a week of minutes at a time.
+"""
 
 
-""" Splits the data dictionaries from read_data() to the appropriate time windows for the STA and LTA.
-    Returns a list of two lists--for STA data and LTA data --each containing the list of dictionaries for each filter.
+""" Sums the minutes newest to oldest back (0 is the minute itself) of each of the last count minutes of values.
+    The minutes are added oldest first, or newest first with newest_first, one after the other,
+    so the sums are the same to the last bit whatever count is.
 """
-def split_data(data, sta_length, lta_length, avg_length, ramp_int, filters):
+def window_sum(values, count, newest, oldest, newest_first=False):
 
-    sta_min = int((sta_length+60)/60) # convert back to min from sec
-    lta_min = int((lta_length+60)/60)
+    end = values.shape[-1]
+    offsets = list(range(oldest, newest - 1, -1))
+    if(newest_first):
+        offsets.reverse()
 
-    sta_data = {}
-    lta_data = {}
-    ramp_data = {}
-    velocity_data = {}
+    result = values[..., end - count - offsets[0]:end - offsets[0]].copy()
+    for offset in offsets[1:]:
+        result += values[..., end - count - offset:end - offset]
 
-    for i in range(0, len(filters)):
-        filter_name = str(filters[i])
-        sta_data_dict = {}
-        lta_data_dict = {}
-        ramp_data_dict = {}
-        velocity_data_dict = {}
-
-        for name in data[filter_name]:
-            sta_data_list = []
-            lta_data_list = []
-            ramp_data_list = []
-
-            for j in range(1, sta_min+1):
-                sta_data_list.append(data[filter_name][name][-j])
-            for k in range(1, lta_min+1):
-                lta_data_list.append(data[filter_name][name][-k-sta_min]) # end of sta window - k
-            for l in range(1, avg_length*ramp_int+1):
-                ramp_data_list.append(data[filter_name][name][-l])
-            velocity_data_dict[name] = data[filter_name][name][-1]
-
-            # assigns data to station and reverses list of data so it's in correct order (earliest to latest)
-            sta_data_dict[name] = sta_data_list[::-1]
-            lta_data_dict[name] = lta_data_list[::-1]
-            ramp_data_dict[name] = ramp_data_list[::-1]
-
-        sta_data[filter_name] = sta_data_dict
-        lta_data[filter_name] = lta_data_dict
-        ramp_data[filter_name] = ramp_data_dict
-        velocity_data[filter_name] = velocity_data_dict
-
-    AlertInfo.sta = sta_data
-    AlertInfo.lta = lta_data
-    AlertInfo.ramp = ramp_data
-    AlertInfo.current_velocity = velocity_data
-
-
-""" For each station (and each filter), averages RSAM values for each station within long and short windows.
-    Returns list of dictionaries (one per filter) of STA and LTA averages for each station.
+    return(result)
+
+
+""" The number of minutes with data (not 0.0) up to each minute of values, with a 0 in front.
+    Used by window_average to count the minutes with data in a window with one subtraction.
 """
-def avg_windows(data_percent, filters):
+def data_counts(values):
 
-    data = [AlertInfo.sta, AlertInfo.lta]
+    present = numpy.zeros(values.shape[:-1] + (values.shape[-1] + 1,), dtype=numpy.int64)
+    numpy.cumsum(values != 0.0, axis=-1, out=present[..., 1:])
 
-    for i in range(0, len(data)): # len 2, position 0 for sta & position 1 for lta
-        for j in range(0, len(filters)):
-            filter_name = str(filters[j])
+    return(present)
 
-            for name in data[i][filter_name]:
-                list_to_avg = data[i][filter_name][name]
-                list_sum = 0
-                length = 0 # length of data to be averaged
 
-                for k in range(0, len(list_to_avg)):
+""" Averages the RSAM of the minutes newest to oldest back of each of the last count minutes, present being data_counts(values).
+    Minutes without data (0.0) are left out, and a window is only averaged if at least data_percent of it has data.
+    Returns (averages, mask of the averaged windows), both ... x count.
+"""
+def window_average(values, present, count, newest, oldest, data_percent):
 
-                    if(str(list_to_avg[k]) != "0.0"):
-                        #list_sum += numpy.log(list_to_avg[k])
-                        list_sum += list_to_avg[k]
-                        length += 1
+    end = present.shape[-1]
+    length = present[..., end - count - newest:end - newest] - present[..., end - count - oldest - 1:end - oldest - 1] # length of data to be averaged
+    list_sum = window_sum(values, count, newest, oldest)
+    data_percent_used = (length/(oldest - newest + 1))*100
 
-                data_percent_used = (length/len(list_to_avg))*100
+    averaged = (length != 0) & (data_percent_used >= data_percent)
+    avg = numpy.where(averaged, list_sum/numpy.maximum(length, 1), numpy.nan)
 
-                # redefines AlertInfo.sta and AlertInfo.lta list as average (with natural log applied before)
-                if(length != 0 and data_percent_used >= data_percent):
-                    avg = list_sum/length
-                    data[i][filter_name][name] = avg
-                else:
-                    data[i][filter_name][name] = None
+    return(avg, averaged)
 
 
-""" Calculates sta/lta ratio for each station from avg_windows() data.
-    Returns list of dictionaries (one per filter) of the sta/lta ratio at each station.
+""" Calculates sta/lta ratio for each station from window_average() data, for the stations that have both averages.
+    Returns (ratios, mask of the stations with a ratio).
 """
-def calc_ratio(filters):
+def calc_ratio(sta, sta_averaged, lta, lta_averaged):
 
-    sta = AlertInfo.sta
-    lta = AlertInfo.lta
+    has_ratio = sta_averaged & lta_averaged
 
-    ratio = {}
-    for i in range(0, len(filters)):
-        filter_name = str(filters[i])
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        ratio = numpy.where(has_ratio, sta/lta, numpy.nan)
 
-        ratio_dict = {}
+    return(ratio, has_ratio)
 
-        for name in sta[filter_name]:
-            if(sta[filter_name][name] != None and lta[filter_name][name] != None):
-                ratio_dict[name] = (sta[filter_name][name])/(lta[filter_name][name])
-        ratio[filter_name] = ratio_dict
 
-    AlertInfo.ratio_values = ratio
+""" Averages the ramp of each of the last count minutes in intervals of avg_length minutes, counted back from the minute.
+    Returns a list with the averages (... x count) of each interval, oldest interval first.
+"""
+def make_ramp(values, count, avg_length, ramp_int):
 
+    intervals = len(range(1, ramp_int * avg_length, avg_length))
+    if(intervals == 0):
+        return([])
 
-""" Checks most recent sta ratio values (in ring buffer) to see if most recent is higher than first (or in steps?).
-    Checking first value (ratio recorded x minutes earlier) versus current value -- only important for new trigger.
-"""
-def make_ramp(avg_length, ramp_int, filters):
+    extra = (intervals - 1) * avg_length
 
-    data = AlertInfo.ramp
-    ramp_dict = {}
+    # the averages of the newest interval from the oldest interval of the first minute on, each summed from its newest minute back
+    averages = window_sum(values, count + extra, 0, avg_length - 1, True) / avg_length
+
+    return([averages[..., extra - b * avg_length:extra - b * avg_length + count] for b in range(intervals - 1, -1, -1)])
 
-    for name in filters:
-        filter_name = str(name)
-        ring_buffer_dict = {}
-        for station in data[filter_name]:
-            buffer_averages = []
 
-            i = 1
-            while i < (ramp_int * avg_length):
-                sum_num = 0
-                for j in range(0, avg_length):
-                    sum_num += data[filter_name][station][-i]
-                    i += 1
+""" Whether each ramp interval average is higher than the one before, or None when there are fewer than two intervals.
+"""
+def ramp_rising(ramp):
 
-                avg_num = sum_num / avg_length
-                buffer_averages.insert(0, avg_num)
+    if(len(ramp) < 2):
+        return(None)
 
-            ring_buffer_dict[station] = buffer_averages
-        ramp_dict[filter_name] = ring_buffer_dict
+    rising = ramp[1] > ramp[0]
+    for b in range(2, len(ramp)):
+        rising &= ramp[b] > ramp[b - 1]
 
-    AlertInfo.ramp_buffer = ramp_dict
+    return(rising)
 
 
-""" Assigns boolean True or False to each station for each filter, True if ratio above trigger ratio, False if below.
-    Counts number of stations that are triggered (aka stations assigned True).
-    Returns list with list of dictionaries (one per filter) of True/False and list of number of votes (one per filter).
+""" Runs the STA/LTA and the ramp with the window settings of alert_config for each of the last count minutes of values.
+    Returns (sta, sta_averaged, lta, lta_averaged, ratio, has_ratio, ramp, rising, velocity), see the functions above.
 """
-def stat_voting(trigger_ratio, min_velocity):
+def alert_windows(values, count, alert_config):
 
-    stat_triggered = {}
-    trig_votes = {}
+    sta_min = alert_config["sta_length"]
+    lta_min = alert_config["lta_length"]
+    present = data_counts(values)
+
+    # the lta window ends where the sta window starts
+    sta, sta_averaged = window_average(values, present, count, 0, sta_min - 1, alert_config["percentage_data"])
+    lta, lta_averaged = window_average(values, present, count, sta_min, sta_min + lta_min - 1, alert_config["percentage_data"])
+    ratio, has_ratio = calc_ratio(sta, sta_averaged, lta, lta_averaged)
+
+    # checks that ramp exists before eruption
+    ramp = make_ramp(values, count, alert_config["ramp_min_avg"], alert_config["ramp_intervals"])
+    rising = ramp_rising(ramp)
+
+    velocity = values[..., values.shape[-1] - count:]
 
-    ratios = AlertInfo.ratio_values
-    ramp_dict = AlertInfo.ramp_buffer
-    velocities = AlertInfo.current_velocity
+    return(sta, sta_averaged, lta, lta_averaged, ratio, has_ratio, ramp, rising, velocity)
 
-    for filter_name in ratios:
-        trigger_dict = {} # dictionary with boolian
-        trig_vote = 0
-        for name in ratios[filter_name]:
 
-            # checks that most recent velocity is at or above velocity threshold
-            if(velocities[filter_name][name] >= min_velocity):
+""" Decides for each station with a ratio whether it is triggered: the current velocity is at or above min_velocity,
+    the ratio at or above trigger_ratio and the ramp is rising (ramp_rising).
+    A station that passes the first two checks but has fewer than two ramp intervals to compare gets no verdict.
+    Returns (triggered, mask of the stations with a verdict).
+"""
+def stat_voting(ratio, has_ratio, rising, velocity, trigger_ratio, min_velocity):
 
-                # checks that sta/lta ratio above trigger ratio
-                if(ratios[filter_name][name] >= trigger_ratio):
+    above = has_ratio & (velocity >= min_velocity) & (ratio >= trigger_ratio)
 
-                    i = 1
-                    while i < len(ramp_dict[filter_name][name]):
+    if(rising is None):
+        return(numpy.zeros(above.shape, dtype=bool), has_ratio & ~above)
 
-                        # checks that each most recent ramps interval average is higher than previous
-                        if(ramp_dict[filter_name][name][-i] > ramp_dict[filter_name][name][-i - 1]):
-                            i += 1
+    return(above & rising, has_ratio)
 
-                            if(i == len(ramp_dict[filter_name][name])):
-                                trigger_dict[name] = True
-                                trig_vote += 1
 
-                        else:
-                            trigger_dict[name] = False
-                            break
+""" Puts the per station triggers into AlertInfo.station_trigger, a dictionary (one per filter) of station -> True/False,
+    and returns a dictionary of filter -> number of votes.
+"""
+def station_triggers(filters, stations, triggered, decided):
 
-                else:
-                    trigger_dict[name] = False
+    stat_triggered = {}
+    trig_votes = {}
 
-            else:
-                trigger_dict[name] = False
+    for i in range(0, len(filters)):
+        filter_name = str(filters[i])
+        trigger_dict = {}
+
+        for j in numpy.flatnonzero(decided[i]):
+            trigger_dict[stations[j]] = bool(triggered[i, j])
 
         stat_triggered[filter_name] = trigger_dict
-        trig_votes[filter_name] = trig_vote
+        trig_votes[filter_name] = int(triggered[i].sum())
 
-    AlertInfo.station_trigger = stat_triggered # list of dictionaries (one per filter) with bool if station triggered
+    AlertInfo.station_trigger = stat_triggered
 
-    votes = trig_votes
-    return(votes)
+    return(trig_votes)
 
 
 """ For each filter, checks if enough stations are triggered to set alert_on to TRUE (if alert_on currently FALSE).
@@ -380,122 +437,51 @@ def trigger(vote, votes_needed):
     AlertInfo.filters_triggered = triggered_filters_dict
 
 
-""" Creates new event in catalog and new file, if necessary. Returns event_info (for filter, give time & eventID).
+""" Returns the catalog store, opened the first time it is needed.
 """
-def catalog_new_event(current_time, current_filter, current_info, previous_info, current_stations, line_one, delim):
-
-    # defines file path of new catalog (or of existing catalog) based on current time
-    cat_path = ("tremor_catalog/" + str(current_time.year) + "/")
-    if (os.path.exists(cat_path) == False):
-        os.makedirs(cat_path)
-
-    month = str(current_time.month)
-    year = str(current_time.year)
+def catalog_store():
+    if(AlertInfo.catalog is None):
+        AlertInfo.catalog = catalog.catalogStore()
 
-    filename = year + "." + month + "_tremor_catalog.txt"
-    file_path = cat_path + filename
+    return(AlertInfo.catalog)
 
-    if (os.path.exists(file_path) == False):
-        catalog = open(file_path, "w+")
-        catalog.write(line_one)
-        catalog.close()
 
-    catalog = open(file_path, "r")
-    lines = catalog.readlines()  # previous event ID
-    prevID = (lines[-1]).split()[0]
+""" Creates new event in catalog. Returns event_info (for filter, give time & eventID).
+"""
+def catalog_new_event(current_time, current_filter, current_info, previous_info, current_stations):
 
-    # define new event ID for new event (add 1 to old event ID)
-    # HANDLE if over year or month boundary
-    if(prevID == "EventID"):
-        eventID = 1
-    else:
-        eventID = int(prevID) + 1
+    # event IDs start at 1 every month
+    eventID = catalog_store().new_event(current_time, current_filter, current_stations)
 
     current_info[current_filter] = [eventID, current_time]
     previous_info[current_filter] = [eventID, current_time]
 
-    # remove " " and "'" from station and filter strings to avoid future reading issues (i.e. .split())
-    characters_to_remove = " '[]"
-    current_stations.sort()
-    stations = str(current_stations)
-    for character in characters_to_remove:
-        stations = stations.replace(character, "")
-
-    write_filter = str(current_filter).replace(" ", "")
-
-    # allotted space for written variables (somewhat arbitrary, but nice for reading)
-    """
-    id_space = (7 - len(str(eventID))) * " " + delim
-    time_space = (27 - len(str(current_time))) * " " + delim
-    filter_space = (12 - len(str(write_filter))) * " " + delim
-    """
-
-    catalog = open(file_path, "a")
-    catalog.write(str(eventID) + delim + str(current_time) + delim + str(write_filter) + delim +
-                  str(stations) + "\n")
-    catalog.close()
-
     AlertInfo.previous_eventID = previous_info
     AlertInfo.alert_on[current_filter] = True  # for a filter, set alert_on to True (preserves state for next run)
     return(current_info)
 
 
-""" Adds newly triggered stations for event to currently triggered event line in catalog.
+""" Adds newly triggered stations for event to currently triggered event in catalog.
 """
-def catalog_edit_event(current_filter, current_stations, alert_on, line_one, delim):
+def catalog_edit_event(current_filter, current_stations, alert_on):
 
     time = AlertInfo.current_eventID[current_filter][1]  # if filt already triggered, tries reading event id & starttime
     eventID = AlertInfo.current_eventID[current_filter][0]
 
-    # must do this in case the file with currently triggered event is different month or year!
-    cat_path = ("tremor_catalog/" + str(time.year) + "/")
-    if(os.path.exists(cat_path) == False):
-        os.makedirs(cat_path)
-
-    month = str(time.month)
-    year = str(time.year)
-
-    filename = year + "." + month + "_tremor_catalog.txt"
-    file_path = cat_path + filename
+    # the event is found by its starttime, in case the currently triggered event is from a different month or year
+    catalog_store().add_stations(time, eventID, current_stations)
 
-    catalog = open(file_path, "r")
-    lines = catalog.readlines()[1:]  # previous event ID
-    rewrite_lines = [line_one]
-
-    for line in lines:
-        split_line = line.split(delim)
-        if(int(split_line[0]) == int(eventID)):  # checks for line with previous eventID
-            previous_stations = split_line[3].rstrip()
-            previous_stations = previous_stations.split(",")
-
-            for station in current_stations:
-                if station not in previous_stations:
-                    previous_stations.append(station)
-            previous_stations.sort()
-
-            # remove " " and "'" from station and filter strings to avoid future reading issues (i.e. .split())
-            characters_to_remove = " '[]"
-            stations = str(previous_stations)
-            for character in characters_to_remove:
-                stations = stations.replace(character, "")
-
-            #line = str(line[0:58]) + str(stations) + "\n" please don't do this
-            line = split_line[0] + delim + split_line[1] + delim + split_line[2] + delim + str(stations) + "\n"
+    alert_on[current_filter] = True
 
-        rewrite_lines.append(line)
-    catalog.close()
 
-    temp_path = file_path + "temp"
-    catalog = open(temp_path, "w")
-    catalog.writelines(rewrite_lines)
-    catalog.close()
+""" Tells the catalog that the currently triggered event of the filter has ended.
+"""
+def catalog_close_event(current_filter):
 
-    # swap files
-    os.rename(file_path, file_path + "old")
-    os.rename(temp_path, file_path)
-    os.remove(file_path + "old")
+    time = AlertInfo.current_eventID[current_filter][1]
+    eventID = AlertInfo.current_eventID[current_filter][0]
 
-    alert_on[current_filter] = True
+    catalog_store().close_event(time, eventID)
 
 
 """ Creates catalogue of tremor events.
@@ -506,14 +492,6 @@ def write_catalog(time, filters, minimum_event_gap):
     AlertInfo.alert_on_redefine(filters, AlertInfo.alert_on)
     alert_status = AlertInfo.alert_on
 
-    # currently hardcoded, allows proper space for more than enough events per month
-    #s = "    "
-    #s = "    "
-    #first_line = "EventID" + s + "TriggerTime                " + s + "Filter      " + s + "Stations\n"
-    #NOTE(thordur): I changed this to facilitate programmatic reading of the catalog files(i.e. reading them to a dict)
-    delim = "\t"
-    first_line = "EventID" + delim + "TriggerTime" + delim + "Filter" + delim + "Stations\n"
-
     event_info = AlertInfo.current_eventID
 
     audio = {}
@@ -539,20 +517,20 @@ def write_catalog(time, filters, minimum_event_gap):
                         alert_status[filter_name] = True
                         event_info[filter_name] = prev_info[filter_name]
                         AlertInfo.current_eventID = event_info
-                        catalog_edit_event(filter_name, stations, alert_status, first_line, delim)
+                        catalog_edit_event(filter_name, stations, alert_status)
                         audio[filter_name] = False
                     else:
                         # returns event_info for AlertInfo.current_event_id
-                        event_info = catalog_new_event(time, filter_name, event_info, prev_info, stations, first_line, delim)
+                        event_info = catalog_new_event(time, filter_name, event_info, prev_info, stations)
                         audio[filter_name] = True  # sets audio alarm dictionary to true for given minute
                 except:
                     # returns event_info for AlertInfo.current_event_id
-                    event_info = catalog_new_event(time, filter_name, event_info, prev_info, stations, first_line, delim)
+                    event_info = catalog_new_event(time, filter_name, event_info, prev_info, stations)
                     audio[filter_name] = True  # sets audio alarm dictionary to true for given minute
 
             elif(alert_status[filter_name] == True):
                 # read most recent event ID for this filter and check if new stations must be added to this event
-                catalog_edit_event(filter_name, stations, alert_status, first_line, delim)
+                catalog_edit_event(filter_name, stations, alert_status)
                 audio[filter_name] = False
 
         elif(triggered_filters[filter_name] == False):
@@ -560,6 +538,7 @@ def write_catalog(time, filters, minimum_event_gap):
             if(alert_status[filter_name] == False):
                 alert_status[filter_name] = False
             elif(alert_status[filter_name] == True):
+                catalog_close_event(filter_name)
                 event_info.pop(filter_name)
                 alert_status[filter_name] = False
             audio[filter_name] = False
@@ -629,32 +608,38 @@ def ring_audio_alarm(filters, max_audio, time):
     return(ring_alarm)
 
 
-def main(starttime, logger_filters, channel, alert_hook=None):
+""" Runs the alerts for the minute that starts at starttime.
+    rsam_results are the logger's results for that minute (a list with one dictionary of station -> RSAM per filter),
+    which go into the rolling window. Without them the window is filled from the day files again.
+"""
+def main(starttime, logger_filters, channel, alert_hook=None, rsam_results=None):
     alert_config = common.config("alert_config.json")
 
     AlertInfo.filter_list = logger_filters # import filters in data structure from tremv_logger
 
-    # window length in min (because cannot be smaller than 1 minute) -- config file in min, this var in sec
-    sta_len = alert_config["sta_length"]*60-60
-    # * 60 to convert to sec, minus 60 because already includes data from current minute
-    lta_len = alert_config["lta_length"]*60-60
+    # recent data from the rolling window as filters x stations x minutes, evaluated for the current minute
+    window, created = rolling_window(alert_config, logger_filters, channel, starttime)
 
-    # read data, split data to sta and lta windows
-    time_windows = define_windows(starttime, sta_len, lta_len)
-    time_range = define_data_range(time_windows, starttime)
-    data_dictionary = read_data(logger_filters, time_range, channel)
-    updated_data_dict = remove_stat(logger_filters, data_dictionary, alert_config["remove_stations"])
-    split_data(updated_data_dict, sta_len, lta_len, alert_config["ramp_min_avg"], alert_config["ramp_intervals"],
-               logger_filters)
+    if(rsam_results is not None):
+        window.push(starttime, rsam_results)
+    elif(not created):
+        window.warm(starttime)
 
-    # checks that ramp exists before eruption
-    make_ramp(alert_config["ramp_min_avg"], alert_config["ramp_intervals"], logger_filters)
+    stations, values = window.matrix(starttime)
+    stations, values = remove_stat(stations, values, alert_config["remove_stations"])
+    sta, sta_averaged, lta, lta_averaged, ratio, has_ratio, ramp, rising, velocity = alert_windows(values, 1, alert_config)
+
+    # checks that sta/lta trigger ratio is satisfied and that ramp exists before eruption
+    triggered, decided = stat_voting(ratio, has_ratio, rising, velocity, alert_config["trigger_ratio"], alert_config["min_velocity"])
+    voting = station_triggers(logger_filters, stations, triggered[..., 0], decided[..., 0])
 
-    # checks that sta/lta trigger ratio is satisfied
-    avg_windows(alert_config["percentage_data"], logger_filters)
-    calc_ratio(logger_filters)
+    AlertInfo.stations = stations
+    AlertInfo.sta = sta[..., 0]
+    AlertInfo.lta = lta[..., 0]
+    AlertInfo.ratio_values = ratio[..., 0]
+    AlertInfo.ramp_buffer = numpy.concatenate([numpy.zeros(values.shape[:-1] + (0,))] + ramp, axis=-1) # one column per interval
+    AlertInfo.current_velocity = velocity[..., 0]
 
-    voting = stat_voting(alert_config["trigger_ratio"], alert_config["min_velocity"])
     trigger(voting, alert_config["station_votes"])
     write_catalog(starttime, logger_filters, alert_config["minimum_min_between_events"])
 
@@ -0,0 +1,364 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+import multiprocessing
+import numpy
+import obspy
+from obspy import UTCDateTime
+from obspy.core.inventory import Inventory, Network, Station, Channel, Response, InstrumentSensitivity
+import logger
+
+"""
+Measures how the per minute processing of the logger scales with the number of stations and bandpass filters,
+on synthetic data and without any network access.
+Each case times process_station_data, response_correction, apply_bandpass_filters, rsam_processing and
+write_tremvlog_file separately, and the whole minute end to end. The results are written as JSON,
+so that runs from different versions can be compared with --compare.
+Every case is run with each of the dsp modes (station_dsp and station_dsp_float32), with the peak memory
+allocated during a minute measured with tracemalloc, and the rsam values of the modes are compared.
+Each case runs in a new process, so the peak RSS of a case is its own and not that of the biggest case before it.
+
+Usage:
+    python3 benchmark.py --stations 10,50,100,200 --bands 1,3,6 --output benchmark.json
+    python3 benchmark.py --dsp-modes standard,float32 --stations 100 --bands 6
+    python3 benchmark.py --compare benchmark_old.json --output benchmark.json
+"""
+
+NETWORK = "XX"
+SAMPLING_RATE = 100.0
+
+
+def station_names(count):
+    result = []
+    for i in range(0, count):
+        result.append("S%03d" % i)
+
+    return(result)
+
+
+"""
+Bandpass filters between 0.5 and 8 Hz, split evenly on a log scale.
+"""
+def generate_filters(count):
+    edges = numpy.geomspace(0.5, 8.0, count + 1)
+    result = []
+
+    for i in range(0, count):
+        result.append([round(float(edges[i]), 3), round(float(edges[i + 1]), 3)])
+
+    return(result)
+
+
+"""
+A minute of noise in counts for each station, with the same length as a seedlink request for a minute returns.
+"""
+def generate_stream(names, starttime, seed=0):
+    rng = numpy.random.default_rng(seed)
+    traces = []
+
+    for name in names:
+        header = {"network": NETWORK, "station": name, "location": "", "channel": "HHZ", "sampling_rate": SAMPLING_RATE, "starttime": starttime}
+        data = (rng.normal(size=int(SAMPLING_RATE * 60) + 1) * 1000).astype(numpy.int32)
+        traces.append(obspy.Trace(data, header=header))
+
+    return(obspy.Stream(traces))
+
+
+def generate_sensitivity_table(names):
+    stations = []
+
+    for name in names:
+        channel = Channel("HHZ", "", 64.0, -19.0, 0.0, 0.0, sample_rate=SAMPLING_RATE, start_date=UTCDateTime(2000, 1, 1))
+        channel.response = Response(instrument_sensitivity=InstrumentSensitivity(1e9, 1.0, "M/S", "COUNTS"))
+        stations.append(Station(name, 64.0, -19.0, 0.0, channels=[channel], start_date=UTCDateTime(2000, 1, 1)))
+
+    return(logger.sensitivityTable(Inventory([Network(NETWORK, stations=stations)], "benchmark")))
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else.
+    if(sys.platform == "darwin"):
+        return(peak / (1024 * 1024))
+
+    return(peak / 1024)
+
+
+def summarize(samples):
+    return({"min": min(samples), "median": statistics.median(samples), "max": max(samples)})
+
+
+"""
+Runs one minute through the same steps as station_dsp (or station_dsp_float32) and the write stage, timing each of them.
+
+Returns:
+    (dictionary of step -> seconds, rsam results)
+"""
+def process_minute(stream, filters, sensitivity_table, names, data_starttime, writer, dsp_mode):
+    timings = {}
+    start = time.perf_counter()
+
+    if(dsp_mode == "float32"):
+        rsam_results, missing, step_timings, window_results = logger.station_dsp_float32(stream, filters, sensitivity_table, data_starttime + 60)
+        timings.update(step_timings)
+    else:
+        step_start = time.perf_counter()
+        pre_processed = logger.process_station_data(stream)
+        timings["process_station_data"] = time.perf_counter() - step_start
+
+        step_start = time.perf_counter()
+        pre_processed, missing = logger.response_correction(pre_processed, sensitivity_table, data_starttime + 60)
+        timings["response_correction"] = time.perf_counter() - step_start
+
+        received = []
+        for trace in pre_processed:
+            received.append(trace.stats.station)
+
+        step_start = time.perf_counter()
+        per_filter = logger.apply_bandpass_filters(pre_processed, filters)
+        timings["apply_bandpass_filters"] = time.perf_counter() - step_start
+
+        step_start = time.perf_counter()
+        rsam_results = logger.rsam_processing(per_filter, received)
+        timings["rsam_processing"] = time.perf_counter() - step_start
+
+    step_start = time.perf_counter()
+    logger.write_tremvlog_file(logger.merge_rsam_results([rsam_results], len(filters), names), filters, names, data_starttime, "z", writer)
+    timings["write_tremvlog_file"] = time.perf_counter() - step_start
+
+    timings["end_to_end"] = time.perf_counter() - start
+    return(timings, rsam_results)
+
+
+"""
+Times repeat minutes of a case. Every repeat writes the next minute of the day, so write_tremvlog_file appends like it does in the logger.
+One more minute is then run with tracemalloc on, for the peak memory allocated while processing a minute.
+"""
+def run_case(station_count, band_count, repeat, starttime, dsp_mode="standard"):
+    names = station_names(station_count)
+    filters = generate_filters(band_count)
+    sensitivity_table = generate_sensitivity_table(names)
+    writer = logger.tremvlogWriter()
+    steps = ["process_station_data", "response_correction", "apply_bandpass_filters", "rsam_processing", "write_tremvlog_file", "end_to_end"]
+    samples = {}
+
+    for step in steps:
+        samples[step] = []
+
+    # The first minute creates the files, designs the filter coefficients and allocates the buffers, it isn't counted.
+    for i in range(-1, repeat):
+        data_starttime = starttime + 60 * (i + 1)
+        stream = generate_stream(names, data_starttime, i + 1)
+        timings, rsam_results = process_minute(stream, filters, sensitivity_table, names, data_starttime, writer, dsp_mode)
+
+        if(i < 0):
+            continue
+
+        for step in steps:
+            samples[step].append(timings[step])
+
+    data_starttime = starttime + 60 * (repeat + 1)
+    stream = generate_stream(names, data_starttime, 0)
+    tracemalloc.start()
+    timings, rsam_results = process_minute(stream, filters, sensitivity_table, names, data_starttime, writer, dsp_mode)
+    peak_allocated = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    seconds = {}
+    for step in steps:
+        seconds[step] = summarize(samples[step])
+
+    end_to_end = seconds["end_to_end"]["median"]
+
+    return({
+        "stations": station_count,
+        "bands": band_count,
+        "dsp_mode": dsp_mode,
+        "filters": filters,
+        "repeat": repeat,
+        "seconds": seconds,
+        "stations_per_second": station_count / end_to_end,
+        "budget_fraction": end_to_end / 60.0,
+        "peak_allocated_mb": peak_allocated / (1024 * 1024),
+    }, rsam_results)
+
+
+"""
+Runs a case (see run_case) in the process it is called in, which is a new process for every case,
+and adds its peak RSS and the RSS it started with, before anything of the case was made.
+"""
+def measure_case(workdir, station_count, band_count, repeat, starttime, dsp_mode):
+    os.chdir(workdir)
+    baseline = peak_rss_mb()
+
+    case, rsam_results = run_case(station_count, band_count, repeat, starttime, dsp_mode)
+    case["baseline_rss_mb"] = baseline
+    case["peak_rss_mb"] = peak_rss_mb()
+
+    return(case, rsam_results)
+
+
+"""
+Largest relative difference between the rsam values of two runs over the same minute.
+"""
+def max_relative_difference(results, reference):
+    result = 0.0
+
+    for i in range(0, len(reference)):
+        for station in reference[i]:
+            if(reference[i][station] != 0.0):
+                result = max(result, abs(results[i][station] - reference[i][station]) / abs(reference[i][station]))
+
+    return(result)
+
+
+"""
+Fits end to end seconds = a + b * stations for each dsp mode and band count, and estimates how many stations fit in the 60 second minute.
+"""
+def scaling_curves(cases):
+    result = []
+    groups = sorted(set([(case["dsp_mode"], case["bands"]) for case in cases]))
+
+    for dsp_mode, band_count in groups:
+        points = [(case["stations"], case["seconds"]["end_to_end"]["median"]) for case in cases if case["bands"] == band_count and case["dsp_mode"] == dsp_mode]
+        points.sort()
+        curve = {"dsp_mode": dsp_mode, "bands": band_count, "points": points}
+
+        if(len(points) >= 2):
+            slope, intercept = numpy.polyfit([p[0] for p in points], [p[1] for p in points], 1)
+            curve["seconds_per_station"] = float(slope)
+            curve["fixed_seconds"] = float(intercept)
+            if(slope > 0):
+                curve["stations_in_budget"] = int((60.0 - intercept) / slope)
+
+        result.append(curve)
+
+    return(result)
+
+
+def git_version():
+    try:
+        return(subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip())
+    except Exception:
+        return(None)
+
+
+"""
+Prints the ratio of the median end to end time of each case to the same case in a previous result file.
+"""
+def compare(result, baseline_filename):
+    with open(baseline_filename, "r") as f:
+        baseline = json.load(f)
+
+    old_cases = {}
+    for case in baseline["cases"]:
+        # Result files from before the dsp modes only have the standard mode.
+        old_cases[(case["stations"], case["bands"], case.get("dsp_mode", "standard"))] = case
+
+    print("Compared to " + baseline_filename + " (" + str(baseline.get("version")) + "):")
+
+    for case in result["cases"]:
+        key = (case["stations"], case["bands"], case["dsp_mode"])
+        if(key not in old_cases):
+            continue
+
+        old = old_cases[key]["seconds"]["end_to_end"]["median"]
+        new = case["seconds"]["end_to_end"]["median"]
+        print("  %4d stations %2d bands %-8s: %8.3fs -> %8.3fs (x%.2f)" % (key[0], key[1], key[2], old, new, new / old))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per minute processing of the logger on synthetic data.")
+    parser.add_argument("--stations", default="10,50,100,200", help="comma separated station counts")
+    parser.add_argument("--bands", default="1,3,6", help="comma separated numbers of bandpass filters")
+    parser.add_argument("--repeat", type=int, default=3, help="timed minutes per case")
+    parser.add_argument("--dsp-modes", default="standard,float32", help="comma separated dsp modes, standard and/or float32")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", default=None, help="result file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    station_counts = [int(x) for x in args.stations.split(",")]
+    band_counts = [int(x) for x in args.bands.split(",")]
+    dsp_modes = args.dsp_modes.split(",")
+    output = os.path.abspath(args.output)
+
+    # write_tremvlog_file writes to logger_output in the working directory.
+    workdir = tempfile.mkdtemp(prefix="tremv_benchmark_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+
+    cases = []
+    starttime = UTCDateTime(2020, 1, 1)
+
+    # forkserver children start from a process that has only imported the modules, so each case starts from the same RSS.
+    start_method = "spawn"
+    if("forkserver" in multiprocessing.get_all_start_methods()):
+        start_method = "forkserver"
+    context = multiprocessing.get_context(start_method)
+
+    try:
+        for band_count in band_counts:
+            for station_count in station_counts:
+                reference = None
+
+                for dsp_mode in dsp_modes:
+                    with context.Pool(1) as pool:
+                        case, rsam_results = pool.apply(measure_case, (workdir, station_count, band_count, args.repeat, starttime, dsp_mode))
+                    cases.append(case)
+
+                    # Every mode gets the same data, so the last minute of the first mode is the reference for the others.
+                    if(reference is None):
+                        reference = rsam_results
+                    else:
+                        case["max_relative_difference"] = max_relative_difference(rsam_results, reference)
+
+                    print("%4d stations %2d bands %-8s: %8.3fs per minute (%5.1f%% of the budget), %7.1f stations/s, %6.1f MB allocated per minute, peak rss %.0f MB (%.0f MB at the start)" %
+                          (station_count, band_count, dsp_mode, case["seconds"]["end_to_end"]["median"], case["budget_fraction"] * 100, case["stations_per_second"], case["peak_allocated_mb"], case["peak_rss_mb"], case["baseline_rss_mb"]))
+
+                    if("max_relative_difference" in case):
+                        print("    largest relative difference to %s: %.2e" % (dsp_modes[0], case["max_relative_difference"]))
+
+                starttime += 86400
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+    result = {
+        "version": git_version(),
+        "time": str(UTCDateTime()),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "obspy": obspy.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "cases": cases,
+        "scaling": scaling_curves(cases),
+    }
+
+    for curve in result["scaling"]:
+        if("stations_in_budget" in curve):
+            print("%-8s %2d bands: %.4fs per station, about %d stations fit in a minute" % (curve["dsp_mode"], curve["bands"], curve["seconds_per_station"], curve["stations_in_budget"]))
+
+    with open(output, "w") as f:
+        json.dump(result, f, indent=4)
+
+    if(args.compare is not None):
+        compare(result, args.compare)
+
+
+if(__name__ == "__main__"):
+    main()
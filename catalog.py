@@ -0,0 +1,245 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import os
+import csv
+import glob
+import sqlite3
+import logging
+import threading
+from obspy import UTCDateTime
+
+"""
+The tremor catalog, kept in an SQLite database in the catalog directory (tremor_catalog/catalog.db).
+
+Every event is one row with the EventID, the trigger time, the filter and the stations that have triggered
+during the event. The EventIDs start at 1 every month, as in the text files. A new event is a single insert
+and adding stations to an ongoing event a single update, with indexes on the EventID, the trigger time and the filter.
+
+The tab separated text files (tremor_catalog/YYYY/YYYY.M_tremor_catalog.txt) are still written for whatever
+reads them. A new event is appended to the file of its month as one line. The stations that are added while an event
+goes on are only in the database until the event ends (close_event), then the file of its month is written again
+from the database. The months whose files are behind are kept in the database too (stale_months), so the files of
+events that were going on when the logger stopped are written when the store is opened again. When the database is created, the events in existing text files are imported into it so the
+EventIDs carry on where they were.
+"""
+
+DEFAULT_DIRECTORY = "tremor_catalog"
+DATABASE_FILENAME = "catalog.db"
+
+#NOTE(thordur): Tab separated to facilitate programmatic reading of the catalog files(i.e. reading them to a dict)
+DELIMITER = "\t"
+FIELDS = ["EventID", "TriggerTime", "Filter", "Stations"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    event_id INTEGER NOT NULL,
+    trigger_time TEXT NOT NULL,
+    trigger_timestamp REAL NOT NULL,
+    filter TEXT NOT NULL,
+    stations TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS events_event_id ON events (year, month, event_id);
+CREATE INDEX IF NOT EXISTS events_trigger_time ON events (trigger_timestamp);
+CREATE INDEX IF NOT EXISTS events_filter ON events (filter, trigger_timestamp);
+CREATE TABLE IF NOT EXISTS stale_months (
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    PRIMARY KEY (year, month)
+);
+"""
+
+
+""" Filter as it is written in the catalog, e.g. "[0.5,1.0]".
+"""
+def filter_string(f):
+    return(str(f).replace(" ", ""))
+
+
+""" Stations as they are written in the catalog, sorted and comma separated.
+"""
+def stations_string(stations):
+    return(",".join(sorted(stations)))
+
+
+def generate_text_filename(year, month):
+    return(str(year) + "/" + str(year) + "." + str(month) + "_tremor_catalog.txt")
+
+
+class catalogStore:
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, export_text=True):
+        self.directory = directory
+        self.export_text = export_text
+        self.lock = threading.Lock()
+
+        if(not os.path.exists(directory)):
+            os.makedirs(directory)
+
+        filename = os.path.join(directory, DATABASE_FILENAME)
+        new_database = not os.path.exists(filename)
+
+        # The logger writes and the server reads from another process, WAL lets the server read while an event is written.
+        self.connection = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+        if(new_database):
+            self.import_text_files()
+
+        self.export_stale()
+
+    """ Imports the events of the text files in the catalog directory, for catalogs from before the database.
+    """
+    def import_text_files(self):
+        count = 0
+
+        with self.lock, self.connection:
+            for path in sorted(glob.glob(os.path.join(self.directory, "*", "*_tremor_catalog.txt"))):
+                year, month = os.path.basename(path).split("_")[0].split(".")
+
+                with open(path) as catalog_file:
+                    for entry in csv.DictReader(catalog_file, delimiter=DELIMITER):
+                        self.connection.execute("INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                                (int(year), int(month), int(entry["EventID"]), entry["TriggerTime"],
+                                                 UTCDateTime(entry["TriggerTime"]).timestamp, entry["Filter"], entry["Stations"].strip()))
+                        count += 1
+
+        if(count > 0):
+            logging.info("Imported " + str(count) + " events from the text catalogs into " + DATABASE_FILENAME + ".")
+
+    """ Adds an event that triggered at time (UTCDateTime) and returns its EventID, the next one of the month.
+    """
+    def new_event(self, time, f, stations):
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT MAX(event_id) FROM events WHERE year = ? AND month = ?", (time.year, time.month)).fetchone()
+            event_id = 1
+            if(row[0] is not None):
+                event_id = row[0] + 1
+
+            self.connection.execute("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (time.year, time.month, event_id, str(time), time.timestamp, filter_string(f), stations_string(stations)))
+
+        self.append_event(time.year, time.month, [str(event_id), str(time), filter_string(f), stations_string(stations)])
+        return(event_id)
+
+    """ Adds the stations that aren't in it yet to the event of the month of time (UTCDateTime, the trigger time of the event).
+        The text file of the month is written when the event ends, see close_event.
+        Returns True if the event changed.
+    """
+    def add_stations(self, time, event_id, stations):
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT stations FROM events WHERE year = ? AND month = ? AND event_id = ?", (time.year, time.month, event_id)).fetchone()
+            if(row is None):
+                return(False)
+
+            previous_stations = [name for name in row["stations"].split(",") if name != ""]
+            new_stations = [name for name in stations if name not in previous_stations]
+            if(len(new_stations) == 0):
+                return(False)
+
+            self.connection.execute("UPDATE events SET stations = ? WHERE year = ? AND month = ? AND event_id = ?",
+                                    (stations_string(previous_stations + new_stations), time.year, time.month, event_id))
+            self.connection.execute("INSERT OR IGNORE INTO stale_months VALUES (?, ?)", (time.year, time.month))
+
+        return(True)
+
+    """ Called when the event of the month of time (UTCDateTime, the trigger time of the event) has ended.
+        Writes the text file of the month again if stations were added to any of its events.
+    """
+    def close_event(self, time, event_id):
+        self.export_stale(set([(time.year, time.month)]))
+
+    """ Writes the text files of the months in months (all of them by default) that are behind the database.
+    """
+    def export_stale(self, months=None):
+        if(not self.export_text):
+            return
+
+        with self.lock:
+            stale = set([(row["year"], row["month"]) for row in self.connection.execute("SELECT year, month FROM stale_months").fetchall()])
+
+        if(months is not None):
+            stale = stale & months
+
+        for year, month in sorted(stale):
+            # Cleared before the export, so stations added while the file is written mark the month again.
+            with self.lock, self.connection:
+                self.connection.execute("DELETE FROM stale_months WHERE year = ? AND month = ?", (year, month))
+
+            try:
+                self.export_month(year, month)
+            except Exception:
+                with self.lock, self.connection:
+                    self.connection.execute("INSERT OR IGNORE INTO stale_months VALUES (?, ?)", (year, month))
+                raise
+
+    """ The events as dictionaries with the catalog fields, all strings as in the text files.
+    """
+    def entries(self, query, parameters):
+        with self.lock:
+            rows = self.connection.execute("SELECT event_id, trigger_time, filter, stations FROM events " + query, parameters).fetchall()
+
+        result = []
+        for row in rows:
+            result.append({"EventID": str(row["event_id"]), "TriggerTime": row["trigger_time"], "Filter": row["filter"], "Stations": row["stations"]})
+
+        return(result)
+
+    """ The events of a month, in the order of their EventIDs.
+    """
+    def month_events(self, year, month):
+        return(self.entries("WHERE year = ? AND month = ? ORDER BY event_id", (year, month)))
+
+    """ The events that triggered between start and end (UTCDateTime, both excluded), oldest first.
+        With f only the events of that filter.
+    """
+    def events_between(self, start, end, f=None):
+        if(f is None):
+            return(self.entries("WHERE trigger_timestamp > ? AND trigger_timestamp < ? ORDER BY trigger_timestamp, year, month, event_id", (start.timestamp, end.timestamp)))
+
+        return(self.entries("WHERE filter = ? AND trigger_timestamp > ? AND trigger_timestamp < ? ORDER BY trigger_timestamp, year, month, event_id", (filter_string(f), start.timestamp, end.timestamp)))
+
+    """ Appends the fields of an event to the text file of its month, or writes the whole month if there is no file yet.
+    """
+    def append_event(self, year, month, fields):
+        if(not self.export_text):
+            return
+
+        path = os.path.join(self.directory, generate_text_filename(year, month))
+        if(not os.path.exists(path)):
+            self.export_month(year, month)
+            return
+
+        with open(path, "a") as catalog_file:
+            catalog_file.write(DELIMITER.join(fields) + "\n")
+
+    """ Writes the text file of a month from the database.
+    """
+    def export_month(self, year, month):
+        if(not self.export_text):
+            return
+
+        path = os.path.join(self.directory, generate_text_filename(year, month))
+        if(not os.path.exists(os.path.dirname(path))):
+            os.makedirs(os.path.dirname(path))
+
+        lines = [DELIMITER.join(FIELDS) + "\n"]
+        for entry in self.month_events(year, month):
+            lines.append(DELIMITER.join([entry[k] for k in FIELDS]) + "\n")
+
+        with open(path + "temp", "w") as catalog_file:
+            catalog_file.writelines(lines)
+        os.replace(path + "temp", path)
+
+    def close(self):
+        self.export_stale()
+
+        with self.lock:
+            self.connection.close()
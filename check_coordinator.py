@@ -0,0 +1,234 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+from obspy import UTCDateTime
+import common
+import coordinator
+
+"""
+Checks that coordinator.py takes a worker that dies out and gives its stations to the others, on one machine.
+
+Starts the seedlink and FDSN servers of replay.py with synthetic stations on a fast simulated clock, a coordinator and
+a few loggers as its workers, all on 127.0.0.1, each in its own temporary directory. Once every worker has joined and
+a minute has been written with all of the stations, one of the workers is killed. The check then waits for the
+coordinator to record the dead worker's shard as missing in _shards.csv once the shard deadline has passed, and for
+a later minute in the day files that has the dead worker's stations again, from the workers that took them over.
+Prints what it saw and exits with 1 if either doesn't happen in time.
+
+Usage:
+    python3 check_coordinator.py
+    python3 check_coordinator.py --workers 4 --stations 12 --speed 20
+"""
+
+START = "2020-01-01"
+FILTERS = [[0.5, 1.0], [1.0, 2.0]]
+COMPONENT = "z"
+NETWORK = "XX"
+
+REPOSITORY = os.path.dirname(os.path.abspath(__file__))
+
+
+"""
+Starts one of the programs of the repository in directory, with its output in directory/output.log.
+"""
+def start(directory, script, arguments=[]):
+    output = open(os.path.join(directory, "output.log"), "w")
+    return(subprocess.Popen([sys.executable, os.path.join(REPOSITORY, script)] + arguments, cwd=directory, stdout=output, stderr=subprocess.STDOUT))
+
+
+def write_config(directory, config):
+    with open(os.path.join(directory, "config.json"), "w") as f:
+        json.dump(config, f, indent=4)
+
+
+"""
+Waits until something listens on port, so the coordinator and the workers don't start before the servers of replay.py.
+"""
+def wait_for_port(port, timeout):
+    end = time.time() + timeout
+
+    while(time.time() < end):
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return(True)
+        except OSError:
+            time.sleep(0.25)
+
+    return(False)
+
+
+"""
+The workers the coordinator has logged as joined.
+"""
+def joined_workers(directory):
+    filename = os.path.join(directory, "debug.log")
+    if(not os.path.exists(filename)):
+        return(set())
+
+    result = set()
+    with open(filename) as f:
+        for line in f:
+            if(" joined, " in line):
+                result.add(line.split("Worker ", 1)[1].split(" joined, ")[0])
+
+    return(result)
+
+
+"""
+The rows of a csv file in the coordinator's output, as dictionaries, or an empty list if it hasn't been written yet.
+"""
+def read_rows(directory, filename):
+    path = os.path.join(directory, common.logger_output_path(UTCDateTime(START)), filename)
+    if(not os.path.exists(path)):
+        return([])
+
+    with open(path) as f:
+        return(list(csv.DictReader(f, delimiter=common.delimiter())))
+
+
+"""
+Whether every one of stations has a value in a row of a day file.
+"""
+def has_stations(row, stations):
+    return(all(s in row and float(row[s]) != 0.0 for s in stations))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that coordinator.py reassigns the stations of a worker that dies.")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--stations", type=int, default=9)
+    parser.add_argument("--speed", type=float, default=30.0, help="how many times faster than real time the simulated clock runs")
+    parser.add_argument("--port", type=int, default=18300, help="first of the four ports used on 127.0.0.1")
+    parser.add_argument("--minutes", type=int, default=40, help="simulated minutes to wait for each step before giving up")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directories, with the output of every program")
+    args = parser.parse_args()
+
+    seedlink_port = args.port
+    fdsn_port = args.port + 1
+    coordinator_port = args.port + 2
+    timeout = 60 * args.minutes / args.speed
+
+    directory = tempfile.mkdtemp(prefix="check_coordinator_")
+    clock_file = os.path.join(directory, "clock.json")
+    worker_names = ["worker%d" % i for i in range(0, args.workers)]
+    processes = {}
+    failures = []
+
+    config = {
+        "fdsn_address": "http://127.0.0.1:" + str(fdsn_port),
+        "seedlink_address": "127.0.0.1",
+        "seedlink_port": seedlink_port,
+        "network": NETWORK,
+        "clock_file": clock_file,
+        "channels": "HHZ",
+        "filters": FILTERS,
+        "output_formats": ["csv"],
+    }
+
+    try:
+        os.makedirs(os.path.join(directory, "replay"))
+        processes["replay"] = start(os.path.join(directory, "replay"), "replay.py", ["--synthetic", str(args.stations), "--network", NETWORK, "--speed", str(args.speed), "--start", START,
+                                                                                   "--seedlink-port", str(seedlink_port), "--fdsn-port", str(fdsn_port), "--clock-file", clock_file])
+
+        if(not wait_for_port(fdsn_port, 60) or not wait_for_port(seedlink_port, 60)):
+            raise RuntimeError("replay.py didn't start, see " + os.path.join(directory, "replay", "output.log"))
+
+        coordinator_directory = os.path.join(directory, "coordinator")
+        os.makedirs(coordinator_directory)
+        coordinator_config = dict(config)
+        coordinator_config.update({"coordinator_port": coordinator_port, "worker_timeout": 6, "shard_deadline": 50})
+        write_config(coordinator_directory, coordinator_config)
+        processes["coordinator"] = start(coordinator_directory, "coordinator.py")
+
+        if(not wait_for_port(coordinator_port, 60)):
+            raise RuntimeError("coordinator.py didn't start, see " + os.path.join(coordinator_directory, "output.log"))
+
+        for name in worker_names:
+            os.makedirs(os.path.join(directory, name))
+            worker_config = dict(config)
+            worker_config.update({"coordinator_address": "http://127.0.0.1:" + str(coordinator_port), "worker_name": name, "heartbeat_seconds": 1})
+            write_config(os.path.join(directory, name), worker_config)
+            processes[name] = start(os.path.join(directory, name), "logger.py")
+
+        day_filename = common.generate_tremvlog_filename(UTCDateTime(START), FILTERS[0], COMPONENT)
+        shards_filename = coordinator.generate_shards_filename(UTCDateTime(START))
+
+        #Every worker has joined and a minute has been written with all of the stations.
+        end = time.time() + timeout
+        stations = None
+        while(time.time() < end):
+            rows = read_rows(coordinator_directory, day_filename)
+            if(joined_workers(coordinator_directory) == set(worker_names) and len(rows) > 0 and has_stations(rows[-1], list(rows[-1].keys())[1:])):
+                stations = list(rows[-1].keys())[1:]
+                break
+            time.sleep(0.5)
+
+        if(stations is None):
+            raise RuntimeError("The workers didn't all join, or no minute was written with every station, within %d minutes." % args.minutes)
+
+        victim = worker_names[0]
+        victim_stations = coordinator.assign_stations(stations, sorted(worker_names))[victim]
+        processes[victim].kill()
+        processes[victim].wait()
+        killed_rows = len(read_rows(coordinator_directory, day_filename))
+        print("%d workers with %d stations, killed %s with %s." % (len(worker_names), len(stations), victim, " ".join(victim_stations)))
+
+        #The dead worker's shard is recorded as missing, and a later minute has its stations again.
+        end = time.time() + timeout
+        missing = None
+        reassigned = None
+        while(time.time() < end and (missing is None or reassigned is None)):
+            if(missing is None):
+                for row in read_rows(coordinator_directory, shards_filename):
+                    if(row["WORKER"] == victim and row["STATUS"] == "missing"):
+                        missing = row
+                        print("%s: the shard of %s was recorded as missing (%s)." % (row["TIMESTAMP"], victim, row["STATIONS"]))
+                        break
+
+            if(missing is not None and reassigned is None):
+                for row in read_rows(coordinator_directory, day_filename)[killed_rows:]:
+                    if(UTCDateTime(row["TIMESTAMP"]) > UTCDateTime(missing["TIMESTAMP"]) and has_stations(row, victim_stations)):
+                        reassigned = row
+                        print("%s: the stations of %s were written again by the other workers." % (row["TIMESTAMP"], victim))
+                        break
+
+            time.sleep(0.5)
+
+        if(missing is None):
+            failures.append("no missing shard of %s in %s" % (victim, shards_filename))
+        if(reassigned is None):
+            failures.append("the stations of %s weren't written again after it was taken out" % victim)
+    except RuntimeError as e:
+        failures.append(str(e))
+    finally:
+        for name in processes:
+            if(processes[name].poll() is None):
+                processes[name].terminate()
+                processes[name].wait()
+
+        if(args.keep):
+            print("The output of every program is in " + directory + ".")
+        else:
+            shutil.rmtree(directory)
+
+    for failure in failures:
+        print("FAILED: " + failure)
+    if(len(failures) > 0):
+        sys.exit(1)
+
+    print("The coordinator reassigned the stations of the dead worker.")
+
+
+if(__name__ == "__main__"):
+    main()
@@ -114,6 +114,47 @@ def generate_tremvlog_filename(date, f, component):
     return(datestr + "_" + str(f[0]) + "," + str(f[1]) + "_" + str(component) + ".csv")
 
 
+""" The components (z, n and/or e) a seedlink channel selector covers, e.g. ["z"] for "HHZ" and ["z", "n", "e"] for "HH?".
+    Selectors can be comma separated, e.g. "HHZ,HHN". The components are in the order z, n, e.
+"""
+def determine_components(selector):
+    result = []
+
+    for channel in selector.split(","):
+        component = channel.strip()[-1:].lower()
+
+        if(component in ["?", "*"]):
+            result += ["z", "n", "e"]
+        elif(component in ["z", "n", "e"]):
+            result.append(component)
+
+    ordered = []
+    for component in ["z", "n", "e"]:
+        if(component in result):
+            ordered.append(component)
+
+    return(ordered)
+
+
+"""
+The window lengths (in seconds) of "rsam_windows" that divide a minute. The others are left out with an error in the log.
+"""
+def valid_rsam_windows(windows):
+    result = []
+
+    for window in windows:
+        if(window in result):
+            continue
+
+        if(int(window) != window or window <= 0 or window >= 60 or 60 % window != 0):
+            logging.error("rsam_windows: " + str(window) + " seconds doesn't divide a minute, leaving it out.")
+            continue
+
+        result.append(int(window))
+
+    return(result)
+
+
 """ Parses an iso format date string to python datetime object.
 """
 def parse_isoformat_to_datetime(date_str):
@@ -130,31 +171,80 @@ def parse_isoformat_to_datetime(date_str):
     return(datetime.datetime(year=yy, month=mm, day=dd, hour=h, minute=m, second=s))
 
 
+""" Splits a header line ("TIMESTAMP,station1,station2,...") into the list of station names.
+"""
+def parse_tremvlog_header(line):
+    stations = line.split(delimiter())
+    stations = stations[1:] # remove "TIMESTAMP" at position 0
+
+    # removes \n line jump from last station in file and any other erroneous white space
+    for i in range(0, len(stations)):
+        stations[i] = stations[i].rstrip()
+
+    return(stations)
+
+
+""" A csv file is made of one or more segments, each starting with a header line.
+    When a station joins the network during the day the logger appends a new header with the new station list
+    instead of rewriting the file, so the columns of the lines below a header are the stations in that header.
+    Returns the column mapping index of the file: a list with [stations, index of the first line of data] per segment.
+"""
+def read_tremvlog_segments(filename):
+    segments = []
+
+    if(os.path.exists(filename)):
+        input_file = open(filename, "r")
+        row_count = 0
+
+        for line in input_file:
+            if(line.startswith("TIMESTAMP")):
+                segments.append([parse_tremvlog_header(line), row_count])
+            else:
+                row_count += 1
+
+        input_file.close()
+
+    return(segments)
+
+
 """ Reads in a csv file and returns a dictionary where the keys are the station names.
+    Files with more than one segment are presented as one table: stations that were added during the day
+    have 0.0 for the minutes before they were added.
 """
 def read_tremvlog_file(filename):
     result = {}
 
     if(os.path.exists(filename)):
         input_file = open(filename, "r")
-        station_names_in_file = input_file.readline().split(delimiter())
-        station_names_in_file = station_names_in_file[1:] # remove "TIMESTAMP" at position 0
+        station_names_in_file = []
+        row_count = 0
 
-        # removes \n line jump from last station in file and any other erroneous white space
-        for i in range(0, len(station_names_in_file)):
-            station_names_in_file[i] = station_names_in_file[i].rstrip()
+        for line in input_file:
+            values = line.split(delimiter())
 
-        for name in station_names_in_file:
-            result[name] = []
+            if(values[0] == "TIMESTAMP"):
+                station_names_in_file = parse_tremvlog_header(line)
 
-        for line in input_file.readlines():
-            values = line.split(delimiter())
+                for name in station_names_in_file:
+                    if(name not in result):
+                        result[name] = [0.0] * row_count
+                continue
 
             for i in range(0, len(station_names_in_file)):
                 name = station_names_in_file[i]
                 # i+1 to ignore timestamp (otherwise error cannot convert strng (timestamp) to float)
                 result[name].append(float(values[i+1]))
 
+            row_count += 1
+
+            # stations from an earlier segment that are not in this one
+            if(len(station_names_in_file) != len(result)):
+                for name in result:
+                    if(len(result[name]) < row_count):
+                        result[name].append(0.0)
+
+        input_file.close()
+
     #result = dictionary of RSAM results up to current minute for all stations in file
     return(result)
 
@@ -167,29 +257,28 @@ def read_tremvlog_timestamps(filename):
     if(os.path.exists(filename)):
         input_file = open(filename, "r")
 
-        for line in input_file.readlines():
-            values = line.split(delimiter())
-            timestamp_list.append(values[0])
+        for line in input_file:
+            values = line.split(delimiter(), 1)
+
+            # header lines ("TIMESTAMP" in the first column) start each segment of the file
+            if(values[0] != "TIMESTAMP"):
+                timestamp_list.append(values[0])
 
-        timestamp_list.pop(0) # Remove "TIMESTAMP" from position 0, first line
         input_file.close()
 
     return(timestamp_list)
 
 
-""" Reads csv file and returns list of station names in file.
+""" Reads csv file and returns list of station names in file, over all segments of the file.
 """
 def read_tremvlog_stations(filename):
 
     if(os.path.exists(filename)):
-        input_file = open(filename, "r")
-
-        stations = input_file.readline().split(delimiter())
-        stations = stations[1:]  # Remove "TIMESTAMP" text at position 0
+        stations = []
 
-        for i in range(0, len(stations)):
-            stations[i] = stations[i].rstrip()
-
-        input_file.close()
+        for segment_stations, first_row in read_tremvlog_segments(filename):
+            for name in segment_stations:
+                if(name not in stations):
+                    stations.append(name)
 
         return(stations)
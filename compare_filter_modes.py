@@ -0,0 +1,233 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import sys
+import glob
+import json
+import argparse
+import statistics
+import numpy
+import obspy
+from obspy import UTCDateTime
+import common
+import dsp
+import logger
+import replay
+
+"""
+Replays a stretch of data minute by minute through the zero phase filters (station_dsp) and the streaming
+filters (station_dsp_streaming), like the live logger would, and shows how the rsam values of the two differ.
+
+Both are also compared with the same filters run once over the whole stretch, where there are no minute boundaries:
+the zero phase filters over the whole stretch for station_dsp, the causal filters over the whole stretch for
+station_dsp_streaming. The difference to these references is what the minute boundaries cost each mode.
+The data comes from the same sources as replay.py, miniSEED files or synthetic noise.
+
+Usage:
+    python3 compare_filter_modes.py --synthetic 20 --minutes 60
+    python3 compare_filter_modes.py --data "archive/*.mseed" --resp .resp.xml --start 2020-11-01T00:00:00 --minutes 120
+"""
+
+DEFAULT_FILTERS = [[0.5, 1.0], [1.0, 2.0], [2.0, 4.0]]
+
+
+"""
+The data of a source between starttime and endtime, both included, like a seedlink request returns it.
+"""
+def fetch(source, starttime, endtime):
+    result = obspy.Stream()
+    block_start = int(starttime) - int(starttime) % replay.BLOCK_SECONDS
+
+    while(block_start <= endtime):
+        result += source.make_block(block_start)
+        block_start += replay.BLOCK_SECONDS
+
+    result.merge(method=-1)
+    return(result.slice(UTCDateTime(starttime), UTCDateTime(endtime)))
+
+
+"""
+Rsam of every minute of a trace that has been filtered in one go.
+
+Parameters:
+    filtered: the filtered data at the working rate.
+    boundaries: index of the first sample of each minute in filtered, and the end of the last minute.
+"""
+def minute_rsam(filtered, boundaries):
+    result = []
+
+    for m in range(0, len(boundaries) - 1):
+        result.append(numpy.abs(filtered[boundaries[m]:boundaries[m + 1]]).sum() / (logger.WORKING_SAMPLING_RATE * 60))
+
+    return(result)
+
+
+"""
+Per minute rsam of every station and filter with the filters run once over all of the data.
+
+Returns:
+    (zero phase reference, causal reference), each a dictionary of (filter index, station) -> list of rsam per minute.
+"""
+def references(stream, filters, sensitivity_table, start, minutes):
+    zerophase = {}
+    causal = {}
+    streaming_filters = dsp.streamingFilterBank(logger.filter_bank, logger.resampler)
+
+    for trace in stream:
+        counts_to_um = sensitivity_table.lookup(trace.id, start + 60 * minutes)
+        offset = trace.stats.starttime.timestamp - start
+
+        # Only stations with data for the whole stretch, since the minutes of the others don't line up with the references.
+        if(counts_to_um is None or abs(offset) > 0.5 / trace.stats.sampling_rate or trace.stats.npts < int(round(60 * minutes * trace.stats.sampling_rate)) + 1):
+            continue
+
+        pre_processed, missing = logger.response_correction(logger.process_station_data(obspy.Stream([trace])), sensitivity_table, start + 60 * minutes)
+        data = pre_processed[0].data
+        # The zero phase minutes are the data from the start to the end of the minute, both included, as in the live logger.
+        boundaries = [int(m * 60 * logger.WORKING_SAMPLING_RATE) for m in range(0, minutes + 1)]
+
+        up, down = logger.resampler.ratio(trace.stats.sampling_rate)
+        state, raw = streaming_filters.new_samples(trace, counts_to_um)
+        resampled = streaming_filters.resample([state], raw[None, :].astype(numpy.float64), trace.stats.sampling_rate) / counts_to_um
+        # The streaming minutes end with the sample at the end of the minute, and the next one starts after it.
+        causal_boundaries = [0]
+        for m in range(0, minutes):
+            npts = int(round(60 * (m + 1) * trace.stats.sampling_rate)) + 1
+            causal_boundaries.append(len(range(0, npts * up, down)))
+
+        for i in range(0, len(filters)):
+            filtered = logger.filter_bank.filter(data[None, :], filters[i], logger.WORKING_SAMPLING_RATE)[0]
+            zerophase[(i, trace.stats.station)] = [numpy.abs(filtered[b:b + int(60 * logger.WORKING_SAMPLING_RATE) + 1]).sum() / (logger.WORKING_SAMPLING_RATE * 60) for b in boundaries[:-1]]
+            causal[(i, trace.stats.station)] = minute_rsam(streaming_filters.bandpass([state], resampled, filters[i], logger.WORKING_SAMPLING_RATE)[0], causal_boundaries)
+
+    return(zerophase, causal)
+
+
+def filter_values(values, filter_index):
+    result = {}
+
+    for key in values:
+        if(key[0] == filter_index):
+            result[key] = values[key]
+
+    return(result)
+
+
+def relative_differences(values, reference):
+    result = []
+
+    for key in reference:
+        if(key not in values):
+            continue
+
+        for m in range(0, len(reference[key])):
+            if(reference[key][m] != 0.0):
+                result.append(abs(values[key][m] - reference[key][m]) / reference[key][m])
+
+    return(result)
+
+
+def summarize(samples):
+    if(len(samples) == 0):
+        return(None)
+
+    return({"median": statistics.median(samples), "p95": float(numpy.percentile(samples, 95)), "max": max(samples)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the zero phase and the streaming filter modes on replayed data.")
+    parser.add_argument("--data", default=None, help="glob of miniSEED files to replay")
+    parser.add_argument("--synthetic", type=int, default=None, help="number of synthetic stations to generate instead")
+    parser.add_argument("--network", default="XX", help="network code of the synthetic stations")
+    parser.add_argument("--channels", default="HHZ", help="comma separated channels of the synthetic stations")
+    parser.add_argument("--resp", default=None, help="StationXML with the responses (default: a flat response for every station)")
+    parser.add_argument("--start", default=None, help="first minute (default: the start of the data)")
+    parser.add_argument("--minutes", type=int, default=60)
+    parser.add_argument("--config", default=None, help="config.json to take the filters from")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if(args.data is not None):
+        source = replay.archiveSource(sorted(glob.glob(args.data)))
+    elif(args.synthetic is not None):
+        stations = [replay.synthetic_station_code(i) for i in range(0, args.synthetic)]
+        source = replay.syntheticSource(args.network, stations, args.channels.split(","))
+    else:
+        print("Either --data or --synthetic is needed.")
+        sys.exit(1)
+
+    if(args.start is not None):
+        start = UTCDateTime(args.start).timestamp
+    elif(source.start is not None):
+        start = source.start
+    else:
+        start = UTCDateTime(2020, 1, 1).timestamp
+
+    start -= start % 60
+
+    filters = DEFAULT_FILTERS
+    if(args.config is not None):
+        filters = common.config(args.config)["filters"]
+
+    if(args.resp is not None):
+        inventory = obspy.read_inventory(args.resp)
+    else:
+        inventory = replay.generate_inventory(source)
+
+    sensitivity_table = logger.sensitivityTable(inventory)
+
+    modes = {"zerophase": logger.station_dsp, "streaming": logger.station_dsp_streaming}
+    results = {}
+    seconds = {}
+
+    for mode in modes:
+        results[mode] = {}
+        seconds[mode] = []
+
+        for m in range(0, args.minutes):
+            data_starttime = start + 60 * m
+            rsam_results, missing, timings, window_results = modes[mode](fetch(source, data_starttime, data_starttime + 60), filters, sensitivity_table, UTCDateTime(data_starttime + 60))
+            seconds[mode].append(timings["process_station_data"] + timings["apply_bandpass_filters"])
+
+            for i in range(0, len(filters)):
+                for station in rsam_results[i]:
+                    results[mode].setdefault((i, station), [0.0] * args.minutes)[m] = rsam_results[i][station]
+
+    zerophase_reference, causal_reference = references(fetch(source, start, start + 60 * args.minutes), filters, sensitivity_table, start, args.minutes)
+
+    report = {"start": str(UTCDateTime(start)), "minutes": args.minutes, "stations": len(set([key[1] for key in results["zerophase"]])), "filters": []}
+    print("%d minutes from %s, %d stations" % (args.minutes, report["start"], report["stations"]))
+    print("Filtering per minute: zerophase %.4fs, streaming %.4fs" % (statistics.median(seconds["zerophase"]), statistics.median(seconds["streaming"])))
+    report["seconds_per_minute"] = {"zerophase": statistics.median(seconds["zerophase"]), "streaming": statistics.median(seconds["streaming"])}
+
+    for i in range(0, len(filters)):
+        ratios = []
+
+        for key in filter_values(results["zerophase"], i):
+            for m in range(0, args.minutes):
+                if(results["zerophase"][key][m] != 0.0 and key in results["streaming"]):
+                    ratios.append(results["streaming"][key][m] / results["zerophase"][key][m])
+
+        entry = {
+            "filter": filters[i],
+            "zerophase_vs_whole_stretch": summarize(relative_differences(results["zerophase"], filter_values(zerophase_reference, i))),
+            "streaming_vs_whole_stretch": summarize(relative_differences(results["streaming"], filter_values(causal_reference, i))),
+            "streaming_to_zerophase_ratio": summarize(ratios),
+        }
+        report["filters"].append(entry)
+
+        print("Filter " + str(filters[i]) + ":")
+        for name in ["zerophase_vs_whole_stretch", "streaming_vs_whole_stretch"]:
+            if(entry[name] is not None):
+                print("  %-28s median %.2e, p95 %.2e, max %.2e" % (name.replace("_", " "), entry[name]["median"], entry[name]["p95"], entry[name]["max"]))
+        if(entry["streaming_to_zerophase_ratio"] is not None):
+            print("  streaming / zerophase rsam  median %.4f, p95 %.4f" % (entry["streaming_to_zerophase_ratio"]["median"], entry["streaming_to_zerophase_ratio"]["p95"]))
+
+    if(args.output is not None):
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if(__name__ == "__main__"):
+    main()
@@ -0,0 +1,206 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import os
+import sys
+import csv
+import json
+import shutil
+import argparse
+import tempfile
+import numpy
+from obspy import UTCDateTime
+import alert
+import catalog
+import logger
+import sweep
+
+"""
+Checks that sweep.py makes the same catalogs as the live alerts (alert.main), so the two can't drift apart unnoticed.
+
+Writes a few days of synthetic rsam, with tremor that ramps up on some of the stations now and then and minutes without
+data, as day files in a temporary directory. For each combination of a small grid of alert settings the alerts are then
+run for every minute the way the logger runs them, and the sweep is run over the same days, and the catalogs are compared.
+The default start puts a month boundary in the middle of the days, where the EventIDs start again.
+Prints the combinations whose catalogs differ and exits with 1 if there are any.
+
+Usage:
+    python3 compare_sweep.py
+    python3 compare_sweep.py --days 3 --stations 20 --seed 4
+"""
+
+FILTERS = [[0.5, 1.0], [1.0, 2.0]]
+COMPONENT = "z"
+
+GRID = {
+    "sta_length": [2, 3],
+    "lta_length": [10],
+    "ramp_intervals": [1, 3],
+    "trigger_ratio": [1.2, 1.5],
+    "station_votes": [2, 4],
+    "minimum_min_between_events": [30],
+}
+
+ALERT_CONFIG = {
+    "sta_length": 3,
+    "lta_length": 10,
+    "trigger_ratio": 1.3,
+    "ramp_min_avg": 2,
+    "ramp_intervals": 3,
+    "min_velocity": 0.03,
+    "station_votes": 4,
+    "percentage_data": 80,
+    "mute_filters": [],
+    "mute_stations": [],
+    "remove_stations": [],
+    "silence_audio": "True",
+    "minimum_min_between_events": 30,
+    "max_audio_per_hr": 6,
+}
+
+
+"""
+Synthetic rsam for every filter, stations x minutes: noise around a level of each station, tremor that ramps up and
+dies down on some of the stations a few times a day, and minutes without data (0.0), a couple of hours of them for one station.
+"""
+def synthetic_rsam(rng, station_count, minutes):
+    level = 0.05 * numpy.exp(rng.normal(0.0, 0.5, (station_count, 1)))
+    tremor = numpy.ones((station_count, minutes))
+
+    for i in range(0, minutes // 240):
+        start = int(rng.integers(0, minutes))
+        rise = int(rng.integers(10, 40))
+        decay = int(rng.integers(20, 90))
+        peak = rng.uniform(2.0, 8.0)
+        shape = numpy.concatenate([numpy.linspace(1.0, peak, rise), numpy.linspace(peak, 1.0, decay)])
+        end = min(start + len(shape), minutes)
+
+        for s in numpy.flatnonzero(rng.random(station_count) < 0.6):
+            tremor[s, start:end] *= shape[:end - start]
+
+    result = []
+    for f in FILTERS:
+        values = level * tremor * numpy.exp(rng.normal(0.0, 0.15, (station_count, minutes)))
+        values[rng.random(values.shape) < 0.03] = 0.0
+        outage = int(rng.integers(0, minutes - 120))
+        values[0, outage:outage + 120] = 0.0
+        result.append(values)
+
+    return(result)
+
+
+"""
+Runs alert.main for every minute from first_day on with alert_config, pushing each minute's rsam like the logger does.
+
+Returns:
+    The rows of the catalog, (EventID, TriggerTime, Filter, Stations), oldest month first.
+"""
+def run_live(alert_config, first_day, minutes, stations, values):
+    with open("alert_config.json", "w") as f:
+        json.dump(alert_config, f)
+
+    if(os.path.exists(catalog.DEFAULT_DIRECTORY)):
+        shutil.rmtree(catalog.DEFAULT_DIRECTORY)
+
+    alert.AlertInfo = alert.ClassAlertInfo()
+
+    for m in range(0, minutes):
+        rsam_results = []
+        for i in range(0, len(FILTERS)):
+            rsam_results.append(dict([(stations[s], float(values[i][s, m])) for s in range(0, len(stations)) if values[i][s, m] != 0.0]))
+
+        alert.main(first_day + 60 * m, FILTERS, COMPONENT, None, rsam_results)
+
+    store = alert.catalog_store()
+    rows = []
+    months = sorted(set([((first_day + 60 * m).year, (first_day + 60 * m).month) for m in range(0, minutes, 60)]))
+    for year, month in months:
+        for entry in store.month_events(year, month):
+            rows.append(tuple([entry[k] for k in catalog.FIELDS]))
+    store.close()
+
+    return(rows)
+
+
+"""
+Runs the sweep over the day files for the combinations, the same way sweep.main does but without the pool.
+
+Returns:
+    A list with the rows of the catalog of each combination, as for run_live.
+"""
+def run_sweep(combos, first_day, days):
+    stations, values = sweep.load_rsam(first_day, days, FILTERS, COMPONENT, ALERT_CONFIG["remove_stations"])
+    sweep.init_worker({"start": first_day.timestamp, "stations": stations, "values": values})
+    events = [[] for c in combos]
+
+    for unit in sweep.make_units(combos, len(FILTERS)):
+        filter_index, result = sweep.evaluate_unit(unit)
+        for combination, combination_events in result:
+            for t, event_stations in combination_events:
+                events[combination].append((t, filter_index, catalog.filter_string(FILTERS[filter_index]), event_stations))
+
+    result = []
+    for i in range(0, len(combos)):
+        events[i].sort(key=lambda e: (e[0], e[1]))
+        sweep.write_catalog("sweep_catalog.txt", [(e[0], e[2], e[3]) for e in events[i]])
+
+        with open("sweep_catalog.txt") as catalog_file:
+            result.append([tuple([entry[k] for k in catalog.FIELDS]) for entry in csv.DictReader(catalog_file, delimiter=catalog.DELIMITER)])
+
+    return(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that sweep.py makes the same catalogs as the live alerts.")
+    parser.add_argument("--start", default="2020-03-31", help="first day, YYYY-MM-DD")
+    parser.add_argument("--days", type=int, default=2)
+    parser.add_argument("--stations", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    first_day = UTCDateTime(args.start)
+    minutes = args.days * sweep.SECONDS_IN_DAY // 60
+    stations = ["S%03d" % i for i in range(0, args.stations)]
+    values = synthetic_rsam(numpy.random.default_rng(args.seed), len(stations), minutes)
+    combos = sweep.combinations(GRID, ALERT_CONFIG)
+
+    directory = tempfile.mkdtemp(prefix="compare_sweep_")
+    cwd = os.getcwd()
+    os.chdir(directory)
+
+    try:
+        writer = logger.tremvlogWriter()
+        for m in range(0, minutes):
+            rsam_results = []
+            for i in range(0, len(FILTERS)):
+                rsam_results.append(dict([(stations[s], float(values[i][s, m])) for s in range(0, len(stations))]))
+
+            logger.write_tremvlog_file(rsam_results, FILTERS, stations, first_day + 60 * m, COMPONENT, writer)
+
+        swept = run_sweep(combos, first_day, args.days)
+        differ = 0
+
+        for i in range(0, len(combos)):
+            alert_config = dict(ALERT_CONFIG)
+            alert_config.update(combos[i])
+            live = run_live(alert_config, first_day, minutes, stations, values)
+
+            if(live == swept[i]):
+                print("combination %d: %d events, same catalog" % (i, len(live)))
+            else:
+                differ += 1
+                print("combination %d: catalogs differ, %d live events and %d sweep events, settings %s" % (i, len(live), len(swept[i]), json.dumps(combos[i])))
+                for row in sorted(set(live) ^ set(swept[i])):
+                    print("    " + ("live  " if row in live else "sweep ") + "\t".join(row))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+    print("%d of %d combinations differ." % (differ, len(combos)))
+    if(differ > 0):
+        sys.exit(1)
+
+
+if(__name__ == "__main__"):
+    main()
@@ -0,0 +1,550 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from obspy import UTCDateTime
+import common
+import alert
+import logger
+import metadata
+import daystore
+import metrics
+import pipeline
+
+"""
+Coordinator of a sharded logger deployment, for networks that are too large for one logger to process in a minute.
+
+Any number of loggers run as workers, on the same machine or on others, with "coordinator_address" in their config.json.
+The coordinator splits the stations of the metadata inventory between the workers that are alive, each worker processes
+its own stations every minute and sends the rsam rows to the coordinator, and the coordinator writes the day files
+(and runs the alerts) for the whole network once every worker has reported, or once "shard_deadline" seconds have passed
+since the end of the minute. Stations whose worker didn't report in time are written as 0.0 like any other missing station,
+and the missing shard is recorded in the day's _shards.csv file. A shard that comes in late, but within LATE_MINUTES,
+is still written into place and recorded as late.
+
+Workers send a heartbeat every few seconds. A worker that hasn't been heard from for "worker_timeout" seconds is taken out,
+and its stations are given to the other workers from the next minute on.
+
+Usage:
+    python3 coordinator.py
+    python3 coordinator.py --config coordinator.json
+"""
+
+#How many minutes back a late shard is still written into the day files.
+LATE_MINUTES = 5
+
+
+"""
+Assigns each station to one of the workers with rendezvous hashing: a station goes to the worker with the highest
+hash of the two names. When a worker joins or leaves only the stations it gets or had move, so the rest
+keep their worker (and their streaming filter states).
+
+Returns:
+    A dictionary of worker -> list of stations, with an entry for every worker.
+"""
+def assign_stations(stations, workers):
+    result = {}
+    for worker in workers:
+        result[worker] = []
+
+    if(len(workers) == 0):
+        return(result)
+
+    for station in stations:
+        best = max(workers, key=lambda worker: hashlib.md5((station + "/" + worker).encode()).digest())
+        result[best].append(station)
+
+    return(result)
+
+
+""" Creates file name format: YYYY.MM.DD_shards.csv, the record of the shards that were missing or late on a day.
+"""
+def generate_shards_filename(date):
+    datestr = str(date.year) + "." + str(date.month) + "." + str(date.day)
+    return(datestr + "_shards.csv")
+
+
+"""
+Appends a line per shard to the day's shards file: the minute, the worker, "missing" or "late", and the stations of the shard.
+"""
+def write_shard_record(data_starttime, shards, status):
+    path = common.logger_output_path(data_starttime)
+
+    if(not os.path.exists(path)):
+        os.makedirs(path)
+
+    filename = path + generate_shards_filename(data_starttime)
+    lines = []
+
+    if(not os.path.exists(filename)):
+        lines.append(common.delimiter().join(["TIMESTAMP", "WORKER", "STATUS", "STATIONS"]) + "\n")
+
+    for worker in sorted(shards):
+        lines.append(common.delimiter().join([str(data_starttime), worker, status, " ".join(shards[worker])]) + "\n")
+
+    output = open(filename, "a")
+    output.write("".join(lines))
+    output.close()
+
+
+class coordinatorRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode())
+
+            if(self.path == "/heartbeat"):
+                response = self.server.coordinator.heartbeat(body["worker"])
+            elif(self.path == "/rows"):
+                response = self.server.coordinator.report(body)
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+        except Exception:
+            logging.exception("Bad request from a worker.")
+            self.send_response(400)
+            self.end_headers()
+            return
+
+        data = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    #Every worker calls in every few seconds, they don't belong in debug.log.
+    def log_message(self, format, *args):
+        pass
+
+
+"""
+Keeps track of the workers and the minutes they report, and writes each minute once it is complete or overdue.
+The minutes are finished in order, so the csv files are always appended to in order.
+"""
+class coordinator:
+    def __init__(self, config_filename="config.json"):
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+            handlers=[logging.StreamHandler(), logging.FileHandler("debug.log")]
+        )
+
+        self.config = common.config(config_filename)
+        self.lock = threading.Lock()
+        self.workers = {}#worker name -> monotonic time of its last heartbeat
+        self.minutes = {}#data start timestamp -> minute that is waiting for its shards
+        self.finished = {}#data start timestamp -> the last LATE_MINUTES minutes that were written, for late shards
+        self.last_finished = None
+        self.writers = []
+        self.window_writer = daystore.dayStoreWriter()
+        self.stats = pipeline.pipelineStats()
+        self.alerts = pipeline.minuteConsumer("alert", self.run_alert, self.stats)
+        self.metrics = metrics.registry()
+        self.setup_metrics()
+        self.clock = pipeline.wallClock()
+
+        if("clock_file" in self.config.config):
+            self.clock = pipeline.simulatedClock.load(self.config["clock_file"])
+            logging.info("Using the simulated clock in " + self.config["clock_file"] + " (" + str(self.clock.speed) + "x).")
+
+        if("network" not in self.config.config):
+            raise Exception("You need to define the SEED network config.json with \"network\".")
+
+        if("coordinator_port" not in self.config.config):
+            raise Exception("You need to define the port the coordinator listens on in config.json with \"coordinator_port\".")
+
+        if("metadata_filename" not in self.config.config):
+            self.config["metadata_filename"] = ".meta.xml"
+
+        if("channels" not in self.config.config):
+            self.config["channels"] = "HHZ"
+
+        if("filters" not in self.config.config):
+            self.config["filters"] = [[0.5, 1.0], [1.0, 2.0], [2.0, 4.0]]
+
+        self.shard_deadline = 50
+        if("shard_deadline" in self.config.config):
+            self.shard_deadline = self.config["shard_deadline"]
+
+        self.worker_timeout = 20
+        if("worker_timeout" in self.config.config):
+            self.worker_timeout = self.config["worker_timeout"]
+
+        output_formats = ["csv"]
+        if("output_formats" in self.config.config):
+            output_formats = self.config["output_formats"]
+
+        if("csv" in output_formats):
+            self.writers.append(logger.tremvlogWriter())
+        if("binary" in output_formats):
+            self.writers.append(daystore.dayStoreWriter())
+
+        fdsn_address = None
+        if("fdsn_address" in self.config.config):
+            fdsn_address = self.config["fdsn_address"]
+
+        refresh_minutes = 60
+        if("metadata_refresh_minutes" in self.config.config):
+            refresh_minutes = self.config["metadata_refresh_minutes"]
+
+        self.metadata = metadata.metadataCache(fdsn_address, self.config["network"], self.config["metadata_filename"], refresh_minutes)
+
+        try:
+            self.metadata.start()
+        except Exception as e:
+            logging.error(str(e) + " Aborting program.")
+            sys.exit(1)
+
+        address = "127.0.0.1"
+        if("coordinator_bind_address" in self.config.config):
+            address = self.config["coordinator_bind_address"]
+
+        self.httpd = ThreadingHTTPServer((address, self.config["coordinator_port"]), coordinatorRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.coordinator = self
+
+        if("metrics_port" in self.config.config):
+            metrics_address = "127.0.0.1"
+            if("metrics_address" in self.config.config):
+                metrics_address = self.config["metrics_address"]
+
+            metrics.metricsServer(self.metrics, metrics_address, self.config["metrics_port"]).start()
+
+
+    def setup_metrics(self):
+        self.shard_reports = self.metrics.counter("tremv_shard_reports_total", "Shards reported by the workers.", ["status"])
+        self.missing_shard_count = self.metrics.counter("tremv_missing_shards_total", "Shards that were not reported by the deadline.")
+        self.missing_stations = self.metrics.counter("tremv_missing_shard_stations_total", "Stations in shards that were not reported by the deadline.")
+        self.rebalances = self.metrics.counter("tremv_rebalances_total", "Times the stations were split again because a worker joined or left.")
+        self.minute_seconds = self.metrics.histogram("tremv_minute_complete_seconds", "Seconds from the end of a minute until it was written.", ["reason"])
+        self.bytes_written = self.metrics.counter("tremv_bytes_written_total", "Bytes written to the output files.", ["format"])
+
+        def worker_count():
+            with self.lock:
+                return({(): len(self.workers)})
+
+        def alert_queue():
+            return({(): self.alerts.queue.qsize()})
+
+        def alert_failures():
+            return({(): self.alerts.failures})
+
+        self.metrics.gauge("tremv_workers", "Workers that are alive.", [], worker_count)
+        self.metrics.gauge("tremv_alert_queue_minutes", "Written minutes waiting for the alerts.", [], alert_queue)
+        self.metrics.counter("tremv_alert_failures_total", "Minutes the alerts failed for.", [], alert_failures)
+        alert_latency = self.metrics.histogram("tremv_alert_latency_seconds", "Seconds from a minute being written until its alerts were done.")
+        self.alerts.listeners.append(lambda seconds: alert_latency.observe(seconds))
+
+
+    def stations_in_network(self, starttime, endtime):
+        blacklist = []
+        if("station_blacklist" in self.config.config):
+            blacklist = self.config["station_blacklist"]
+
+        return(self.metadata.stations_in_network(starttime, endtime, blacklist))
+
+
+    """
+    Registers a worker, or notes that it is still alive, and returns its share of the stations.
+    """
+    def heartbeat(self, worker):
+        with self.lock:
+            if(worker not in self.workers):
+                logging.info("Worker " + worker + " joined, splitting the stations between " + str(len(self.workers) + 1) + " workers.")
+                self.rebalances.inc()
+
+            self.workers[worker] = time.monotonic()
+            workers = sorted(self.workers)
+
+        now = UTCDateTime(self.clock.time())
+        return({"stations": assign_stations(self.stations_in_network(now - 60, now), workers)[worker]})
+
+
+    """
+    Takes out the workers that haven't sent a heartbeat for worker_timeout seconds.
+    Their stations go to the other workers the next time those ask for their share.
+    """
+    def expire_workers(self):
+        with self.lock:
+            for worker in list(self.workers):
+                silent = time.monotonic() - self.workers[worker]
+
+                if(silent > self.worker_timeout):
+                    self.workers.pop(worker)
+                    self.rebalances.inc()
+                    logging.error("Worker " + worker + " hasn't been heard from for %.0fs, splitting its stations between the %d other workers." % (silent, len(self.workers)))
+
+
+    """
+    Starts waiting for the shards of the minute that starts at data_starttime. The stations the minute needs and who
+    should report them are taken when the minute is opened. Must be called with the lock held.
+    """
+    def open_minute(self, data_starttime):
+        if(data_starttime in self.minutes or (self.last_finished is not None and data_starttime <= self.last_finished)):
+            return
+
+        starttime = UTCDateTime(data_starttime)
+        stations = self.stations_in_network(starttime, starttime + 60)
+
+        self.minutes[data_starttime] = {
+            "data_starttime": starttime,
+            "stations": stations,
+            "assignment": assign_stations(stations, sorted(self.workers)),
+            "deadline": data_starttime + 60 + self.shard_deadline,
+            "filters": self.config["filters"],
+            "components": common.determine_components(self.config["channels"]),
+            "windows": common.valid_rsam_windows(self.config.config.get("rsam_windows", [])),
+            "alert_on": "alert_on" in self.config.config and self.config["alert_on"] == True,
+            "reports": {},
+            "ready": None,#"complete" or "deadline" once the minute can be written
+        }
+
+
+    """
+    Takes the rsam rows of a worker for a minute. Rows that were computed with other filters, components or
+    sub minute windows than the coordinator's (e.g. while a changed config.json is being picked up) are rejected.
+    """
+    def report(self, body):
+        data_starttime = int(body["data_starttime"])
+
+        with self.lock:
+            self.workers[body["worker"]] = time.monotonic()
+
+            if(data_starttime in self.finished):
+                entry = self.finished[data_starttime]
+            else:
+                self.open_minute(data_starttime)
+                entry = self.minutes.get(data_starttime)
+
+            if(entry is None):
+                self.shard_reports.inc(1, ("late",))
+                logging.error("Worker " + body["worker"] + " reported " + str(UTCDateTime(data_starttime)) + " too late to be written.")
+                return({"status": "late"})
+
+            if(body["filters"] != entry["filters"] or body["components"] != entry["components"] or body["windows"] != entry["windows"]):
+                self.shard_reports.inc(1, ("rejected",))
+                logging.error("Worker " + body["worker"] + " reported " + str(entry["data_starttime"]) + " with other filters, components or rsam_windows than the coordinator.")
+                return({"status": "rejected"})
+
+            entry["reports"][body["worker"]] = body
+
+            if(data_starttime in self.finished):
+                self.shard_reports.inc(1, ("late",))
+                self.write_stage.put({"minute": entry["data_starttime"] + 60, "entry": entry, "late": body["worker"]})
+                return({"status": "late"})
+
+            self.shard_reports.inc(1, ("accepted",))
+
+            covered = set()
+            for worker in entry["reports"]:
+                covered.update(entry["reports"][worker]["stations"])
+
+            if(covered.issuperset(entry["stations"])):
+                entry["ready"] = "complete"
+                self.finish_ready()
+
+        return({"status": "accepted"})
+
+
+    """
+    Hands the minutes that are ready to the write stage, oldest first. A minute that is ready waits for
+    the older ones, so the minutes are always written in order. Must be called with the lock held.
+    """
+    def finish_ready(self):
+        for key in sorted(self.minutes):
+            entry = self.minutes[key]
+
+            if(entry["ready"] is None):
+                break
+
+            self.minutes.pop(key)
+            self.finished[key] = entry
+            self.last_finished = key
+            self.minute_seconds.observe(max(self.clock.time() - (key + 60), 0.0), (entry["ready"],))
+            self.write_stage.put({"minute": entry["data_starttime"] + 60, "entry": entry, "late": None})
+
+        for key in list(self.finished):
+            if(key <= self.last_finished - 60 * LATE_MINUTES):
+                self.finished.pop(key)
+
+
+    """
+    Marks the minutes whose deadline has passed as ready, with whatever shards they have.
+    """
+    def finish_overdue(self):
+        now = self.clock.time()
+
+        with self.lock:
+            for key in self.minutes:
+                if(self.minutes[key]["ready"] is None and self.minutes[key]["deadline"] <= now):
+                    self.minutes[key]["ready"] = "deadline"
+
+            self.finish_ready()
+
+
+    """
+    The shards of a minute that are missing: for each worker the minute was assigned to (or "unassigned" if there were
+    no workers), the stations nobody reported.
+    """
+    def missing_shards(self, entry):
+        covered = set()
+        for worker in entry["reports"]:
+            covered.update(entry["reports"][worker]["stations"])
+
+        result = {}
+        for worker in entry["assignment"]:
+            stations = [s for s in entry["assignment"][worker] if s not in covered]
+            if(len(stations) > 0):
+                result[worker] = stations
+
+        unassigned = [s for s in entry["stations"] if s not in covered and not any(s in stations for stations in entry["assignment"].values())]
+        if(len(unassigned) > 0):
+            result["unassigned"] = unassigned
+
+        return(result)
+
+
+    """
+    Merges the shards of a minute into the results for the whole network, the same way the dsp workers of a single logger are merged.
+    """
+    def merge(self, entry):
+        reports = list(entry["reports"].values())
+        rsam_results = {}
+        window_results = {}
+
+        for component in entry["components"]:
+            rsam_results[component] = logger.merge_rsam_results([r["rsam_results"][component] for r in reports], len(entry["filters"]), entry["stations"])
+
+            shard_windows = []
+            for r in reports:
+                windows = {}
+                for window in entry["windows"]:
+                    windows[window] = r["window_results"][component][str(window)]
+                shard_windows.append(windows)
+
+            window_results[component] = logger.merge_window_results(shard_windows, len(entry["filters"]), entry["stations"], entry["windows"])
+
+        return(rsam_results, window_results)
+
+
+    """
+    Write stage: writes a finished minute to the day files, records its missing shards and hands the minute to the alerts,
+    or writes a minute again with a shard that came in late.
+    """
+    def write(self, item):
+        entry = item["entry"]
+        data_starttime = entry["data_starttime"]
+
+        with self.lock:
+            rsam_results, window_results = self.merge(entry)
+
+        for writer in self.writers:
+            bytes_written = writer.bytes_written
+
+            for component in entry["components"]:
+                if(item["late"] is None):
+                    logger.write_tremvlog_file(rsam_results[component], entry["filters"], entry["stations"], data_starttime, component, writer)
+                else:
+                    writer.overwrite([(data_starttime, rsam_results[component], entry["stations"])], entry["filters"], component)
+
+            self.bytes_written.inc(writer.bytes_written - bytes_written, (writer.format,))
+
+        bytes_written = self.window_writer.bytes_written
+        for component in entry["components"]:
+            self.window_writer.write_windows(window_results[component], entry["filters"], entry["stations"], data_starttime, component)
+
+        self.bytes_written.inc(self.window_writer.bytes_written - bytes_written, (self.window_writer.format,))
+
+        if(item["late"] is not None):
+            if(len(entry["components"]) > 0):
+                alert.push_minute(data_starttime, entry["filters"], entry["components"][0], rsam_results[entry["components"][0]])
+
+            write_shard_record(data_starttime, {item["late"]: entry["reports"][item["late"]]["stations"]}, "late")
+            logging.info("Wrote the late shard of " + item["late"] + " into " + str(data_starttime) + ".")
+            return(None)
+
+        missing = self.missing_shards(entry)
+
+        if(len(missing) > 0):
+            write_shard_record(data_starttime, missing, "missing")
+            self.missing_shard_count.inc(len(missing))
+            for worker in missing:
+                self.missing_stations.inc(len(missing[worker]))
+            logging.error("Shards missing for " + str(data_starttime) + ": " + ", ".join([w + " (" + str(len(missing[w])) + " stations)" for w in sorted(missing)]))
+
+        logging.info("Wrote " + str(data_starttime) + " from " + str(len(entry["reports"])) + " shards.")
+
+        if(entry["alert_on"] and len(entry["components"]) > 0):
+            item["rsam_results"] = rsam_results
+            self.alerts.notify(item)
+
+        return(None)
+
+
+    """
+    Runs the alert module on a minute that has been written, on the thread of self.alerts, like the logger does.
+    """
+    def run_alert(self, item):
+        entry = item["entry"]
+
+        rsam_results = None
+        if(item["follows"]):
+            rsam_results = item["rsam_results"][entry["components"][0]]
+
+        alert.main(entry["data_starttime"], entry["filters"], entry["components"][0], None, rsam_results)
+
+
+    """
+    Checks for dead workers and overdue minutes a few times a second.
+    """
+    def watch(self):
+        while(True):
+            self.expire_workers()
+            self.finish_overdue()
+            time.sleep(0.25)
+
+
+    def run(self):
+        self.write_stage = pipeline.stage("write", self.write, self.stats, queue_size=LATE_MINUTES)
+        self.write_stage.start()
+        self.alerts.start()
+
+        # Opening the catalog writes the text files of events that were going on when the coordinator last stopped.
+        if("alert_on" in self.config.config and self.config["alert_on"] == True):
+            alert.catalog_store()
+
+        threading.Thread(target=self.httpd.serve_forever, name="coordinator_server_thread", daemon=True).start()
+        threading.Thread(target=self.watch, name="coordinator_watch_thread", daemon=True).start()
+        logging.info("Coordinating workers on port " + str(self.httpd.server_address[1]) + ".")
+
+        def on_minute(minute):
+            self.config.reload()
+
+            with self.lock:
+                self.open_minute(int(minute.timestamp) - 60)
+
+        scheduler = pipeline.minuteScheduler(on_minute, self.stats, None, self.clock)
+        scheduler.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coordinate logger workers that each process a share of the network.")
+    parser.add_argument("--config", default="config.json")
+    args = parser.parse_args()
+
+    coordinator(args.config).run()
+
+
+if(__name__ == "__main__"):
+    main()
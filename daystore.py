@@ -0,0 +1,479 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import os
+import sys
+import struct
+import argparse
+import logging
+import threading
+import numpy
+from obspy import UTCDateTime
+import common
+
+"""
+Binary storage for the rsam results: one file per (day, filter, component), next to the csv files, with the extension .bin.
+
+Layout (little endian):
+    header:     magic "TREMVDAY", version (uint32), capacity (uint32), station count (uint32),
+                minutes per day (uint32), start of the day in seconds since the epoch (int64)
+    stations:   capacity x 16 bytes, ascii station names padded with zeroes
+    validity:   one bit per minute, set when the minute has been written
+    data:       minutes x capacity float32, one row per minute
+
+Each file is preallocated for the whole day, so writing minute t is a store of one row at a fixed offset
+and a reader can slice out any minute range without parsing anything. Stations that join during the day
+take one of the spare columns (capacity is larger than the station count) so the file isn't rewritten.
+
+The sub minute rsam ("rsam_windows" in config.json) is stored the same way, in a file per window length
+with a _10s (for 10 seconds) suffix, where a "minute" of the layout is one window: 8640 rows per day for 10 seconds.
+"""
+
+MAGIC = b"TREMVDAY"
+VERSION = 1
+HEADER_FORMAT = "<8sIIIIq"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+NAME_SIZE = 16
+MINUTES_PER_DAY = 1440
+
+
+"""
+Name of the binary file for a day, filter and component. resolution is the rsam window length in seconds,
+anything but the default 60 gets its own file.
+"""
+def generate_filename(date, f, component, resolution=60):
+    suffix = ".bin"
+    if(resolution != 60):
+        suffix = "_" + str(resolution) + "s.bin"
+
+    return(common.generate_tremvlog_filename(date, f, component)[:-len(".csv")] + suffix)
+
+
+"""
+A memory mapped binary day file.
+"""
+class dayFile:
+    def __init__(self, filename, mode="r"):
+        self.filename = filename
+        self.mode = mode
+
+        with open(filename, "rb") as f:
+            magic, version, capacity, station_count, minutes, day_start = struct.unpack(HEADER_FORMAT, f.read(HEADER_SIZE))
+
+        if(magic != MAGIC or version != VERSION):
+            raise Exception(filename + " is not a tremvlog day file.")
+
+        self.capacity = capacity
+        self.minutes = minutes
+        self.day_start = UTCDateTime(day_start)
+
+        names_offset = HEADER_SIZE
+        validity_offset = names_offset + capacity * NAME_SIZE
+        data_offset = data_offset_for(capacity, minutes)
+
+        self.names = numpy.memmap(filename, dtype="S" + str(NAME_SIZE), mode=mode, offset=names_offset, shape=(capacity,))
+        self.validity = numpy.memmap(filename, dtype=numpy.uint8, mode=mode, offset=validity_offset, shape=((minutes + 7) // 8,))
+        self.data = numpy.memmap(filename, dtype="<f4", mode=mode, offset=data_offset, shape=(minutes, capacity))
+
+        self.stations = []
+        self.station_index = {}
+        for i in range(0, station_count):
+            self.add_station_name(self.names[i].decode())
+
+
+    def add_station_name(self, name):
+        self.station_index[name] = len(self.stations)
+        self.stations.append(name)
+
+
+    """
+    Creates a new, zeroed day file.
+
+    Parameters:
+        filename: path of the file.
+        day: UTCDateTime at the start of the day.
+        stations: station names to reserve columns for.
+        capacity: number of columns. Defaults to twice the number of stations (at least 32).
+    """
+    @staticmethod
+    def create(filename, day, stations, capacity=None, minutes=MINUTES_PER_DAY):
+        if(capacity is None):
+            capacity = max(32, 2 * len(stations))
+
+        data_offset = data_offset_for(capacity, minutes)
+
+        with open(filename, "wb") as f:
+            f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, capacity, 0, minutes, int(day.timestamp)))
+            f.truncate(data_offset + minutes * capacity * 4)
+
+        result = dayFile(filename, "r+")
+        result.add_stations(stations)
+        return(result)
+
+
+    """
+    Gives each of the stations a column if it doesn't have one already.
+    If the file runs out of spare columns it is copied into a new file with twice the capacity.
+    """
+    def add_stations(self, stations):
+        added = []
+        for name in stations:
+            if(name not in self.station_index):
+                added.append(name)
+
+        if(len(added) == 0):
+            return
+
+        if(len(self.stations) + len(added) > self.capacity):
+            self.grow(2 * (len(self.stations) + len(added)))
+
+        for name in added:
+            self.names[len(self.stations)] = name.encode()
+            self.add_station_name(name)
+
+        self.names.flush()
+
+        with open(self.filename, "r+b") as f:
+            f.seek(struct.calcsize("<8sII"))
+            f.write(struct.pack("<I", len(self.stations)))
+
+
+    def grow(self, capacity):
+        logging.info("Growing " + self.filename + " to " + str(capacity) + " stations.")
+        temp_path = self.filename + "temp"
+        bigger = dayFile.create(temp_path, self.day_start, self.stations, capacity, self.minutes)
+        bigger.data[:, 0:len(self.stations)] = self.data[:, 0:len(self.stations)]
+        bigger.validity[:] = self.validity[:]
+        bigger.flush()
+
+        os.replace(temp_path, self.filename)
+        self.__init__(self.filename, self.mode)
+
+
+    """
+    Stores one minute of data.
+
+    Parameters:
+        minute: minute of the day, 0 - 1439.
+        values: dictionary of station name -> value. Stations in the file that are not in values get 0.0.
+    """
+    def write(self, minute, values):
+        self.add_stations(list(values.keys()))
+
+        row = numpy.zeros(self.capacity, dtype="<f4")
+        for name in values:
+            row[self.station_index[name]] = values[name]
+
+        self.data[minute] = row
+        self.validity[minute // 8] |= numpy.uint8(1 << (minute % 8))
+
+
+    def flush(self):
+        self.names.flush()
+        self.validity.flush()
+        self.data.flush()
+
+
+    """
+    Returns a boolean array with one entry per minute of the day, True where the minute has been written.
+    """
+    def valid_minutes(self):
+        return(numpy.unpackbits(numpy.asarray(self.validity), bitorder="little")[0:self.minutes].astype(bool))
+
+
+    """
+    Returns the last minute of the day that has been written, or -1 if none have.
+    """
+    def last_valid_minute(self):
+        valid = numpy.flatnonzero(self.valid_minutes())
+        if(len(valid) == 0):
+            return(-1)
+        return(int(valid[-1]))
+
+
+    """
+    Returns a view of the data for minutes start to end (end not included), with one column per station
+    in the order of self.stations.
+    """
+    def read(self, start=0, end=MINUTES_PER_DAY):
+        return(self.data[start:end, 0:len(self.stations)])
+
+
+    """
+    Returns the file as a dictionary of station name -> list of values, from the start of the day up to
+    and including the last written minute, in the same form as common.read_tremvlog_file.
+    Minutes that were never written are 0.0.
+    """
+    def as_dict(self, start=0, end=None):
+        if(end is None):
+            end = self.last_valid_minute() + 1
+
+        data = self.read(start, end)
+        valid = self.valid_minutes()[start:end]
+        result = {}
+
+        for name in sorted(self.stations):
+            column = numpy.where(valid, data[:, self.station_index[name]], 0.0)
+            result[name] = column.astype(float).tolist()
+
+        return(result)
+
+
+def data_offset_for(capacity, minutes):
+    offset = HEADER_SIZE + capacity * NAME_SIZE + (minutes + 7) // 8
+    # Align the data to a page so that writing a minute touches as few pages as possible.
+    return(((offset + 4095) // 4096) * 4096)
+
+
+"""
+Reads a day of rsam data for a filter and component from the binary store.
+
+Parameters:
+    date: obspy UTCDateTime or python datetime for the day.
+    f: bandpass filter.
+    component: z, n or e.
+    start, end: minute range of the day to read (end not included). end defaults to the last written minute.
+        For a resolution under a minute, these are windows of the day instead of minutes.
+    resolution: rsam window length in seconds, 60 or one of "rsam_windows".
+
+Returns:
+    Dictionary of station name -> list of values, or None if there is no binary file for the day.
+"""
+def read_tremvlog_day(date, f, component, start=0, end=None, resolution=60):
+    filename = common.logger_output_path(date) + generate_filename(date, f, component, resolution)
+
+    if(not os.path.exists(filename)):
+        return(None)
+
+    return(dayFile(filename).as_dict(start, end))
+
+
+"""
+Reads the last written minute (or window, for a resolution under 60 seconds) of a day from the binary store.
+
+Returns:
+    Dictionary of station name -> value, or None if there is no binary file for the day.
+"""
+def read_tremvlog_latest(date, f, component, resolution=60):
+    filename = common.logger_output_path(date) + generate_filename(date, f, component, resolution)
+
+    if(not os.path.exists(filename)):
+        return(None)
+
+    day_file = dayFile(filename)
+    last = day_file.last_valid_minute()
+    result = {}
+
+    if(last >= 0):
+        data = day_file.read(last, last + 1)
+        for name in day_file.stations:
+            result[name] = float(data[0, day_file.station_index[name]])
+
+    return(result)
+
+
+"""
+Writes rsam results to the binary store. Has the same write_minute as the csv writer in logger.py,
+and keeps the day files it has written to open until the day is over.
+"""
+class dayStoreWriter:
+    def __init__(self):
+        self.files = {}#file path -> (day, dayFile, [last written minute since the epoch])
+        self.lock = threading.Lock()#the minute loop and the backfill thread both write through this
+        self.format = "binary"
+        self.bytes_written = 0
+
+
+    def open_file(self, file_path, timestamp, station_names, rows=MINUTES_PER_DAY):
+        day = int(timestamp.timestamp) // 86400
+
+        if(file_path not in self.files):
+            for path in list(self.files.keys()):
+                if(self.files[path][0] < day):
+                    self.files.pop(path)[1].flush()
+
+            if(os.path.exists(file_path)):
+                day_file = dayFile(file_path, "r+")
+            else:
+                day_file = dayFile.create(file_path, UTCDateTime(day * 86400), sorted(station_names), minutes=rows)
+
+            self.files[file_path] = (day, day_file, [day * MINUTES_PER_DAY + day_file.last_valid_minute()])
+
+        return(self.files[file_path])
+
+
+    """
+    Writes one minute of rsam results for each filter.
+
+    Returns:
+        A list of (first minute, last minute) gaps since the last written minute, in minutes since the epoch,
+        the same as tremvlogWriter.write_minute in logger.py.
+    """
+    def write_minute(self, rsam_results, filters, station_names, timestamp, channel):
+        with self.lock:
+            return(self.write_minute_locked(rsam_results, filters, station_names, timestamp, channel, True))
+
+
+    def write_minute_locked(self, rsam_results, filters, station_names, timestamp, channel, live):
+        gaps = []
+        path = common.logger_output_path(timestamp)
+
+        if(os.path.exists(path) == False):
+            os.makedirs(path)
+
+        current_minute = int(timestamp.timestamp) // 60
+        minute = current_minute % MINUTES_PER_DAY
+
+        for filter_index in range(0, len(filters)):
+            file_path = path + generate_filename(timestamp, filters[filter_index], channel)
+            day, day_file, last_minute = self.open_file(file_path, timestamp, station_names)
+
+            values = {}
+            for name in station_names:
+                values[name] = rsam_results[filter_index].get(name, 0.0)
+
+            day_file.write(minute, values)
+            day_file.flush()
+            self.bytes_written += 4 * len(values)
+
+            if(live):
+                gap = (last_minute[0] + 1, current_minute - 1)
+                if(gap[1] >= gap[0] and gap not in gaps):
+                    gaps.append(gap)
+
+                last_minute[0] = current_minute
+
+        return(gaps)
+
+
+    """
+    Writes the sub minute rsam of one minute, each window length to its own day file (see generate_filename).
+
+    Parameters:
+        window_results: dictionary of window length in seconds -> list (one per filter) of dictionaries of station -> list of 60 / window values.
+        filters, station_names, timestamp, channel: as for write_minute.
+    """
+    def write_windows(self, window_results, filters, station_names, timestamp, channel):
+        with self.lock:
+            path = common.logger_output_path(timestamp)
+
+            if(os.path.exists(path) == False):
+                os.makedirs(path)
+
+            for window in window_results:
+                rows_per_minute = 60 // window
+                first_row = (int(timestamp.timestamp) % 86400) // window
+
+                for filter_index in range(0, len(filters)):
+                    file_path = path + generate_filename(timestamp, filters[filter_index], channel, window)
+                    day, day_file, last_minute = self.open_file(file_path, timestamp, station_names, 86400 // window)
+                    result_dict = window_results[window][filter_index]
+
+                    for row in range(0, rows_per_minute):
+                        values = {}
+                        for name in station_names:
+                            values[name] = 0.0
+                            if(name in result_dict):
+                                values[name] = result_dict[name][row]
+
+                        day_file.write(first_row + row, values)
+
+                    day_file.flush()
+                    self.bytes_written += 4 * len(station_names) * rows_per_minute
+
+
+    """
+    Stores backfilled minutes in place, same arguments as tremvlogWriter.overwrite in logger.py.
+    """
+    def overwrite(self, rows, filters, channel):
+        with self.lock:
+            for timestamp, rsam_results, station_names in rows:
+                self.write_minute_locked(rsam_results, filters, station_names, timestamp, channel, False)
+
+
+"""
+Converts a csv tremvlog file to a binary day file. Rows are placed by the minute of their timestamp.
+"""
+def convert_csv(csv_filename, bin_filename):
+    data = common.read_tremvlog_file(csv_filename)
+    timestamps = common.read_tremvlog_timestamps(csv_filename)
+    stations = sorted(data.keys())
+
+    if(len(timestamps) == 0):
+        return
+
+    first = UTCDateTime(timestamps[0])
+    day = UTCDateTime((int(first.timestamp) // 86400) * 86400)
+    day_file = dayFile.create(bin_filename, day, stations)
+
+    for i in range(0, len(timestamps)):
+        minute = (int(UTCDateTime(timestamps[i]).timestamp) // 60) % MINUTES_PER_DAY
+        values = {}
+        for name in stations:
+            values[name] = data[name][i]
+        day_file.write(minute, values)
+
+    day_file.flush()
+
+
+"""
+Exports a binary day file as a csv tremvlog file, with one line per written minute.
+"""
+def export_csv(bin_filename, csv_filename):
+    day_file = dayFile(bin_filename)
+    stations = sorted(day_file.stations)
+    valid = day_file.valid_minutes()
+    data = day_file.read()
+
+    output = open(csv_filename, "w")
+    output.write("TIMESTAMP" + common.delimiter() + common.delimiter().join(stations) + "\n")
+
+    for minute in numpy.flatnonzero(valid):
+        values = []
+        for name in stations:
+            values.append(str(float(data[minute, day_file.station_index[name]])))
+        output.write(str(day_file.day_start + int(minute) * 60) + common.delimiter() + common.delimiter().join(values) + "\n")
+
+    output.close()
+
+
+if(__name__ == "__main__"):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Convert between csv tremvlog files and binary day files.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    convert_parser = subparsers.add_parser("convert", help="create a .bin file next to every .csv file in a logger_output tree")
+    convert_parser.add_argument("root", nargs="?", default="logger_output")
+    convert_parser.add_argument("--overwrite", action="store_true", help="convert even if the .bin file exists")
+
+    export_parser = subparsers.add_parser("export", help="write a .bin file out as csv")
+    export_parser.add_argument("bin_file")
+    export_parser.add_argument("csv_file", nargs="?", default=None)
+
+    args = parser.parse_args()
+
+    if(args.command == "convert"):
+        for directory, _, filenames in os.walk(args.root):
+            for filename in sorted(filenames):
+                if(not filename.endswith(".csv")):
+                    continue
+
+                csv_filename = os.path.join(directory, filename)
+                bin_filename = csv_filename[:-len(".csv")] + ".bin"
+
+                if(os.path.exists(bin_filename) and not args.overwrite):
+                    continue
+
+                logging.info("Converting " + csv_filename)
+                convert_csv(csv_filename, bin_filename)
+    elif(args.command == "export"):
+        csv_filename = args.csv_file
+        if(csv_filename is None):
+            csv_filename = args.bin_file[:-len(".bin")] + ".csv"
+
+        export_csv(args.bin_file, csv_filename)
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,385 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import threading
+from fractions import Fraction
+import numpy
+from scipy.signal import iirfilter, sosfilt, sosfilt_zi, lfilter, lfilter_zi, firwin, resample_poly
+
+try:
+    # The compiled loop behind sosfilt, which filters in place. It is private, so we fall back to sosfilt without it.
+    from scipy.signal._sosfilt import _sosfilt
+except ImportError:
+    _sosfilt = None
+
+
+"""
+A set of station traces that share sampling rate and length, stacked into a 2-D array with one row per station.
+This lets us filter and average all of them with a single numpy/scipy call.
+"""
+class stationMatrix:
+    def __init__(self, names, data, sampling_rate):
+        self.names = names
+        self.data = data
+        self.sampling_rate = sampling_rate
+
+
+"""
+Groups traces by sampling rate and number of points and stacks each group into a stationMatrix.
+
+Parameters:
+    traces: obspy Stream (or a list of traces).
+
+Returns:
+    A list of stationMatrix objects, one per (sampling rate, npts) group.
+"""
+def stack_traces(traces):
+    groups = {}
+
+    for trace in traces:
+        key = (trace.stats.sampling_rate, trace.stats.npts)
+        if(key not in groups):
+            groups[key] = ([], [])
+
+        groups[key][0].append(trace.stats.station)
+        groups[key][1].append(trace.data)
+
+    result = []
+    for (sampling_rate, npts), (names, rows) in groups.items():
+        result.append(stationMatrix(names, numpy.vstack(rows).astype(numpy.float64, copy=False), sampling_rate))
+
+    return(result)
+
+
+"""
+Butterworth bandpass filters whose second order sections are designed once per (band, sampling rate, corners)
+and then reused every minute. The filtering itself is the same as obspy's Trace.filter("bandpass", ...),
+including the fallback to a highpass when the upper corner is at or above nyquist.
+"""
+class filterBank:
+    def __init__(self, corners=4, zerophase=True):
+        self.corners = corners
+        self.zerophase = zerophase
+        self.sos_cache = {}
+
+
+    """
+    Returns the second order sections for a band at a sampling rate, designing them on first use.
+    With dtype=numpy.float32 they are returned as a C contiguous float32 array, for filtering float32 data in place.
+    """
+    def sos(self, f, sampling_rate, dtype=numpy.float64):
+        key = (float(f[0]), float(f[1]), float(sampling_rate), self.corners, dtype)
+
+        if(dtype != numpy.float64):
+            if(key not in self.sos_cache):
+                self.sos_cache[key] = numpy.ascontiguousarray(self.sos(f, sampling_rate), dtype=dtype)
+
+            return(self.sos_cache[key])
+
+        if(key not in self.sos_cache):
+            nyquist = 0.5 * float(sampling_rate)
+            low = float(f[0]) / nyquist
+            high = float(f[1]) / nyquist
+
+            if(high - 1.0 > -1e-6):
+                sos = iirfilter(self.corners, low, btype="highpass", ftype="butter", output="sos")
+            elif(low > 1):
+                raise ValueError("Selected low corner frequency is above Nyquist.")
+            else:
+                sos = iirfilter(self.corners, [low, high], btype="band", ftype="butter", output="sos")
+
+            self.sos_cache[key] = sos
+
+        return(self.sos_cache[key])
+
+
+    """
+    Filters every row of a 2-D array with the band f.
+
+    Parameters:
+        data: 2-D numpy array, one row per station.
+        f: the bandpass filter as a pair of corner frequencies.
+        sampling_rate: sampling rate of the rows.
+
+    Returns:
+        A new 2-D array with the filtered rows.
+    """
+    def filter(self, data, f, sampling_rate):
+        sos = self.sos(f, sampling_rate)
+
+        if(self.zerophase):
+            firstpass = numpy.flip(sosfilt(sos, data, axis=-1), axis=-1)
+            return(numpy.flip(sosfilt(sos, firstpass, axis=-1), axis=-1))
+
+        return(sosfilt(sos, data, axis=-1))
+
+
+"""
+Resamples station data of any sampling rate to one working rate, e.g. 100, 50 or 200 Hz to 20 Hz.
+Each row is upsampled, low passed with a FIR anti alias filter and downsampled in a single polyphase pass
+(scipy's resample_poly), which has no phase shift. The filter is designed once per ratio of rates and reused every minute.
+It is the same Kaiser windowed filter that resample_poly designs by default, with the cutoff at the lower of the two nyquists.
+"""
+class polyphaseResampler:
+    def __init__(self, target_rate=20.0):
+        self.target_rate = target_rate
+        self.window_cache = {}
+
+
+    """
+    Returns (up, down), the smallest integers with sampling_rate * up / down = target_rate.
+    """
+    def ratio(self, sampling_rate):
+        ratio = (Fraction(self.target_rate) / Fraction(float(sampling_rate))).limit_denominator(1000)
+        return(ratio.numerator, ratio.denominator)
+
+
+    def window(self, up, down, dtype):
+        key = (up, down, dtype)
+
+        if(key not in self.window_cache):
+            max_rate = max(up, down)
+            half_len = 10 * max_rate
+            self.window_cache[key] = firwin(2 * half_len + 1, 1.0 / max_rate, window=("kaiser", 5.0)).astype(dtype)
+
+        return(self.window_cache[key])
+
+
+    """
+    Resamples every row of a 2-D array.
+
+    Returns:
+        A new 2-D array of the same dtype, with ceil(columns * up / down) columns.
+    """
+    def resample(self, data, sampling_rate):
+        up, down = self.ratio(sampling_rate)
+
+        if(up == down):
+            return(data.copy())
+
+        return(resample_poly(data, up, down, axis=-1, window=self.window(up, down, data.dtype)))
+
+
+"""
+Filter state of one stream (SEED identifier) in the streaming filter mode.
+"""
+class streamState:
+    def __init__(self, sampling_rate, factor):
+        self.sampling_rate = sampling_rate
+        self.factor = factor#counts to um, the state is only valid for one response
+        self.next_time = None#timestamp of the first sample that hasn't been filtered yet
+        self.resample_zi = None
+        self.phase = 0#index, in upsampled samples, of the next sample to keep after the anti alias filter
+        self.band_zi = {}#(low, high) -> zi of the bandpass filter
+
+
+"""
+Causal filtering that carries on from one minute to the next, instead of filtering each minute on its own
+with zero phase filters. The state of the anti alias filter and of every bandpass filter is kept per stream,
+so each minute only the samples that are new since the last minute are filtered, in a single forward pass.
+There are no edge transients at the minute boundaries, and a band costs half of a forward and backward pass.
+The price is the phase shift of causal filters, which doesn't matter for rsam.
+
+The state of a stream starts over when its data doesn't continue where the last minute ended
+(a gap, a restart or a minute that was skipped), when its sampling rate changes or when its response changes.
+It then starts from the steady state for the first sample, which keeps the start up transient small.
+
+Streams are always processed by the same worker (see workers.shard_traces), so every worker keeps its own states.
+"""
+class streamingFilterBank:
+    def __init__(self, filter_bank, resampler):
+        self.filter_bank = filter_bank
+        self.resampler = resampler
+        self.states = {}#SEED identifier -> streamState
+
+
+    """
+    Returns the state of the stream of trace and the samples of trace that haven't been filtered yet.
+    Trace usually starts with the last sample of the previous minute, which is dropped.
+    """
+    def new_samples(self, trace, factor):
+        sampling_rate = trace.stats.sampling_rate
+        state = self.states.get(trace.id)
+        skip = 0
+
+        if(state is not None and state.sampling_rate == sampling_rate and state.factor == factor and state.next_time is not None):
+            delta = 1.0 / sampling_rate
+            skip = int(round((state.next_time - trace.stats.starttime.timestamp) * sampling_rate))
+
+            if(skip < 0 or abs(trace.stats.starttime.timestamp + skip * delta - state.next_time) > 0.5 * delta):
+                state = None
+
+        else:
+            state = None
+
+        if(state is None):
+            state = streamState(sampling_rate, factor)
+            self.states[trace.id] = state
+            skip = 0
+
+        data = trace.data[skip:]
+        if(len(data) > 0):
+            state.next_time = trace.stats.starttime.timestamp + (skip + len(data)) / sampling_rate
+
+        return(state, data)
+
+
+    """
+    Causal version of polyphaseResampler.resample for rows that all continue from their states.
+    The rows are upsampled by inserting zeros, filtered with the anti alias filter and every down-th sample is kept.
+    All states must have the same phase.
+    """
+    def resample(self, states, data, sampling_rate):
+        up, down = self.resampler.ratio(sampling_rate)
+        h = self.resampler.window(up, down, numpy.float64) * up
+
+        if(up > 1):
+            upsampled = numpy.zeros((data.shape[0], data.shape[1] * up))
+            upsampled[:, ::up] = data
+        else:
+            upsampled = data
+
+        zi = numpy.empty((data.shape[0], len(h) - 1))
+        for i in range(0, len(states)):
+            if(states[i].resample_zi is None):
+                states[i].resample_zi = lfilter_zi(h, 1.0) * data[i, 0] / up
+
+            zi[i] = states[i].resample_zi
+
+        filtered, zf = lfilter(h, 1.0, upsampled, axis=-1, zi=zi)
+        phase = states[0].phase
+
+        for i in range(0, len(states)):
+            states[i].resample_zi = zf[i]
+            states[i].phase = (phase - upsampled.shape[1]) % down
+
+        return(filtered[:, phase::down])
+
+
+    """
+    Filters rows that all continue from their states with the band f, in a single causal pass.
+    """
+    def bandpass(self, states, data, f, sampling_rate):
+        sos = self.filter_bank.sos(f, sampling_rate)
+        key = (float(f[0]), float(f[1]))
+        zi = numpy.empty((sos.shape[0], data.shape[0], 2))
+
+        for i in range(0, len(states)):
+            if(key not in states[i].band_zi):
+                states[i].band_zi[key] = sosfilt_zi(sos) * data[i, 0]
+
+            zi[:, i, :] = states[i].band_zi[key]
+
+        filtered, zf = sosfilt(sos, data, axis=-1, zi=zi)
+
+        for i in range(0, len(states)):
+            states[i].band_zi[key] = zf[:, i, :]
+
+        return(filtered)
+
+
+"""
+Buffers for the float32 processing mode, kept from one minute to the next so a minute allocates
+(almost) nothing. Buffers are looked up by name and row length and only grow, by doubling, when there
+are more rows than before; callers get a view of the first rows.
+Each thread gets its own workspace from thread_workspace, since the dsp threads and the backfill thread
+can process minutes at the same time.
+"""
+class float32Workspace:
+    def __init__(self):
+        self.buffers = {}
+
+
+    def buffer(self, name, rows, shape):
+        key = (name, tuple(shape))
+        buf = self.buffers.get(key)
+
+        if(buf is None or buf.shape[0] < rows):
+            capacity = rows
+            if(buf is not None):
+                capacity = max(rows, 2 * buf.shape[0])
+
+            buf = numpy.empty((capacity,) + tuple(shape), dtype=numpy.float32)
+            self.buffers[key] = buf
+
+        return(buf[:rows])
+
+
+    def nbytes(self):
+        total = 0
+        for key in self.buffers:
+            total += self.buffers[key].nbytes
+
+        return(total)
+
+
+thread_local = threading.local()
+
+
+def thread_workspace():
+    if(not hasattr(thread_local, "workspace")):
+        thread_local.workspace = float32Workspace()
+
+    return(thread_local.workspace)
+
+
+"""
+Filters every row of a C contiguous 2-D float32 array in place with a causal pass of sos (float32 sections from filterBank).
+
+Parameters:
+    zi: float32 buffer of shape (rows, sections, 2) for the filter state, it is zeroed first.
+"""
+def sosfilt_inplace(sos, data, zi):
+    if(_sosfilt is not None):
+        zi[...] = 0.0
+        _sosfilt(sos, data, zi)
+    else:
+        data[...] = sosfilt(sos, data, axis=-1)
+
+
+"""
+Zero phase filtering of data in place: a forward pass, then a pass over the reversed result, like filterBank.filter.
+The reversed copy goes to scratch, which has the same shape as data.
+"""
+def sosfiltfilt_inplace(sos, data, scratch, zi):
+    sosfilt_inplace(sos, data, zi)
+    numpy.copyto(scratch, data[:, ::-1])
+    sosfilt_inplace(sos, scratch, zi)
+    numpy.copyto(data, scratch[:, ::-1])
+
+
+"""
+RSAM of every row of a 2-D array: the sum of absolute values divided by the number of points in a minute.
+With in_place=True the absolute values are written over data instead of into a new array.
+
+Returns:
+    1-D numpy array with one value per row.
+"""
+def rsam(data, sampling_rate, in_place=False):
+    pts_per_minute = int(sampling_rate * 60)
+
+    if(in_place):
+        return(numpy.abs(data, out=data).sum(axis=-1, dtype=numpy.float64) / pts_per_minute)
+
+    return(numpy.abs(data).sum(axis=-1) / pts_per_minute)
+
+
+"""
+RSAM of consecutive windows of every row, e.g. 6 windows of 10 seconds for a minute of data.
+Each window is the sum of absolute values divided by the number of points in the window.
+Only whole windows from the start of the rows are used; windows that the rows are too short for are 0.0.
+
+Returns:
+    2-D numpy array with one row per row of data and count columns.
+"""
+def rsam_windows(data, sampling_rate, window_seconds, count):
+    pts_per_window = int(sampling_rate * window_seconds)
+    available = min(count, data.shape[-1] // pts_per_window)
+    result = numpy.zeros((data.shape[0], count))
+
+    if(available > 0):
+        windows = data[:, 0:available * pts_per_window].reshape(data.shape[0], available, pts_per_window)
+        result[:, 0:available] = numpy.abs(windows).sum(axis=-1, dtype=numpy.float64) / pts_per_window
+
+    return(result)
@@ -5,65 +5,103 @@
 import errno
 import os
 import sys
+import json
 import time
-import schedule
+import queue
+import socket
+import urllib.request
+import numpy
 import obspy
 from obspy.clients.seedlink.basic_client import Client as seedlinkClient
 from obspy.clients.fdsn import Client as fdsnClient
 from obspy import UTCDateTime
 import common
 import alert
+import acquisition
+import dsp
+import workers
+import pipeline
+import metadata
+import daystore
+import metrics
 import threading
 import logging
 
 
+#Bandpass filter coefficients are designed once per band and sampling rate and reused every minute.
+filter_bank = dsp.filterBank(corners=4, zerophase=True)
+
+#All stations are processed at 20hz, whatever rate they are recorded at.
+WORKING_SAMPLING_RATE = 20.0
+resampler = dsp.polyphaseResampler(WORKING_SAMPLING_RATE)
+
+#Filter states for "filter_mode": "streaming", kept from one minute to the next.
+streaming_filters = dsp.streamingFilterBank(filter_bank, resampler)
+
+
 """ 
-Apply lowpass filter to the data and downsample it from 100 points per minute to 20 per minute.
+Resample the data of every station to 20hz and demean it.
+The anti alias filter and the change of rate are done in one zero phase polyphase pass (see dsp.polyphaseResampler),
+so 50hz, 100hz and 200hz stations all end up filtered the same way at the same rate.
 
 Parameters:
     stations: a obspy trace with the stations to pre process.
 
 Returns:
-    trace object which has been filtered, decimated and demeaned.
+    Stream with new traces which have been resampled and demeaned.
 """
 def process_station_data(stations):
-    result = stations.copy()
+    result = obspy.Stream()
 
-    #This is done in order to avoid the phase shift in the decimation process
-    #It is only 10hz because otherwise we run in to aliasing, since we decimate after(nyquist-shannon theorem)
-    result.filter("lowpass", freq=10.0, corners=2, zerophase=True)# this is super slow!
- 
-    #Down sample from 100hz to 20hz (100/5 = 20), no filter to avoid phase shift
-    for trace in result:
-        trace.decimate(5, no_filter=True)
- 
-    result.detrend("demean")
+    for matrix_traces in group_traces(stations):
+        sampling_rate = matrix_traces[0].stats.sampling_rate
+        resampled = resampler.resample(numpy.vstack([trace.data for trace in matrix_traces]).astype(numpy.float64, copy=False), sampling_rate)
+        resampled -= resampled.mean(axis=1, keepdims=True)
+
+        for i in range(0, len(matrix_traces)):
+            stats = matrix_traces[i].stats.copy()
+            stats.npts = resampled.shape[1]
+            stats.sampling_rate = WORKING_SAMPLING_RATE
+            result.append(obspy.Trace(resampled[i], header=stats))
 
     return(result)
 
 
+"""
+Groups traces with the same sampling rate and number of points, in the order they first appear.
+"""
+def group_traces(traces):
+    groups = {}
+
+    for trace in traces:
+        groups.setdefault((trace.stats.sampling_rate, trace.stats.npts), []).append(trace)
+
+    return(list(groups.values()))
+
+
 """ 
 Applies each bandpass filter to each station trace. 
-Each trace is added to a dictionary corresponding to the filter that was applied.
+The traces are stacked by sampling rate and length so each filter is applied once per group of stations,
+with filter coefficients that are designed once and cached in filter_bank.
 
 Parameters:
     traces: Obspy Stream object(list of traces)
     filters: A list of tuples which describe the bandpass filters to be applied.
 
 Returns:
-    A list of dictionaries where each dictionary corresponds to each filter applied.
-    Each dictionary contains the filtered traces.
+    A list of lists where each list corresponds to each filter applied.
+    Each list contains dsp.stationMatrix objects with the filtered station data.
 """
 def apply_bandpass_filters(traces, filters):
     passbands = []
+    stacked_stations = dsp.stack_traces(traces)
  
     for f in filters:
-        filtered_stations = {}
+        filtered_stations = []
  
-        for trace in traces:
-            t = trace.copy()
-            t.filter("bandpass", freqmin=float(f[0]), freqmax=float(f[1]), corners=4, zerophase=True)
-            filtered_stations[t.stats["station"]] = t
+        for matrix in stacked_stations:
+            filtered = filter_bank.filter(matrix.data, f, matrix.sampling_rate)
+            filtered_stations.append(dsp.stationMatrix(matrix.names, filtered, matrix.sampling_rate))
 
         passbands.append(filtered_stations)
 
@@ -71,11 +109,11 @@ def apply_bandpass_filters(traces, filters):
 
 
 """
-Takes in a list of dictionaries which contain station data that has been filtered with
+Takes in a list of lists which contain station data that has been filtered with
 a bandpass filter and averages the values.
 
 Parameters:
-    per_filter_filtered_stations: List of dictionaries which have been filtered with apply_bandpass_filters.
+    per_filter_filtered_stations: List of lists which have been filtered with apply_bandpass_filters.
     station_names: List of the names of the stations we are working with.
 
 Returns:
@@ -89,253 +127,692 @@ def rsam_processing(per_filter_filtered_stations, station_names):
         for name in station_names:
             rsam_stations[name] = 0.0
 
-            if(name in filtered_stations):
-                trace = filtered_stations[name]
-                pts_per_minute = int(trace.stats.sampling_rate * 60)
+        for matrix in filtered_stations:
+            values = dsp.rsam(matrix.data, matrix.sampling_rate)
+
+            for i in range(0, len(matrix.names)):
+                if(matrix.names[i] in rsam_stations):
+                    rsam_stations[matrix.names[i]] = float(values[i])
+
+        result.append(rsam_stations)
+
+    return(result)
+
+
+"""
+The sub minute version of rsam_processing: rsam of consecutive windows of each minute, for each window length in windows.
+
+Parameters:
+    per_filter_filtered_stations: List of lists which have been filtered with apply_bandpass_filters.
+    station_names: List of the names of the stations we are working with.
+    windows: window lengths in seconds, each one divides 60.
+
+Returns:
+    A dictionary of window length -> list (one per filter) of dictionaries of station -> list of 60 / window values.
+"""
+def rsam_window_processing(per_filter_filtered_stations, station_names, windows):
+    result = {}
+
+    for window in windows:
+        count = 60 // window
+        result[window] = []
+
+        for filtered_stations in per_filter_filtered_stations:
+            rsam_stations = {}
+            for name in station_names:
+                rsam_stations[name] = [0.0] * count
+
+            for matrix in filtered_stations:
+                values = dsp.rsam_windows(matrix.data, matrix.sampling_rate, window, count)
+
+                for i in range(0, len(matrix.names)):
+                    if(matrix.names[i] in rsam_stations):
+                        rsam_stations[matrix.names[i]] = values[i].tolist()
+
+            result[window].append(rsam_stations)
+
+    return(result)
+
+
+"""
+Instrument sensitivities taken from a response inventory, keyed by SEED identifier.
+Each identifier maps to a list of (start, end, counts_to_um) for every epoch of the channel,
+so the per minute correction is a dictionary lookup instead of a search through the inventory.
+"""
+class sensitivityTable:
+    def __init__(self, inventory):
+        self.table = {}
+
+        for network in inventory:
+            for station in network:
+                for channel in station:
+                    if(channel.response is None or channel.response.instrument_sensitivity is None):
+                        continue
+
+                    seed_identifier = network.code + "." + station.code + "." + channel.location_code + "." + channel.code
+                    counts_to_um = channel.response.instrument_sensitivity.value / 1000000
+                    epochs = self.table.setdefault(seed_identifier, [])
+                    epochs.append((channel.start_date, channel.end_date, counts_to_um))
+
+    """
+    Returns the counts to micrometers factor for a channel at a given time, or None if it has no response.
+    """
+    def lookup(self, seed_identifier, time):
+        if(seed_identifier not in self.table):
+            return(None)
+
+        for start, end, counts_to_um in self.table[seed_identifier]:
+            if((start is None or start <= time) and (end is None or time <= end)):
+                return(counts_to_um)
+
+        return(None)
+
+
+"""
+Converts each trace from counts to micrometers with a single multiply per trace.
+
+Parameters:
+    traces: obspy Stream with pre processed data.
+    sensitivity_table: sensitivityTable for the current response inventory.
+    time: the time used to pick the response epoch.
+
+Returns:
+    The corrected traces as an obspy Stream, and a list of SEED identifiers that had no response
+    and were therefore left out.
+"""
+def response_correction(traces, sensitivity_table, time):
+    corrected = obspy.Stream()
+    missing = []
+
+    for trace in traces:
+        counts_to_um = sensitivity_table.lookup(trace.id, time)
+
+        if(counts_to_um is None):
+            missing.append(trace.id)
+            continue
+
+        trace.data *= 1.0 / counts_to_um
+        corrected.append(trace)
+
+    return(corrected, missing)
+
+
+"""
+The per station part of the minute: pre processing, response correction, bandpass filtering and rsam.
+This is what runs on the dsp workers when "dsp_workers" is set, once per shard of stations.
+
+Parameters:
+    traces: obspy Stream (or list of traces) with raw data.
+    filters: A list of the bandpass filters to be applied.
+    sensitivity_table: sensitivityTable for the current response inventory.
+    response_time: the time used to pick the response epoch.
+    windows: sub minute rsam window lengths in seconds (see "rsam_windows"), computed from the same filtered data.
+
+Returns:
+    A list of dictionaries (one per filter) with rsam values for the stations in traces,
+    a list of SEED identifiers that had no response,
+    a dictionary with the duration in seconds of each step, for the metrics,
+    and the sub minute rsam values as returned by rsam_window_processing.
+"""
+def station_dsp(traces, filters, sensitivity_table, response_time, windows=()):
+    timings = {}
+
+    start = time.monotonic()
+    pre_processed_stations = process_station_data(obspy.Stream(traces))
+    timings["process_station_data"] = time.monotonic() - start
+
+    start = time.monotonic()
+    pre_processed_stations, missing_responses = response_correction(pre_processed_stations, sensitivity_table, response_time)
+    timings["response_correction"] = time.monotonic() - start
+
+    station_names = []
+    for trace in pre_processed_stations:
+        station_names.append(trace.stats.station)
+
+    start = time.monotonic()
+    per_filter_filtered_stations = apply_bandpass_filters(pre_processed_stations, filters)
+    timings["apply_bandpass_filters"] = time.monotonic() - start
+
+    start = time.monotonic()
+    rsam_results = rsam_processing(per_filter_filtered_stations, station_names)
+    window_results = rsam_window_processing(per_filter_filtered_stations, station_names, windows)
+    timings["rsam_processing"] = time.monotonic() - start
+
+    return(rsam_results, missing_responses, timings, window_results)
+
+
+"""
+The low memory version of station_dsp, used with "dsp_mode": "float32". Same arguments and results.
+Instead of copying the Stream for the pre processing and every trace again for every band in float64,
+the raw data of each group of stations with the same sampling rate and length is copied once into a float32 matrix,
+and after resampling, the response correction, bandpass filters and rsam all work in place on buffers
+from dsp.thread_workspace, which are reused from one minute to the next.
+The results differ from station_dsp by the float32 rounding, which is far below the resolution we care about.
+"""
+def station_dsp_float32(traces, filters, sensitivity_table, response_time, windows=()):
+    timings = {"process_station_data": 0.0, "response_correction": 0.0, "apply_bandpass_filters": 0.0, "rsam_processing": 0.0}
+    workspace = dsp.thread_workspace()
+    rsam_results = []
+    window_results = empty_window_results(filters, windows)
+    missing_responses = []
+    groups = {}
+
+    for f in filters:
+        rsam_results.append({})
+
+    for trace in traces:
+        counts_to_um = sensitivity_table.lookup(trace.id, response_time)
+
+        if(counts_to_um is None):
+            missing_responses.append(trace.id)
+            continue
+
+        groups.setdefault((trace.stats.sampling_rate, trace.stats.npts), []).append((trace, counts_to_um))
+
+    for (sampling_rate, npts), group in groups.items():
+        rows = len(group)
+
+        start = time.monotonic()
+        raw = workspace.buffer("raw", rows, (npts,))
+
+        for i in range(0, rows):
+            raw[i] = group[i][0].data
+
+        # Same as process_station_data: resample to 20hz, demean.
+        resampled = resampler.resample(raw, sampling_rate)
+        decimated_sampling_rate = WORKING_SAMPLING_RATE
+        columns = resampled.shape[1]
+        resampled -= resampled.mean(axis=1, dtype=numpy.float64, keepdims=True).astype(numpy.float32)
+        timings["process_station_data"] += time.monotonic() - start
+
+        start = time.monotonic()
+        factors = numpy.empty((rows, 1), dtype=numpy.float32)
+        for i in range(0, rows):
+            factors[i] = 1.0 / group[i][1]
+
+        resampled *= factors
+        timings["response_correction"] += time.monotonic() - start
+
+        start = time.monotonic()
+        scratch = workspace.buffer("band_scratch", rows, (columns,))
+        bands = []
+
+        for filter_index in range(0, len(filters)):
+            sos = filter_bank.sos(filters[filter_index], decimated_sampling_rate, numpy.float32)
+            band = workspace.buffer(("band", filter_index), rows, (columns,))
+            numpy.copyto(band, resampled)
+            dsp.sosfiltfilt_inplace(sos, band, scratch, workspace.buffer("band_zi", rows, sos.shape[:1] + (2,)))
+            bands.append(band)
+        timings["apply_bandpass_filters"] += time.monotonic() - start
+
+        start = time.monotonic()
+        for filter_index in range(0, len(filters)):
+            for window in windows:
+                window_values = dsp.rsam_windows(bands[filter_index], decimated_sampling_rate, window, 60 // window)
+                for i in range(0, rows):
+                    window_results[window][filter_index][group[i][0].stats.station] = window_values[i].tolist()
+
+            values = dsp.rsam(bands[filter_index], decimated_sampling_rate, in_place=True)
+
+            for i in range(0, rows):
+                rsam_results[filter_index][group[i][0].stats.station] = float(values[i])
+        timings["rsam_processing"] += time.monotonic() - start
+
+    return(rsam_results, missing_responses, timings, window_results)
+
+
+"""
+The continuous version of station_dsp, used for the live minutes with "filter_mode": "streaming". Same arguments and results.
+The anti alias filter and the bandpass filters are causal and carry on from the previous minute (see dsp.streamingFilterBank),
+so only the samples since the last minute are filtered, once per band, and there is no demean since the bandpass filters remove the mean.
+Stations that continue from the same phase of the resampler with the same number of new samples are filtered together.
+"""
+def station_dsp_streaming(traces, filters, sensitivity_table, response_time, windows=()):
+    timings = {"process_station_data": 0.0, "response_correction": 0.0, "apply_bandpass_filters": 0.0, "rsam_processing": 0.0}
+    rsam_results = []
+    window_results = empty_window_results(filters, windows)
+    missing_responses = []
+    groups = {}
+
+    for f in filters:
+        rsam_results.append({})
+
+    start = time.monotonic()
+    for trace in traces:
+        counts_to_um = sensitivity_table.lookup(trace.id, response_time)
+
+        if(counts_to_um is None):
+            missing_responses.append(trace.id)
+            continue
+
+        state, data = streaming_filters.new_samples(trace, counts_to_um)
+        if(len(data) == 0):
+            continue
+
+        groups.setdefault((trace.stats.sampling_rate, len(data), state.phase), []).append((trace.stats.station, state, data))
+    timings["process_station_data"] += time.monotonic() - start
+
+    for (sampling_rate, npts, phase), group in groups.items():
+        states = [member[1] for member in group]
+
+        start = time.monotonic()
+        resampled = streaming_filters.resample(states, numpy.vstack([member[2] for member in group]).astype(numpy.float64), sampling_rate)
+        timings["process_station_data"] += time.monotonic() - start
 
-                s = 0
-                for n in trace.data:
-                    s += abs(n)
+        start = time.monotonic()
+        factors = numpy.array([state.factor for state in states])
+        resampled /= factors[:, None]
+        timings["response_correction"] += time.monotonic() - start
 
-                rsam_stations[name] = s / pts_per_minute
+        for filter_index in range(0, len(filters)):
+            start = time.monotonic()
+            filtered = streaming_filters.bandpass(states, resampled, filters[filter_index], WORKING_SAMPLING_RATE)
+            timings["apply_bandpass_filters"] += time.monotonic() - start
+
+            start = time.monotonic()
+            for window in windows:
+                window_values = dsp.rsam_windows(filtered, WORKING_SAMPLING_RATE, window, 60 // window)
+                for i in range(0, len(group)):
+                    window_results[window][filter_index][group[i][0]] = window_values[i].tolist()
+
+            values = dsp.rsam(filtered, WORKING_SAMPLING_RATE, in_place=True)
+            for i in range(0, len(group)):
+                rsam_results[filter_index][group[i][0]] = float(values[i])
+            timings["rsam_processing"] += time.monotonic() - start
+
+    return(rsam_results, missing_responses, timings, window_results)
+
+
+"""
+Sub minute results with no stations, a dictionary of window length -> one empty dictionary per filter.
+"""
+def empty_window_results(filters, windows):
+    result = {}
+
+    for window in windows:
+        result[window] = []
+        for f in filters:
+            result[window].append({})
+
+    return(result)
+
+
+"""
+Merges the rsam results from each shard into one dictionary per filter that covers all stations in the network.
+Stations that no shard had data for get 0.0, the same as in rsam_processing.
+"""
+def merge_rsam_results(shard_results, filter_count, station_names):
+    result = []
+
+    for i in range(0, filter_count):
+        rsam_stations = {}
+        for name in station_names:
+            rsam_stations[name] = 0.0
+
+        for shard_rsam in shard_results:
+            for name in shard_rsam[i]:
+                if(name in rsam_stations):
+                    rsam_stations[name] = shard_rsam[i][name]
 
         result.append(rsam_stations)
 
     return(result)
 
 
+"""
+Merges the sub minute rsam results from each shard, like merge_rsam_results. Stations that no shard had data for get 0.0 in every window.
+"""
+def merge_window_results(shard_results, filter_count, station_names, windows):
+    result = {}
+
+    for window in windows:
+        result[window] = []
+
+        for i in range(0, filter_count):
+            rsam_stations = {}
+            for name in station_names:
+                rsam_stations[name] = [0.0] * (60 // window)
+
+            for shard_rsam in shard_results:
+                for name in shard_rsam[window][i]:
+                    if(name in rsam_stations):
+                        rsam_stations[name] = shard_rsam[window][i][name]
+
+            result[window].append(rsam_stations)
+
+    return(result)
+
+
 """ Determines channel -- z, n, or e -- for which RSAM data is being written.
+    For a selector with more than one component this is the first of them, see common.determine_components.
 """
 def determine_channel(selector):
+    components = common.determine_components(selector)
 
-    char_to_check = ["z", "n", "e"]
-    for char in char_to_check:
-        if(char in selector.lower()):
-            return(char)
-        break
+    if(len(components) == 0):
+        return(None)
+
+    return(components[0])
 
 
-""" Creates output files... (one per specified bandpass filter)
 """
-def write_tremvlog_file(rsam_results, filters, station_names, timestamp, channel):
-    path = common.logger_output_path(timestamp)
+Splits traces by component, the last letter of their channel in lower case. Traces of other components are left out.
+
+Returns:
+    A dictionary of component -> list of traces, with an entry for every component in components.
+"""
+def split_components(traces, components):
+    result = {}
+    for component in components:
+        result[component] = []
+
+    for trace in traces:
+        component = trace.stats.channel[-1:].lower()
+        if(component in result):
+            result[component].append(trace)
+
+    return(result)
+
 
-    if (os.path.exists(path) == False):
-        os.makedirs(path)
+"""
+Runs dsp_function (station_dsp or one of its variants) for each component of a minute of data that was fetched
+for all components at once, e.g. with "HH?". This is what runs on the dsp workers.
 
-    for filter_index in range(0, len(filters)):
-        filename = common.generate_tremvlog_filename(timestamp, filters[filter_index], channel)
-        file_path = path + filename
-        file_exists = os.path.exists(file_path)
+Returns:
+    A dictionary of component -> rsam results (a list of dictionaries, one per filter),
+    a list of SEED identifiers that had no response,
+    a dictionary with the duration in seconds of each step, summed over the components,
+    and a dictionary of component -> sub minute rsam results for the window lengths in windows.
+"""
+def components_dsp(traces, filters, sensitivity_table, response_time, components, dsp_function=station_dsp, windows=()):
+    rsam_results = {}
+    window_results = {}
+    missing_responses = []
+    timings = {}
 
-        # creates file for current filter and day if nonexistent
-        station_names.sort()  # sorts station names alphabetically
-        if (file_exists == False):
-            create_tremvlog_file(file_path, timestamp, station_names)
+    per_component = split_components(traces, components)
 
-        station_names_in_file = common.read_tremvlog_stations(file_path)
-        station_names_in_file.sort()  # sorts station names alphabetically
-        timestamps = common.read_tremvlog_timestamps(file_path)
+    for component in components:
+        component_rsam, component_missing, component_timings, component_windows = dsp_function(per_component[component], filters, sensitivity_table, response_time, windows)
+        rsam_results[component] = component_rsam
+        window_results[component] = component_windows
+        missing_responses += component_missing
 
-        stat_diff_data = station_difference(station_names_in_file, station_names, file_path, filter_index, filters)
+        for name in component_timings:
+            timings[name] = timings.get(name, 0.0) + component_timings[name]
 
-        # If station lists differ, must read the whole file in and re-write it
-        if (stat_diff_data != None):
-            new_station_names = []
-            for key in stat_diff_data:
-                new_station_names.append(key)
+    return(rsam_results, missing_responses, timings, window_results)
 
-            new_station_names.sort()  # sorts station names alphabetically
-            station_names_in_file = new_station_names  # updates station list in file with added stations
-            write_tremvlog_stat_differ(new_station_names, filter_index, path, file_path, filters, timestamp, timestamps, stat_diff_data, channel)
 
-        # "backfills" lines of missing data (as 0.0) if gap between previous and current minute
-        write_tremvlog_zeroes(file_path, timestamp)
+""" Creates output files... (one per specified bandpass filter)
+    Writes the current minute for each filter through writer, which keeps the state of each day file in memory.
+    Returns the gaps that were filled with 0.0, see tremvlogWriter.write_minute.
+"""
+def write_tremvlog_file(rsam_results, filters, station_names, timestamp, channel, writer=None):
+    if(writer is None):
+        writer = tremvlogWriter()
 
-        # writes current minute of RSAM data
-        write_tremvlog_rsam(file_path, timestamp, station_names_in_file, rsam_results, filter_index)
+    return(writer.write_minute(rsam_results, filters, station_names, timestamp, channel))
 
 
 """ If csv file does not exist for current day and filter, creates file. Writes station list as header.
     Also writes missing data as zeroes from start of day to current minute.
 """
 def create_tremvlog_file(filename, t, stations):
-    output = open(filename, "w")
-    output.write("TIMESTAMP" + common.delimiter())
-
-    # Writes station names at top of CSV file
-    for i in range(0, len(stations)):
-        output.write(stations[i])
-        if (i == len(stations) - 1):
-            output.write("\n")
-        else:
-            output.write(common.delimiter())
+    lines = ["TIMESTAMP" + common.delimiter() + common.delimiter().join(stations) + "\n"]
 
     minute_of_day = t.minute + t.hour * 60
+    zeroes = common.delimiter().join(["0.0"] * len(stations))
 
     # Fill in empty values in the file if it isn't created at midnight.
     for i in range(0, minute_of_day):
-        output.write(str(t - 60 * (minute_of_day - i)) + common.delimiter())
-
-        for j in range(0, len(stations)):
-            output.write(str(0.0))
-            if (j == len(stations) - 1):
-                output.write("\n")
-            else:
-                output.write(common.delimiter())
+        lines.append(str(t - 60 * (minute_of_day - i)) + common.delimiter() + zeroes + "\n")
 
+    output = open(filename, "w")
+    output.write("".join(lines))
     output.close()
 
 
-""" Returns list of lists with added stations and removed stations, comparing station names in config vs. output file.
+""" Reads the station names of the last segment and the timestamp of the last line of a csv file.
 """
-def station_difference(file_stats, stats, fp, filt_index, filt):
-    station_lists_differ = False
+def read_tremvlog_header_and_last_timestamp(filename):
+    stations = []
+    last_line = ""
+
+    input_file = open(filename, "r")
+
+    for line in input_file:
+        if(line.startswith("TIMESTAMP")):
+            stations = common.parse_tremvlog_header(line)
+        else:
+            last_line = line
 
-    # For added stations: determine if there is difference between config station_names list and output stations
-    added_stats = []
-    for name in stats:
-        # Checks if config file station names are same as data file station names
-        if (name not in file_stats):
-            station_lists_differ = True
-            added_stats.append(name)
+    input_file.close()
 
-    # For removed stations: data and station header will remain in output file until next day.
-    removed_stats = []
-    for name in file_stats:
-        # Checks if station names in file are same as config file station names
-        if (name not in stats):
-            station_lists_differ = True
-            removed_stats.append(name)
+    last_timestamp = None
+    if(len(last_line.strip()) > 0):
+        last_timestamp = UTCDateTime(last_line.split(common.delimiter())[0])
 
-    if (station_lists_differ == True):
-        data_in_file = common.read_tremvlog_file(fp)  # AKA "result"
-        minute_count = len(data_in_file[file_stats[1]])  # At 1 to ignore TIMESTAMP + stat names (first line)
+    return(stations, last_timestamp)
 
-        # account for stations that are not present in the file and fill those with zeroes in dictionary
-        for i in range(0, len(stats)):
-            name = stats[i]
 
-            if (name not in file_stats):
-                file_stats.insert(i, name)
-                data_in_file[name] = []
+""" Rewrites the lines of a csv file whose minute is in values (minute since the epoch -> dictionary of station -> rsam),
+    keeping the columns of the segment each line is in.
+"""
+def overwrite_tremvlog_lines(filename, values):
+    lines = []
+    stations = []
 
-                for j in range(0, minute_count):
-                    data_in_file[name].append(0.0)
+    input_file = open(filename, "r")
 
-        # writes in debug log which stations have been removed/added
-        if (filt_index == len(filt) - 1):
-            if (len(added_stats) > 0):
-                logging.info("Added stations: " + str(added_stats))
-            if (len(removed_stats) > 0):
-                logging.info("Removed stations: " + str(removed_stats))
+    for line in input_file:
+        if(line.startswith("TIMESTAMP")):
+            stations = common.parse_tremvlog_header(line)
+        else:
+            timestamp = line.split(common.delimiter(), 1)[0]
+            minute = int(UTCDateTime(timestamp).timestamp) // 60
 
-        return (data_in_file)
+            if(minute in values):
+                row = []
+                for name in stations:
+                    row.append(str(values[minute].get(name, 0.0)))
+                line = timestamp + common.delimiter() + common.delimiter().join(row) + "\n"
 
+        lines.append(line)
+
+    input_file.close()
 
-""" Reads and rewrites station data from file to include new stations. Inputs zeros for removed stations.
-    Writes note in log debug file to state which stations added or removed.
-"""
-def write_tremvlog_stat_differ(stations, filt_index, p, fp, filt, t, times, data, stat_channel):
     # Writes to an different file so that information isn't lost if the code crashes here
-    temp_path = p + "temp" + common.generate_tremvlog_filename(t, filt[filt_index], stat_channel)
+    temp_path = filename + "temp"
     output = open(temp_path, "w")
+    output.write("".join(lines))
+    output.close()
+
+    os.replace(temp_path, filename)
+
+
+"""
+Appends rsam results to the tremvlog csv files.
+The header and the last written minute of each open day file are kept in memory, so writing a minute is
+a single append per file. A file is only read when it is first opened (at startup or when a new day starts).
+When a station is added to the network during the day a new header line with the new station list is appended,
+starting a new segment of the file (see common.read_tremvlog_segments), so the file is never rewritten.
+Stations that leave the network stay in the file until the end of the day and get 0.0.
+"""
+class tremvlogWriter:
+    def __init__(self):
+        self.files = {}#file path -> {"day", "stations", "last_minute"}
+        self.lock = threading.Lock()#the backfill thread rewrites files that the minute loop appends to
+        self.format = "csv"
+        self.bytes_written = 0
+
 
-    output.write("TIMESTAMP" + common.delimiter())
-    stations.sort()  # sorts stations alphabetically for writing
-    for i in range(0, len(stations)):
-        output.write(stations[i])
+    """
+    Returns the cached state of a day file, reading it (or creating it) if this is the first time we see it.
+    """
+    def open_file(self, file_path, timestamp, station_names):
+        day = int(timestamp.timestamp) // 86400
+
+        if(file_path in self.files):
+            return(self.files[file_path])
+
+        # Forget about files from previous days.
+        for path in list(self.files.keys()):
+            if(self.files[path]["day"] < day):
+                self.files.pop(path)
 
-        if (i == len(stations) - 1):
-            output.write("\n")
+        gap = None
+
+        if(os.path.exists(file_path)):
+            stations, last_timestamp = read_tremvlog_header_and_last_timestamp(file_path)
+
+            #NOTE(thordur): added this to default the beginning of the day if there are no timestamps in a file(this happened...)
+            last_minute = day * 1440 - 1
+            if(last_timestamp is not None):
+                last_minute = int(last_timestamp.timestamp) // 60
         else:
-            output.write(common.delimiter())
+            stations = sorted(station_names)
+            create_tremvlog_file(file_path, timestamp, stations)
+            last_minute = int(timestamp.timestamp) // 60 - 1
 
-    for i in range(0, len(times)):
-        output.write(times[i] + common.delimiter())  # adds timestamp at beginning of lines in new file
+            if(last_minute >= day * 1440):
+                gap = (day * 1440, last_minute)
 
-        for j in range(0, len(stations)):
-            name = stations[j]
-            output.write(str(data[name][i]))
+        state = {"day": day, "stations": stations, "last_minute": last_minute, "station_names": sorted(station_names), "created_gap": gap}
+        self.files[file_path] = state
+        return(state)
 
-            if (j == len(stations) - 1):
-                output.write("\n")
-            else:
-                output.write(common.delimiter())
 
-    output.close()
+    """
+    Makes sure every station in station_names has a column in the file.
+    Logs which stations were added or removed compared to the last minute.
+
+    Returns:
+        The header line of a new segment if stations were added, otherwise an empty string.
+    """
+    def update_stations(self, file_path, state, station_names, log_changes):
+        added_stats = []
+        for name in station_names:
+            if(name not in state["stations"]):
+                added_stats.append(name)
 
-    # swap files
-    os.rename(fp, fp + "old")
-    os.rename(temp_path, fp)
-    os.remove(fp + "old")
+        header = ""
+        if(len(added_stats) > 0):
+            state["stations"] = sorted(state["stations"] + added_stats)
+            header = "TIMESTAMP" + common.delimiter() + common.delimiter().join(state["stations"]) + "\n"
 
+        if(log_changes and state["station_names"] != sorted(station_names)):
+            added = []
+            for name in station_names:
+                if(name not in state["station_names"]):
+                    added.append(name)
 
-""" Reads most recent timestamp of file and compares this to the current minute.
-    If there is more than one minute difference, input zeroes for missing data.
-"""
-def write_tremvlog_zeroes(filename, time):
-    # Read list of specific timestamps for file rewrite with station addition/removal
-    file_path = filename  # to import variable into read timestamp function below
+            removed = []
+            for name in state["station_names"]:
+                if(name not in station_names):
+                    removed.append(name)
 
-    timestamps = common.read_tremvlog_timestamps(file_path)  #### import this timestamps variable
-    station_names_in_file = common.read_tremvlog_stations(file_path)
+            # writes in debug log which stations have been removed/added
+            if(len(added) > 0):
+                logging.info("Added stations: " + str(added))
+            if(len(removed) > 0):
+                logging.info("Removed stations: " + str(removed))
 
-    # do the actual appending of new data...
-    output = open(filename, "a")
-    start_timestamp = time  # string of UTC starttime
+        state["station_names"] = sorted(station_names)
+        return(header)
 
-    if (os.path.exists(filename)):
-        #NOTE(thordur): added this to default the beginning of the day if there are no timestamps in a file(this happened...)
-        SEC_IN_DAY = 60*60*24
-        last_timestamp = UTCDateTime((int(UTCDateTime().timestamp) // SEC_IN_DAY) * SEC_IN_DAY)
 
-        if(len(timestamps) > 0):
-            last_timestamp = UTCDateTime(timestamps[-1])
+    """
+    Writes one minute of rsam results for each filter. Minutes missing since the last written line
+    are filled in with 0.0 in the same write.
+
+    Returns:
+        A list of (first minute, last minute) gaps that were filled with 0.0, in minutes since the epoch.
+    """
+    def write_minute(self, rsam_results, filters, station_names, timestamp, channel):
+        with self.lock:
+            return(self.write_minute_locked(rsam_results, filters, station_names, timestamp, channel))
+
+
+    def write_minute_locked(self, rsam_results, filters, station_names, timestamp, channel):
+        gaps = []
+        path = common.logger_output_path(timestamp)
+
+        if (os.path.exists(path) == False):
+            os.makedirs(path)
+
+        for filter_index in range(0, len(filters)):
+            file_path = path + common.generate_tremvlog_filename(timestamp, filters[filter_index], channel)
 
-        last_timestamp_minutes = int(last_timestamp.timestamp) // 60
-        current_timestamp_minutes = int(time.timestamp) // 60
+            state = self.open_file(file_path, timestamp, station_names)
+            previous_stations = state["stations"]
 
-        minute_delta = current_timestamp_minutes - last_timestamp_minutes
+            if(state["created_gap"] is not None and state["created_gap"] not in gaps):
+                gaps.append(state["created_gap"])
+            state["created_gap"] = None
+            header = self.update_stations(file_path, state, station_names, filter_index == len(filters) - 1)
 
-        for i in range(1, minute_delta):
-            output.write(str(UTCDateTime((last_timestamp_minutes + i) * 60)) + common.delimiter())
+            stations = state["stations"]
+            result_dict = rsam_results[filter_index]
+            current_minute = int(timestamp.timestamp) // 60
+            lines = []
 
-            for j in range(0, len(station_names_in_file)):
-                output.write(str(0.0))
+            # "backfills" lines of missing data (as 0.0) if gap between previous and current minute
+            if(current_minute - state["last_minute"] > 1):
+                zeroes = common.delimiter().join(["0.0"] * len(previous_stations))
+                gap = (state["last_minute"] + 1, current_minute - 1)
 
-                if (j == len(station_names_in_file) - 1):
-                    output.write("\n")
+                if(gap not in gaps):
+                    gaps.append(gap)
+
+                for minute in range(state["last_minute"] + 1, current_minute):
+                    lines.append(str(UTCDateTime(minute * 60)) + common.delimiter() + zeroes + "\n")
+
+            # new segment for stations that joined this minute
+            lines.append(header)
+
+            # writes current minute of RSAM data
+            values = []
+            for name in stations:
+                if(name in result_dict):
+                    values.append(str(result_dict[name]))
                 else:
-                    output.write(common.delimiter())
+                    values.append(str(0.0))
 
-        output.close()
+            lines.append(str(timestamp) + common.delimiter() + common.delimiter().join(values) + "\n")
 
+            text = "".join(lines)
+            output = open(file_path, "a")
+            output.write(text)
+            output.close()
 
-""" Called by write_tremvlog_file. Writes current minute of RSAM data to csv file.
-"""
-def write_tremvlog_rsam(filename, time, stations, rsam, filt_index):
-    # open output to append new data
-    output = open(filename, "a")
+            self.bytes_written += len(text.encode())
 
-    # Writes current RSAM data
-    output.write(str(time) + common.delimiter())
-    for i in range(0, len(stations)):
+            state["last_minute"] = current_minute
 
-        name = stations[i]
-        result_dict = rsam[filt_index]
+        return(gaps)
 
-        if (name in result_dict):
-            output.write(str(result_dict[name]))
-        else:
-            output.write(str(0.0))
 
-        if (i == len(stations) - 1):
-            output.write("\n")
-        else:
-            output.write(common.delimiter())
+    """
+    Replaces lines that were written as 0.0 with backfilled data. Each file is rewritten once.
+
+    Parameters:
+        rows: list of (timestamp, rsam results, station names) per minute, rsam results as for write_minute.
+        filters, channel: as for write_minute.
+    """
+    def overwrite(self, rows, filters, channel):
+        with self.lock:
+            for filter_index in range(0, len(filters)):
+                per_file = {}
+
+                for timestamp, rsam_results, station_names in rows:
+                    file_path = common.logger_output_path(timestamp) + common.generate_tremvlog_filename(timestamp, filters[filter_index], channel)
+                    per_file.setdefault(file_path, {})[int(timestamp.timestamp) // 60] = rsam_results[filter_index]
+
+                for file_path in per_file:
+                    if(os.path.exists(file_path)):
+                        overwrite_tremvlog_lines(file_path, per_file[file_path])
 
-    output.close()
 
 #NOTE: This stuff is needed so we get output from uncaught exceptions in the debug.log file
 def log_uncaught_exception_main(exc_type, exc_value, exc_traceback):
@@ -348,6 +825,198 @@ def log_uncaught_exception_threading(args):
 sys.excepthook = log_uncaught_exception_main
 threading.excepthook = log_uncaught_exception_threading
 
+"""
+Fills in minutes that the logger wrote as 0.0 (after an outage, a restart or a dropped minute) with real data.
+Gaps are handed over by the write stage and processed on a separate thread, so the live minute never waits for them.
+The data for a gap is fetched in batches of "backfill_batch_minutes" minutes with one request per batch, either from the
+seedlink server's buffer or from the FDSN dataselect service ("backfill_source": "seedlink" or "fdsn"),
+run through the same processing as the live data one minute at a time, and written over the placeholder lines.
+"""
+class backfiller:
+    def __init__(self, program, source="seedlink", batch_minutes=60, max_minutes=360):
+        self.program = program
+        self.source = source
+        self.batch_minutes = batch_minutes
+        self.max_minutes = max_minutes
+        self.queue = queue.Queue()
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.name = "backfill_thread"
+        self.thread.daemon = True
+
+
+    def start(self):
+        self.thread.start()
+
+
+    """
+    Queues gaps (as returned by write_tremvlog_file) for backfilling, for all components at once.
+    """
+    def put(self, gaps, filters, components):
+        for gap in gaps:
+            self.queue.put((gap, filters, components))
+
+
+    def run(self):
+        while(True):
+            (first, last), filters, components = self.queue.get()
+
+            if(last - first + 1 > self.max_minutes):
+                logging.info("Gap of " + str(last - first + 1) + " minutes is longer than backfill_max_minutes, only the last " + str(self.max_minutes) + " will be backfilled.")
+                first = last - self.max_minutes + 1
+
+            start = time.monotonic()
+            backfilled = 0
+
+            for batch_first in range(first, last + 1, self.batch_minutes):
+                batch_last = min(batch_first + self.batch_minutes - 1, last)
+
+                try:
+                    backfilled += self.backfill(batch_first, batch_last, filters, components)
+                except Exception:
+                    logging.exception("Could not backfill " + str(UTCDateTime(batch_first * 60)) + " - " + str(UTCDateTime(batch_last * 60)) + ".")
+
+            elapsed = time.monotonic() - start
+            self.program.stats.record_latency("backfill", elapsed)
+
+            logging.info("Backfilled " + str(backfilled) + " of " + str(last - first + 1) + " minutes from " + str(UTCDateTime(first * 60)) +
+                         " in %.1fs (%.2f minutes/s)." % (elapsed, backfilled / max(elapsed, 1e-9)))
+
+
+    def fetch(self, starttime, endtime):
+        config = self.program.config
+
+        if(self.source == "fdsn"):
+            if(self.program.fdsn is None):
+                self.program.fdsn_connect()
+
+            return(self.program.fdsn.get_waveforms(config["network"], config["station_wildcard"], config["location_wildcard"], config["channels"], starttime, endtime))
+
+        seedlink = seedlinkClient(config["seedlink_address"], config["seedlink_port"], 30, False)
+        return(seedlink.get_waveforms(config["network"], config["station_wildcard"], config["location_wildcard"], config["channels"], starttime, endtime))
+
+
+    """
+    Backfills the minutes first to last (minutes since the epoch, both included) with a single data request.
+
+    Returns:
+        The number of minutes that had data and were written.
+    """
+    def backfill(self, first, last, filters, components):
+        waveforms = self.fetch(UTCDateTime(first * 60), UTCDateTime((last + 1) * 60))
+
+        blacklist = []
+        if("station_blacklist" in self.program.config.config):
+            blacklist = self.program.config["station_blacklist"]
+
+        rows = []
+
+        for minute in range(first, last + 1):
+            data_starttime = UTCDateTime(minute * 60)
+            minute_waveforms = waveforms.slice(data_starttime, data_starttime + 60)
+
+            if(len(minute_waveforms) == 0):
+                continue
+
+            stations_in_network = self.program.metadata.stations_in_network(data_starttime, data_starttime + 60, blacklist)
+            rsam_results, window_results = self.program.compute_rsam(minute_waveforms, filters, data_starttime + 60, stations_in_network, components, live=False)
+            rows.append((data_starttime, rsam_results, stations_in_network, window_results))
+
+        for writer in self.program.writers:
+            for component in components:
+                writer.overwrite([(row[0], row[1][component], row[2]) for row in rows], filters, component)
+
+        for data_starttime, rsam_results, stations_in_network, window_results in rows:
+            for component in components:
+                self.program.window_writer.write_windows(window_results[component], filters, stations_in_network, data_starttime, component)
+
+            #The alerts keep the recent minutes in memory, so they need the backfilled values too.
+            if(len(components) > 0):
+                alert.push_minute(data_starttime, filters, components[0], rsam_results[components[0]])
+
+        return(len(rows))
+
+
+"""
+The connection of a logger to the coordinator (coordinator.py) when it runs as a worker of a sharded deployment.
+The worker asks the coordinator which of the stations are its share, and sends it the rsam rows of every minute
+instead of writing them itself. A background thread keeps sending heartbeats between the minutes, so the coordinator
+can tell when the worker has died and give its stations to the others.
+"""
+class coordinatorClient:
+    def __init__(self, address, name, heartbeat_seconds=5, timeout=10):
+        self.address = address.rstrip("/")
+        self.name = name
+        self.heartbeat_seconds = heartbeat_seconds
+        self.timeout = timeout
+        self.stations = None#the share of the stations from the last heartbeat, None until the coordinator has answered
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.name = "coordinator_heartbeat_thread"
+        self.thread.daemon = True
+
+
+    def start(self):
+        self.heartbeat()
+        self.thread.start()
+
+
+    def request(self, path, body):
+        request = urllib.request.Request(self.address + path, json.dumps(body).encode(), {"Content-Type": "application/json"})
+
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return(json.loads(response.read().decode()))
+
+
+    """
+    Tells the coordinator we are alive and gets our share of the stations.
+    If the coordinator can't be reached we keep the share we had.
+
+    Returns:
+        List of station codes, or None if the coordinator has never answered.
+    """
+    def heartbeat(self):
+        try:
+            self.stations = self.request("/heartbeat", {"worker": self.name})["stations"]
+        except Exception as e:
+            logging.error("Could not reach the coordinator at " + self.address + ".")
+            logging.info(e)
+
+        return(self.stations)
+
+
+    def run(self):
+        while(True):
+            time.sleep(self.heartbeat_seconds)
+            self.heartbeat()
+
+
+    """
+    Sends the rsam rows of a minute (an item of the minute pipeline) to the coordinator.
+    """
+    def report(self, item):
+        body = {
+            "worker": self.name,
+            "data_starttime": item["data_starttime"].timestamp,
+            "stations": item["stations_in_network"],
+            "filters": item["filters"],
+            "components": item["components"],
+            "windows": item["windows"],
+            "rsam_results": item["rsam_results"],
+            "window_results": item["window_results"],
+        }
+
+        try:
+            status = self.request("/rows", body)["status"]
+        except Exception as e:
+            logging.error("Could not send " + str(item["data_starttime"]) + " to the coordinator.")
+            logging.info(e)
+            return
+
+        if(status != "accepted"):
+            logging.error("The coordinator took " + str(item["data_starttime"]) + " as " + status + ".")
+
+
 """
 Class that encapsulates the state and the main loop of the program.
 The program relies on a FDSN connection for metadata and response information,
@@ -362,11 +1031,28 @@ class program:
         )
 
         self.exit = False#used so we can tell the program to exit from a thread
-        self.response_lock = threading.Lock()#Lock for the reading of the response inventory as the aquisition happens on another thread.
         self.response_inventory = None
-        self.metadata_inventory = None
+        self.metadata = None
+        self.sensitivity_table = None#Swapped in as a whole whenever a new response inventory is loaded, so readers never need a lock.
         self.fdsn = None
+        self.seedlink_stream = None
+        self.dsp_pool = None
+        self.dsp_function = station_dsp#station_dsp_float32 with "dsp_mode": "float32"
+        self.live_dsp_function = station_dsp#station_dsp_streaming with "filter_mode": "streaming"
+        self.writers = []
+        self.window_writer = daystore.dayStoreWriter()#the sub minute rsam of "rsam_windows" always goes to the binary store
+        self.backfill = None
+        self.coordinator = None#coordinatorClient with "coordinator_address", when this logger is a worker of coordinator.py
+        self.stats = pipeline.pipelineStats()
+        self.alerts = None#minuteConsumer that runs the alerts for every written minute
         self.config = common.config("config.json")
+        self.metrics = metrics.registry()
+        self.setup_metrics()
+        self.clock = pipeline.wallClock()
+
+        if("clock_file" in self.config.config):
+            self.clock = pipeline.simulatedClock.load(self.config["clock_file"])
+            logging.info("Using the simulated clock in " + self.config["clock_file"] + " (" + str(self.clock.speed) + "x), it is now " + str(UTCDateTime(self.clock.time())) + ".")
 
         if("fdsn_address" not in self.config.config):
             raise Exception("You need to define the FDSN server address in config.json with \"fdsn_address\".")
@@ -405,6 +1091,154 @@ class program:
         else:
             self.fetch_response_inventory()
 
+        output_formats = ["csv"]
+        if("output_formats" in self.config.config):
+            output_formats = self.config["output_formats"]
+
+        if("csv" in output_formats):
+            self.writers.append(tremvlogWriter())
+        if("binary" in output_formats):
+            self.writers.append(daystore.dayStoreWriter())
+
+        self.dsp_function = station_dsp
+        if("dsp_mode" in self.config.config and self.config["dsp_mode"] == "float32"):
+            logging.info("Using the float32 dsp path.")
+            self.dsp_function = station_dsp_float32
+
+        #The streaming filters need the minutes in order, so the backfill keeps using dsp_function.
+        self.live_dsp_function = self.dsp_function
+        if("filter_mode" in self.config.config and self.config["filter_mode"] == "streaming"):
+            logging.info("Using streaming filters for the live minutes.")
+            self.live_dsp_function = station_dsp_streaming
+
+        if("coordinator_address" in self.config.config):
+            name = socket.gethostname() + "-" + str(os.getpid())
+            if("worker_name" in self.config.config):
+                name = self.config["worker_name"]
+
+            heartbeat_seconds = 5
+            if("heartbeat_seconds" in self.config.config):
+                heartbeat_seconds = self.config["heartbeat_seconds"]
+
+            logging.info("Running as worker " + name + " of the coordinator at " + self.config["coordinator_address"] + ".")
+            self.coordinator = coordinatorClient(self.config["coordinator_address"], name, heartbeat_seconds)
+            self.coordinator.start()
+
+        refresh_minutes = 60
+        if("metadata_refresh_minutes" in self.config.config):
+            refresh_minutes = self.config["metadata_refresh_minutes"]
+
+        self.metadata = metadata.metadataCache(self.config["fdsn_address"], self.config["network"], self.config["metadata_filename"], refresh_minutes)
+        self.metadata.listeners.append(self.record_step)
+
+        try:
+            self.metadata.start()
+        except Exception as e:
+            logging.error(str(e) + " Aborting program.")
+            sys.exit(1)
+
+        if("seedlink_streaming" in self.config.config and self.config["seedlink_streaming"] == True):
+            self.start_seedlink_stream()
+
+        if("backfill" in self.config.config and self.config["backfill"] == True):
+            source = "seedlink"
+            if("backfill_source" in self.config.config):
+                source = self.config["backfill_source"]
+
+            batch_minutes = 60
+            if("backfill_batch_minutes" in self.config.config):
+                batch_minutes = self.config["backfill_batch_minutes"]
+
+            max_minutes = 360
+            if("backfill_max_minutes" in self.config.config):
+                max_minutes = self.config["backfill_max_minutes"]
+
+            self.backfill = backfiller(self, source, batch_minutes, max_minutes)
+            self.backfill.start()
+
+        alert_queue_minutes = 30
+        if("alert_queue_minutes" in self.config.config):
+            alert_queue_minutes = self.config["alert_queue_minutes"]
+
+        self.alerts = pipeline.minuteConsumer("alert", self.run_alert, self.stats, alert_queue_minutes)
+        self.alerts.listeners.append(lambda seconds: self.alert_latency.observe(seconds))
+        self.alerts.start()
+
+        # Opening the catalog writes the text files of events that were going on when the logger last stopped.
+        if("alert_on" in self.config.config and self.config["alert_on"] == True and self.coordinator is None):
+            alert.catalog_store()
+
+        if("dsp_workers" in self.config.config and self.config["dsp_workers"] > 0):
+            worker_type = "process"
+            if("dsp_worker_type" in self.config.config):
+                worker_type = self.config["dsp_worker_type"]
+
+            logging.info("Starting " + str(self.config["dsp_workers"]) + " dsp workers (" + worker_type + ").")
+            self.dsp_pool = workers.workerPool(components_dsp, self.config["dsp_workers"], worker_type)
+
+        if("metrics_port" in self.config.config):
+            address = "127.0.0.1"
+            if("metrics_address" in self.config.config):
+                address = self.config["metrics_address"]
+
+            metrics.metricsServer(self.metrics, address, self.config["metrics_port"]).start()
+
+
+    """
+    Creates the metrics that are served on the metrics endpoint when "metrics_port" is set.
+    Stage latencies, overruns and skipped minutes come from self.stats, the rest is recorded where it happens.
+    """
+    def setup_metrics(self):
+        self.step_seconds = self.metrics.histogram("tremv_step_seconds", "Duration of each step of the minute.", ["step"])
+        self.stage_seconds = self.metrics.histogram("tremv_stage_seconds", "Duration of each pipeline stage and background task.", ["stage"])
+        self.stations_expected = self.metrics.counter("tremv_stations_expected_total", "Stations in the network, summed over minutes.")
+        self.stations_received = self.metrics.counter("tremv_stations_received_total", "Stations in the network that we got data for, summed over minutes.")
+        self.stations_expected_last = self.metrics.gauge("tremv_stations_expected", "Stations in the network in the last minute.")
+        self.stations_received_last = self.metrics.gauge("tremv_stations_received", "Stations in the network that we got data for in the last minute.")
+        self.dropped_traces = self.metrics.counter("tremv_dropped_traces_total", "Traces that were received but not written.", ["reason"])
+        self.bytes_written = self.metrics.counter("tremv_bytes_written_total", "Bytes written to the output files.", ["format"])
+        self.minute_lag = self.metrics.gauge("tremv_minute_lag_seconds", "Seconds from the end of the last written minute until it was written.")
+        self.last_minute = self.metrics.gauge("tremv_last_written_minute_timestamp_seconds", "Start of the last written minute, seconds since the epoch.")
+
+        def overruns():
+            with self.stats.lock:
+                result = {}
+                for name in self.stats.overruns:
+                    result[(name,)] = self.stats.overruns[name]
+                return(result)
+
+        def skipped():
+            with self.stats.lock:
+                return({(): self.stats.skipped_minutes})
+
+        def alert_queue():
+            return({(): self.alerts.queue.qsize() if self.alerts is not None else 0})
+
+        def alert_failures():
+            return({(): self.alerts.failures if self.alerts is not None else 0})
+
+        self.metrics.counter("tremv_overruns_total", "Minutes dropped because a stage was still busy.", ["stage"], overruns)
+        self.metrics.counter("tremv_skipped_minutes_total", "Minutes the scheduler could not fire.", [], skipped)
+        self.metrics.gauge("tremv_alert_queue_minutes", "Written minutes waiting for the alerts.", [], alert_queue)
+        self.metrics.counter("tremv_alert_failures_total", "Minutes the alerts failed for.", [], alert_failures)
+        self.alert_latency = self.metrics.histogram("tremv_alert_latency_seconds", "Seconds from a minute being written until its alerts were done.")
+
+        self.stats.listeners.append(lambda name, seconds: self.stage_seconds.observe(seconds, (name,)))
+
+
+    def record_step(self, name, seconds):
+        self.step_seconds.observe(seconds, (name,))
+
+
+    """
+    Returns the sub minute rsam window lengths in seconds from "rsam_windows", e.g. [10, 15].
+    """
+    def rsam_windows(self):
+        if("rsam_windows" in self.config.config):
+            return(common.valid_rsam_windows(self.config["rsam_windows"]))
+
+        return([])
+
 
     """
     Tries to connect to the FDSN server. Does not abort on failure, since we might have the relevant information cached.
@@ -418,28 +1252,15 @@ class program:
             logging.info(e)
 
 
-    """
-    Tries to read metadata inventory from file. Aborts program on failure.
-    """
-    def read_metadata_from_file(self):
-        if(os.path.exists(self.config["metadata_filename"])):
-            logging.info("Falling back to metadata file.")
-            self.metadata_inventory = obspy.read_inventory(self.config["metadata_filename"])
-        else:
-            self.exit = True
-            logging.error("No metadata file was found. Aborting program.")
-            sys.exit(1)
-
-
     """
     Tries to read response inventory from file. Aborts program on failure.
     """
     def read_response_from_file(self):
         if(os.path.exists(self.config["response_filename"])):
             logging.info("Falling back to response file.")
-            self.response_lock.acquire()
-            self.response_inventory = obspy.read_inventory(self.config["response_filename"])
-            self.response_lock.release()
+            inv = obspy.read_inventory(self.config["response_filename"])
+            self.sensitivity_table = sensitivityTable(inv)
+            self.response_inventory = inv
         else:
             self.exit = True
             logging.error("No response file was found. Aborting program.")
@@ -451,12 +1272,16 @@ class program:
     """
     def fetch_response_inventory(self):
         logging.info("Fetching response inventory...")
+        start = time.monotonic()
+
+        if(self.fdsn is None):
+            self.fdsn_connect()
 
         try:
             inv = self.fdsn.get_stations(network=self.config["network"], station="*", level="response")
-            self.response_lock.acquire()
+            self.record_step("fdsn_response", time.monotonic() - start)
+            self.sensitivity_table = sensitivityTable(inv)
             self.response_inventory = inv
-            self.response_lock.release()
             self.response_inventory.write(self.config["response_filename"], format="STATIONXML")
             logging.info("Wrote response inventory to file.")
         except Exception as e:
@@ -468,6 +1293,54 @@ class program:
                 logging.info("Using cached response inventory.")
 
 
+    """
+    Starts the long lived seedlink connection that the minute loop slices its data from.
+    The buffers hold "seedlink_buffer_minutes" minutes of data per channel.
+    """
+    def start_seedlink_stream(self):
+        buffer_minutes = 5
+        if("seedlink_buffer_minutes" in self.config.config):
+            buffer_minutes = self.config["seedlink_buffer_minutes"]
+
+        self.seedlink_stream = acquisition.seedlinkStream(self.config["seedlink_address"], self.config["seedlink_port"],
+                                                          self.config["network"], self.config["station_wildcard"],
+                                                          self.config["location_wildcard"], self.config["channels"],
+                                                          buffer_minutes)
+        self.seedlink_stream.start()
+
+
+    """
+    Gets the raw data for the past minute, either from the seedlink stream buffers or with a new seedlink connection.
+
+    Returns:
+        obspy Stream, or None if no seedlink connection could be made.
+    """
+    def fetch_waveforms(self, starttime, endtime):
+        if(self.seedlink_stream is not None):
+            wait = 10
+            if("seedlink_stream_wait" in self.config.config):
+                wait = self.config["seedlink_stream_wait"]
+
+            # Give packets that straddle the end of the minute a chance to arrive before slicing.
+            if(not self.seedlink_stream.wait_for(endtime, wait)):
+                logging.info("Seedlink stream has no data up to " + str(endtime) + ", using what is buffered.")
+
+            return(self.seedlink_stream.get_waveforms(starttime, endtime))
+
+        seedlink = None
+
+        try:
+            seedlink = seedlinkClient(self.config["seedlink_address"], self.config["seedlink_port"], 5, False)
+        except Exception as e:
+            logging.error("Could not connect to seedlink server.")
+            logging.info(e)
+
+        if(seedlink is None):
+            return(None)
+
+        return(seedlink.get_waveforms(self.config["network"], self.config["station_wildcard"], self.config["location_wildcard"], self.config["channels"], starttime, endtime))
+
+
     def fetch_response_inventory_threaded(self):
         thread = threading.Thread(target=self.fetch_response_inventory)
         thread.name = "response_fetch_thread"
@@ -475,116 +1348,268 @@ class program:
 
 
     """
-    The main loop of the program.
-    Gets raw data for stations that are not on the blacklist(if it is present),
-    pre processes and filters it, and then averages the data and writes it to a file.
+    First stage of the minute: gets the station list from the metadata inventory and the raw data for the past minute.
+    Exits if the response fetch thread found nothing to work with.
+
+    Parameters:
+        item: dictionary with "minute", the UTCDateTime the minute was scheduled for.
+
+    Returns:
+        The dictionary with the raw waveforms and everything the later stages need, or None if there was no data.
     """
-    def main(self):
+    def acquire(self, item):
         if(self.exit):
             logging.info("Exiting from response fetch thread(file not found and unable to connect to the server).")
             sys.exit(1)
 
         self.config.reload()
-        self.fdsn_connect()
 
-        fetch_starttime = UTCDateTime()
+        fetch_starttime = item["minute"]
         data_starttime = fetch_starttime - 60
 
-        stations_in_network = []
+        blacklist = []
+        if("station_blacklist" in self.config.config):
+            blacklist = self.config["station_blacklist"]
 
-        try:
-            logging.info("Fetching metadata inventory...")
-            #NOTE: the station regex here isn't the same as for the seedlink connection...
-            metadata = self.fdsn.get_stations(network=self.config["network"], station="*", starttime=data_starttime, endtime=fetch_starttime)
-            self.metadata_inventory = metadata
-            self.metadata_inventory.write(self.config["metadata_filename"], format="STATIONXML")
-            logging.info("Wrote metadata inventory to file.")
-        except Exception as e:
-            logging.error("Could not get stations metadata from the fdsn server.")
-            logging.info(e)
-            if(self.metadata_inventory is None):
-                self.read_metadata_from_file()
-            else:
-                logging.info("Using cached metadata inventory.")
+        stations_in_network = self.metadata.stations_in_network(data_starttime, fetch_starttime, blacklist)
 
-        for s in self.metadata_inventory.networks[0]:
-            add_station = True
-            if("station_blacklist" in self.config.config):
-                if(s in self.config["station_blacklist"]):
-                    add_station = False
+        #A worker only processes its share of the stations, as of the last heartbeat of the background thread.
+        if(self.coordinator is not None):
+            share = self.coordinator.stations
 
-            if(add_station):
-                stations_in_network.append(s.code)
+            if(share is None):
+                logging.error("No stations from the coordinator yet, skipping the minute.")
+                return(None)
 
-        log_path = common.logger_output_path(fetch_starttime)
+            share = set(share)
+            stations_in_network = [name for name in stations_in_network if name in share]
 
-        if(os.path.exists(log_path) == False):
-            os.makedirs(log_path)
+            if(len(stations_in_network) == 0):
+                logging.info("The coordinator has no stations for this worker.")
+                return(None)
 
-        seedlink = None
+        logging.info("Fetching waveforms...")
+        start = time.monotonic()
+        received_station_waveforms = self.fetch_waveforms(data_starttime, fetch_starttime)
+        self.record_step("seedlink_fetch", time.monotonic() - start)
 
-        try:
-            seedlink = seedlinkClient(self.config["seedlink_address"], self.config["seedlink_port"], 5, False)
-        except Exception as e:
-            logging.error("Could not connect to seedlink server.")
-            logging.info(e)
+        if(received_station_waveforms is None):
+            return(None)
 
-        if(seedlink is not None):
-            logging.info("Fetching waveforms...")
-            received_station_waveforms = seedlink.get_waveforms(self.config["network"], self.config["station_wildcard"], self.config["location_wildcard"], self.config["channels"], data_starttime, fetch_starttime)
-            logging.info("Retrieval of metadata and waveforms took " + str(UTCDateTime() - fetch_starttime))
+        if(self.coordinator is not None):
+            received_station_waveforms = obspy.Stream([trace for trace in received_station_waveforms if trace.stats.station in share])
 
-            filters = self.config["filters"]
-            rsam_st = UTCDateTime()
+        logging.info("Retrieval of waveforms took " + str(self.clock.time() - fetch_starttime.timestamp))
 
-            pre_processed_stations = process_station_data(received_station_waveforms)
+        item["fetch_starttime"] = fetch_starttime
+        item["data_starttime"] = data_starttime
+        item["stations_in_network"] = stations_in_network
+        item["waveforms"] = received_station_waveforms
+        item["filters"] = self.config["filters"]
+        item["components"] = common.determine_components(self.config["channels"])
+        item["windows"] = self.rsam_windows()
+        #The coordinator runs the alerts for the whole network.
+        item["alert_on"] = "alert_on" in self.config.config and self.config["alert_on"] == True and self.coordinator is None
+        return(item)
 
-            self.response_lock.acquire()
-            for trace in pre_processed_stations:
-                name = trace.stats.station
-                seed_identifier = self.config["network"] + "." + name + ".." + self.config["channels"]
-                response = None
 
-                try:
-                    response = self.response_inventory.get_response(seed_identifier, fetch_starttime)
-                    counts_to_um = response.instrument_sensitivity.value / 1000000
+    """
+    Runs the per station processing on a minute of raw data and merges the results for all stations in the network,
+    for each of the components.
+    For the live minute (live is True) the dsp workers and the streaming filters are used if they are configured, and the metrics are recorded.
+    windows are the sub minute window lengths, the ones in "rsam_windows" if it is None.
+
+    Returns:
+        A dictionary of component -> rsam results, a list with one dictionary of station -> rsam per filter,
+        and a dictionary of component -> sub minute rsam results (see rsam_window_processing).
+    """
+    def compute_rsam(self, received_station_waveforms, filters, time, stations_in_network, components, live=True, windows=None):
+        dsp_function = self.dsp_function
+        if(live):
+            dsp_function = self.live_dsp_function
 
-                    for i in range(0, len(trace.data)):
-                        trace.data[i] /= counts_to_um
-                except Exception as e:
-                    logging.error(seed_identifier + ": " + str(e) + " Trace will be removed.")
-                    pre_processed_stations.remove(trace)
-            self.response_lock.release()
+        if(windows is None):
+            windows = self.rsam_windows()
 
-            per_filter_filtered_stations = apply_bandpass_filters(pre_processed_stations, filters)
-            rsam_results = rsam_processing(per_filter_filtered_stations, stations_in_network)
+        if(not live or self.dsp_pool is None):
+            shard_results = [components_dsp(received_station_waveforms, filters, self.sensitivity_table, time, components, dsp_function, windows)]
+        else:
+            shards = workers.shard_traces(received_station_waveforms, self.dsp_pool.worker_count)
+            shard_args = []
 
-            logging.info("Rsam calculation duration: " + str(UTCDateTime() - rsam_st))
+            # The table only goes to the workers again when a new response inventory has replaced it.
+            self.dsp_pool.set_shared("sensitivity_table", self.sensitivity_table)
 
-            station_channel = determine_channel(self.config["channels"])
-            write_tremvlog_file(rsam_results, filters, stations_in_network, data_starttime, station_channel)
+            for shard in shards:
+                if(len(shard) > 0):
+                    shard_args.append({"traces": shard, "filters": filters, "response_time": time, "components": components,
+                                       "dsp_function": dsp_function, "windows": windows})
+                else:
+                    shard_args.append(None)
 
-            datestr = str(data_starttime.year) + "." + str(data_starttime.month) + "." + str(data_starttime.day)
-            logging.info("Wrote to files " + datestr + " at: " + str(UTCDateTime()))
+            shard_results = [r for r in self.dsp_pool.run(shard_args) if r is not None]
 
-            if("alert_on" in self.config.config and self.config["alert_on"] == True):
-                try:
-                    def alert_hook():
-                    # Runs tremv_alert module
-                    alert.main(data_starttime, filters, station_channel, None)
-                except Exception as e:
-                    logging.error("Alert module could not be run.")
-                    logging.error(e)
+        missing_responses = []
+        for shard_rsam, shard_missing, shard_timings, shard_windows in shard_results:
+            missing_responses += shard_missing
+
+            if(live):
+                for name in shard_timings:
+                    self.record_step(name, shard_timings[name])
+
+        if(len(missing_responses) > 0):
+            logging.error("No response found for " + str(len(missing_responses)) + " traces, they will be removed: " + ", ".join(missing_responses))
+
+        if(live):
+            self.record_stations(received_station_waveforms, stations_in_network, missing_responses)
+
+        result = {}
+        window_result = {}
+        for component in components:
+            result[component] = merge_rsam_results([r[0][component] for r in shard_results], len(filters), stations_in_network)
+            window_result[component] = merge_window_results([r[3][component] for r in shard_results], len(filters), stations_in_network, windows)
+
+        return(result, window_result)
+
+
+    """
+    Counts the stations we got data for against the stations in the network, and the traces that were dropped,
+    either because they had no response or because their station is not in the network (e.g. blacklisted).
+    """
+    def record_stations(self, received_station_waveforms, stations_in_network, missing_responses):
+        received = []
+        not_in_network = 0
+
+        for trace in received_station_waveforms:
+            if(trace.id in missing_responses):
+                continue
+            elif(trace.stats.station not in stations_in_network):
+                not_in_network += 1
+            elif(trace.stats.station not in received):
+                received.append(trace.stats.station)
+
+        self.stations_expected.inc(len(stations_in_network))
+        self.stations_received.inc(len(received))
+        self.stations_expected_last.set(len(stations_in_network))
+        self.stations_received_last.set(len(received))
+        self.dropped_traces.inc(len(missing_responses), ("no_response",))
+        self.dropped_traces.inc(not_in_network, ("not_in_network",))
+
+
+    """
+    Second stage of the minute: pre processing, response correction, filtering and rsam, on the dsp workers if there are any.
+    """
+    def process(self, item):
+        rsam_st = UTCDateTime()
+        item["rsam_results"], item["window_results"] = self.compute_rsam(item.pop("waveforms"), item["filters"], item["fetch_starttime"], item["stations_in_network"], item["components"], True, item["windows"])
+
+        logging.info("Rsam calculation duration: " + str(UTCDateTime() - rsam_st))
+        return(item)
+
+
+    """
+    Third stage of the minute: writes the rsam results of each component to its tremvlog files,
+    or sends them to the coordinator if this logger is one of its workers.
+    """
+    def write(self, item):
+        data_starttime = item["data_starttime"]
+
+        #A worker's rows are written by the coordinator, together with the other shards.
+        if(self.coordinator is not None):
+            self.coordinator.report(item)
+            self.minute_lag.set(self.clock.time() - item["fetch_starttime"].timestamp)
+            self.last_minute.set(data_starttime.timestamp)
+            return(item)
+
+        gaps = []
+        for writer in self.writers:
+            start = time.monotonic()
+            bytes_written = writer.bytes_written
+
+            for component in item["components"]:
+                for gap in write_tremvlog_file(item["rsam_results"][component], item["filters"], item["stations_in_network"], data_starttime, component, writer):
+                    if(gap not in gaps):
+                        gaps.append(gap)
+
+            self.record_step("write_tremvlog_file", time.monotonic() - start)
+            self.bytes_written.inc(writer.bytes_written - bytes_written, (writer.format,))
+
+        bytes_written = self.window_writer.bytes_written
+        for component in item["components"]:
+            self.window_writer.write_windows(item["window_results"][component], item["filters"], item["stations_in_network"], data_starttime, component)
+
+        self.bytes_written.inc(self.window_writer.bytes_written - bytes_written, (self.window_writer.format,))
+
+        self.minute_lag.set(self.clock.time() - item["fetch_starttime"].timestamp)
+        self.last_minute.set(data_starttime.timestamp)
+
+        if(self.backfill is not None and len(gaps) > 0):
+            self.backfill.put(gaps, item["filters"], item["components"])
+
+        datestr = str(data_starttime.year) + "." + str(data_starttime.month) + "." + str(data_starttime.day)
+        logging.info("Wrote to files " + datestr + " at: " + str(UTCDateTime()))
+
+        #The minute is on disk, the alerts for it run on their own thread.
+        if(item["alert_on"] and len(item["components"]) > 0):
+            self.alerts.notify(item)
+
+        return(item)
+
+
+    """
+    Runs the alert module on a minute that has been written, on the thread of self.alerts.
+    The alerts are for the first component (z when it is fetched), so fetching the horizontals doesn't trigger every event three times.
+    The rsam results are handed to the alerts when the minute follows the last one they saw; after missed minutes
+    the alerts catch up from the files, which have everything up to this minute.
+    """
+    def run_alert(self, item):
+        rsam_results = None
+        if(item["follows"]):
+            rsam_results = item["rsam_results"][item["components"][0]]
+
+        start = time.monotonic()
+        alert.main(item["data_starttime"], item["filters"], item["components"][0], None, rsam_results)
+        self.record_step("alert_main", time.monotonic() - start)
+
+
+    """
+    Runs all stages of a single minute one after the other on the calling thread, except the alerts.
+    Gets raw data for stations that are not on the blacklist(if it is present),
+    pre processes and filters it, and then averages the data and writes it to a file.
+    """
+    def main(self, minute=None):
+        if(minute is None):
+            minute = UTCDateTime(self.clock.time())
+
+        item = self.acquire({"minute": minute})
+
+        if(item is not None):
+            self.write(self.process(item))
+
+
+    """
+    Runs the logger with each step of the minute on its own thread, so acquisition for minute t+1 can
+    start while minute t is still being processed or written. The stages are chained with small queues;
+    if a stage is still busy with an older minute the new one is dropped and counted as an overrun.
+    The alerts run after the write stage on their own consumer (self.alerts).
+    """
+    def run(self):
+        write_stage = pipeline.stage("write", self.write, self.stats)
+        dsp_stage = pipeline.stage("dsp", self.process, self.stats, write_stage)
+        acquire_stage = pipeline.stage("acquire", self.acquire, self.stats, dsp_stage, queue_size=1)
+
+        for s in [write_stage, dsp_stage, acquire_stage]:
+            s.start()
+
+        def on_minute(minute):
+            logging.info("Pipeline: " + self.stats.summary())
+            acquire_stage.put({"minute": minute})
+
+        scheduler = pipeline.minuteScheduler(on_minute, self.stats, self.fetch_response_inventory_threaded, self.clock)
+        scheduler.run()
 
 
 if __name__ == "__main__":
     p = program()
+    p.run()
 
-    #TODO: do the tasks queue up if they take longer than a minute for example?
-    scheduler = schedule.Scheduler()
-    scheduler.every().minute.at(":00").do(p.main)
-    scheduler.every().day.at("00:00").do(p.fetch_response_inventory_threaded)
-
-    while(True):
-        scheduler.run_pending()
-        time.sleep(1)
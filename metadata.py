@@ -0,0 +1,136 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import os
+import time
+import threading
+import logging
+import obspy
+from obspy.clients.fdsn import Client as fdsnClient
+
+
+"""
+Keeps the station metadata of the network in memory and refreshes it from the FDSN server on a background thread.
+The minute loop only ever reads the current snapshot, so it never waits on the FDSN server or the disk.
+The metadata file is only rewritten when the stations in the inventory have actually changed,
+and it is what we fall back to when the FDSN server can't be reached.
+"""
+class metadataCache:
+    def __init__(self, fdsn_address, network, filename, refresh_minutes=60):
+        self.fdsn_address = fdsn_address
+        self.network = network
+        self.filename = filename
+        self.refresh_seconds = refresh_minutes * 60
+        self.fdsn = None
+        self.signature = None
+        self.snapshot = None#tuple of (station code, start date, end date), replaced as a whole on every change
+        self.exit = False
+        self.listeners = []#functions called with ("fdsn_metadata", seconds) after every request to the FDSN server
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.name = "metadata_refresh_thread"
+        self.thread.daemon = True
+
+
+    """
+    Loads the metadata once on the calling thread, then keeps refreshing it in the background.
+    Raises if there is neither a FDSN server nor a metadata file to get the stations from.
+    """
+    def start(self):
+        self.refresh()
+
+        if(self.snapshot is None):
+            raise Exception("No metadata file was found and the fdsn server could not be reached.")
+
+        self.thread.start()
+
+
+    def run(self):
+        while(not self.exit):
+            time.sleep(self.refresh_seconds)
+            self.refresh()
+
+
+    """
+    Fetches the inventory from the FDSN server and swaps in a new snapshot if the stations changed.
+    Falls back to the metadata file if we have nothing cached and the server can't be reached.
+    """
+    def refresh(self):
+        start = time.monotonic()
+
+        try:
+            if(self.fdsn is None):
+                logging.info("Connecting to fdsn server...")
+                self.fdsn = fdsnClient(self.fdsn_address)
+
+            logging.info("Fetching metadata inventory...")
+            inventory = self.fdsn.get_stations(network=self.network, station="*")
+        except Exception as e:
+            logging.error("Could not get stations metadata from the fdsn server.")
+            logging.info(e)
+            self.fdsn = None
+            self.notify(time.monotonic() - start)
+
+            if(self.snapshot is None and os.path.exists(self.filename)):
+                logging.info("Falling back to metadata file.")
+                self.update(obspy.read_inventory(self.filename), False)
+            elif(self.snapshot is not None):
+                logging.info("Using cached metadata inventory.")
+
+            return
+
+        self.notify(time.monotonic() - start)
+        self.update(inventory, True)
+
+
+    def notify(self, seconds):
+        for listener in self.listeners:
+            listener("fdsn_metadata", seconds)
+
+
+    def update(self, inventory, write_file):
+        stations = []
+        signature = []
+
+        for network in inventory:
+            for station in network:
+                stations.append((station.code, station.start_date, station.end_date))
+                signature.append((network.code, station.code, str(station.start_date), str(station.end_date),
+                                  station.latitude, station.longitude, station.elevation))
+
+        signature = tuple(sorted(signature))
+
+        if(signature == self.signature):
+            return
+
+        self.signature = signature
+        self.snapshot = tuple(stations)
+
+        if(write_file):
+            inventory.write(self.filename, format="STATIONXML")
+            logging.info("Metadata inventory changed, wrote it to file.")
+
+
+    """
+    Returns the codes of the stations that were operating at some point between starttime and endtime,
+    the same stations a FDSN station query for that time window would return.
+
+    Parameters:
+        starttime, endtime: UTCDateTime.
+        blacklist: list of station codes to leave out.
+    """
+    def stations_in_network(self, starttime, endtime, blacklist=[]):
+        result = []
+
+        for code, start, end in self.snapshot:
+            if(start is not None and start > endtime):
+                continue
+            if(end is not None and end < starttime):
+                continue
+            if(code in blacklist or code in result):
+                continue
+
+            result.append(code)
+
+        return(result)
@@ -0,0 +1,210 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+#Upper bounds in seconds, picked around the 60 second budget of a minute.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 45.0, 60.0)
+
+
+def format_labels(label_names, label_values):
+    if(len(label_names) == 0):
+        return("")
+
+    parts = []
+    for i in range(0, len(label_names)):
+        value = str(label_values[i]).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(label_names[i] + "=\"" + value + "\"")
+
+    return("{" + ",".join(parts) + "}")
+
+
+def format_value(value):
+    if(value == float("inf")):
+        return("+Inf")
+
+    return(repr(float(value)))
+
+
+"""
+A metric with one value per combination of label values, e.g. one per stage.
+If function is given, the values are not kept here but returned by function() when the metric is rendered,
+as a dictionary of label value tuples -> value.
+"""
+class metric:
+    def __init__(self, kind, name, help_text, label_names=(), function=None):
+        self.kind = kind
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.function = function
+        self.values = {}#tuple of label values -> value
+        self.lock = threading.Lock()
+
+
+    def render(self):
+        lines = ["# HELP " + self.name + " " + self.help_text, "# TYPE " + self.name + " " + self.kind]
+
+        if(self.function is not None):
+            values = self.function()
+        else:
+            with self.lock:
+                values = dict(self.values)
+
+        for label_values in sorted(values):
+            lines.append(self.name + format_labels(self.label_names, label_values) + " " + format_value(values[label_values]))
+
+        return(lines)
+
+
+class counter(metric):
+    def __init__(self, name, help_text, label_names=(), function=None):
+        super().__init__("counter", name, help_text, label_names, function)
+
+
+    def inc(self, amount=1, labels=()):
+        with self.lock:
+            self.values[tuple(labels)] = self.values.get(tuple(labels), 0) + amount
+
+
+class gauge(metric):
+    def __init__(self, name, help_text, label_names=(), function=None):
+        super().__init__("gauge", name, help_text, label_names, function)
+
+
+    def set(self, value, labels=()):
+        with self.lock:
+            self.values[tuple(labels)] = value
+
+
+"""
+Cumulative histogram in the Prometheus sense: a count per upper bound, plus the sum and count of all observations.
+"""
+class histogram(metric):
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__("histogram", name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+
+    def observe(self, value, labels=()):
+        with self.lock:
+            key = tuple(labels)
+            if(key not in self.values):
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            counts, total, count = self.values[key]
+            for i in range(0, len(self.buckets)):
+                if(value <= self.buckets[i]):
+                    counts[i] += 1
+
+            self.values[key][1] = total + value
+            self.values[key][2] = count + 1
+
+
+    def render(self):
+        lines = ["# HELP " + self.name + " " + self.help_text, "# TYPE " + self.name + " histogram"]
+
+        with self.lock:
+            values = {}
+            for key in self.values:
+                values[key] = (list(self.values[key][0]), self.values[key][1], self.values[key][2])
+
+        for label_values in sorted(values):
+            counts, total, count = values[label_values]
+
+            for i in range(0, len(self.buckets)):
+                labels = format_labels(self.label_names + ("le",), label_values + (format_value(self.buckets[i]),))
+                lines.append(self.name + "_bucket" + labels + " " + str(counts[i]))
+
+            labels = format_labels(self.label_names, label_values)
+            lines.append(self.name + "_sum" + labels + " " + format_value(total))
+            lines.append(self.name + "_count" + labels + " " + str(count))
+
+        return(lines)
+
+
+"""
+The set of metrics of a program, rendered together in the Prometheus text format.
+"""
+class registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+
+    def add(self, m):
+        with self.lock:
+            self.metrics.append(m)
+
+        return(m)
+
+
+    def counter(self, name, help_text, label_names=(), function=None):
+        return(self.add(counter(name, help_text, label_names, function)))
+
+
+    def gauge(self, name, help_text, label_names=(), function=None):
+        return(self.add(gauge(name, help_text, label_names, function)))
+
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return(self.add(histogram(name, help_text, label_names, buckets)))
+
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+
+        lines = []
+        for m in metrics:
+            lines += m.render()
+
+        return("\n".join(lines) + "\n")
+
+
+class metricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if(self.path.split("?")[0] != "/metrics"):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    #Scrapes happen every few seconds, they don't belong in debug.log.
+    def log_message(self, format, *args):
+        pass
+
+
+"""
+Serves the metrics of a registry on http://address:port/metrics from a background thread.
+"""
+class metricsServer:
+    def __init__(self, registry, address="127.0.0.1", port=9300):
+        self.httpd = ThreadingHTTPServer((address, port), metricsRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.name = "metrics_server_thread"
+        self.thread.daemon = True
+
+
+    def start(self):
+        self.thread.start()
+        logging.info("Serving metrics on http://" + self.httpd.server_address[0] + ":" + str(self.httpd.server_address[1]) + "/metrics")
+
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
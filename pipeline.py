@@ -0,0 +1,289 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import os
+import json
+import time
+import queue
+import threading
+import logging
+from obspy import UTCDateTime
+
+
+"""
+Keeps track of how the minute pipeline is doing: how long each stage takes, how many minutes
+were dropped because a stage was still busy (overruns) and how many minutes the scheduler
+never got to fire at all (skipped).
+"""
+class pipelineStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}#stage name -> [count, total seconds, max seconds, last seconds]
+        self.overruns = {}#stage name -> number of minutes dropped in front of that stage
+        self.skipped_minutes = 0
+        self.listeners = []#functions called with (stage name, seconds) for every recorded latency
+
+
+    def record_latency(self, name, seconds):
+        with self.lock:
+            if(name not in self.latency):
+                self.latency[name] = [0, 0.0, 0.0, 0.0]
+
+            entry = self.latency[name]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3] = seconds
+
+        for listener in self.listeners:
+            listener(name, seconds)
+
+
+    def record_overrun(self, name, minute):
+        with self.lock:
+            self.overruns[name] = self.overruns.get(name, 0) + 1
+
+        logging.error("Stage " + name + " is still busy, dropping minute " + str(minute) + ".")
+
+
+    def record_skipped(self, count, minute):
+        with self.lock:
+            self.skipped_minutes += count
+
+        logging.error("Scheduler skipped " + str(count) + " minute(s) before " + str(minute) + ".")
+
+
+    """
+    Returns a one line summary of the stats, used for the log.
+    """
+    def summary(self):
+        with self.lock:
+            parts = []
+            for name in self.latency:
+                count, total, maximum, last = self.latency[name]
+                parts.append(name + ": last %.2fs avg %.2fs max %.2fs" % (last, total / count, maximum))
+
+            overruns = 0
+            for name in self.overruns:
+                overruns += self.overruns[name]
+
+            return(", ".join(parts) + " | overruns: " + str(overruns) + " skipped minutes: " + str(self.skipped_minutes))
+
+
+"""
+One step of the minute pipeline, running on its own thread with a small input queue.
+Whatever the function returns is passed on to the next stage, unless it is None.
+If the queue is full when a new minute arrives the minute is dropped and counted as an overrun,
+so a slow stage can never make minutes pile up behind it.
+Items are dictionaries that carry at least "minute" (the UTCDateTime the minute was scheduled for).
+"""
+class stage:
+    def __init__(self, name, function, stats, next_stage=None, queue_size=2):
+        self.name = name
+        self.function = function
+        self.stats = stats
+        self.next_stage = next_stage
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.name = name + "_stage_thread"
+        self.thread.daemon = True
+
+
+    def start(self):
+        self.thread.start()
+
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return(True)
+        except queue.Full:
+            self.stats.record_overrun(self.name, item["minute"])
+            return(False)
+
+
+    def run(self):
+        while(True):
+            item = self.queue.get()
+            start = time.monotonic()
+
+            try:
+                result = self.function(item)
+            except SystemExit as e:
+                # sys.exit() from a stage only ends its thread, so it is turned into an exit of the whole program.
+                logging.critical("Stage " + self.name + " requested exit.")
+                logging.shutdown()
+                os._exit(e.code if isinstance(e.code, int) else 1)
+            except Exception:
+                logging.exception("Stage " + self.name + " failed for minute " + str(item["minute"]) + ".")
+                result = None
+
+            self.stats.record_latency(self.name, time.monotonic() - start)
+
+            if(result is not None and self.next_stage is not None):
+                self.next_stage.put(result)
+
+
+"""
+Runs function on its own thread for every minute it is notified of, e.g. the alerts for every minute that has been written,
+so that whatever function does is off the critical path of the minute: the writer only puts the item in a queue.
+The minutes are handled in order, one at a time. If the consumer is queue_size minutes behind, new minutes are dropped
+and counted as overruns (back-pressure) instead of making the writer wait or the queue grow without bound.
+Each item gets "follows" set to True when the minute before it was the last one handled without an error, so function
+can tell when it has missed minutes and must catch up from the files.
+"""
+class minuteConsumer:
+    def __init__(self, name, function, stats, queue_size=30):
+        self.name = name
+        self.function = function
+        self.stats = stats
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.failures = 0
+        self.last_minute = None#last minute that was handled without an error
+        self.listeners = []#functions called with the seconds from notify until the minute was handled
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.name = name + "_consumer_thread"
+        self.thread.daemon = True
+
+
+    def start(self):
+        self.thread.start()
+
+
+    def notify(self, item):
+        item["notified"] = time.monotonic()
+
+        try:
+            self.queue.put_nowait(item)
+            return(True)
+        except queue.Full:
+            self.stats.record_overrun(self.name, item["minute"])
+            return(False)
+
+
+    def run(self):
+        while(True):
+            item = self.queue.get()
+            item["follows"] = self.last_minute is not None and item["minute"] - self.last_minute == 60
+            start = time.monotonic()
+
+            try:
+                self.function(item)
+                self.last_minute = item["minute"]
+            except Exception:
+                logging.exception("Consumer " + self.name + " failed for minute " + str(item["minute"]) + ".")
+                self.failures += 1
+                self.last_minute = None
+
+            end = time.monotonic()
+            self.stats.record_latency(self.name, end - start)
+
+            for listener in self.listeners:
+                listener(end - item["notified"])
+
+
+"""
+The real clock. wait_until sleeps against the monotonic clock, so setting the wall clock
+while we sleep doesn't make the wait longer or shorter.
+"""
+class wallClock:
+    def time(self):
+        return(time.time())
+
+
+    def wait_until(self, t):
+        deadline = time.monotonic() + (t - time.time())
+
+        while(True):
+            remaining = deadline - time.monotonic()
+            if(remaining <= 0):
+                break
+            time.sleep(remaining)
+
+
+"""
+A clock that starts at start (seconds since the epoch) when the wall clock is at origin and runs speed times faster.
+Used to drive the logger from the replay servers in replay.py faster than real time.
+The replay server writes its clock to a file and the logger reads it with load, so both agree on the time.
+"""
+class simulatedClock:
+    def __init__(self, start, speed=1.0, origin=None):
+        self.start = start
+        self.speed = speed
+        self.origin = origin
+
+        if(self.origin is None):
+            self.origin = time.time()
+
+
+    def time(self):
+        return(self.start + (time.time() - self.origin) * self.speed)
+
+
+    def wait_until(self, t):
+        while(True):
+            remaining = (t - self.time()) / self.speed
+            if(remaining <= 0):
+                break
+            time.sleep(remaining)
+
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            json.dump({"start": self.start, "speed": self.speed, "origin": self.origin}, f)
+
+
+    @staticmethod
+    def load(filename):
+        with open(filename, "r") as f:
+            clock = json.load(f)
+
+        return(simulatedClock(clock["start"], clock["speed"], clock["origin"]))
+
+
+"""
+Calls on_minute at the start of every minute of clock (the wall clock by default), with the minute as a UTCDateTime.
+The waiting itself is done by the clock so the loop doesn't poll, and each minute
+is aligned again to the clock, so a minute can't fire twice or drift.
+If the process was suspended or the callback took so long that whole minutes went by, those minutes
+are recorded as skipped instead of being fired late in a burst.
+on_day is called when the first minute of a new day fires, even if midnight itself was skipped.
+"""
+class minuteScheduler:
+    def __init__(self, on_minute, stats, on_day=None, clock=None):
+        self.on_minute = on_minute
+        self.on_day = on_day
+        self.stats = stats
+        self.clock = clock
+        self.exit = False
+
+        if(self.clock is None):
+            self.clock = wallClock()
+
+
+    def run(self):
+        next_minute = (int(self.clock.time()) // 60) * 60 + 60
+        day = next_minute // 86400
+
+        while(not self.exit):
+            self.clock.wait_until(next_minute)
+
+            minute = (int(self.clock.time()) // 60) * 60
+
+            # The clock was set back while we slept, wait for the minute we were waiting for.
+            if(minute < next_minute):
+                continue
+
+            if(minute > next_minute):
+                self.stats.record_skipped((minute - next_minute) // 60, UTCDateTime(minute))
+
+            if(minute // 86400 != day):
+                day = minute // 86400
+                if(self.on_day is not None):
+                    self.on_day()
+
+            self.on_minute(UTCDateTime(minute))
+            next_minute = minute + 60
@@ -0,0 +1,638 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import io
+import sys
+import glob
+import time
+import struct
+import fnmatch
+import argparse
+import threading
+import logging
+import socketserver
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy
+import obspy
+from obspy import UTCDateTime
+from obspy.core.inventory import Inventory, Network, Station, Channel, Response, InstrumentSensitivity
+import pipeline
+
+"""
+Stand-ins for the seedlink and FDSN servers the logger talks to, for load testing the whole chain
+(logger -> files -> alert -> server) on a machine without access to the real servers.
+
+The seedlink server replays miniSEED files, or synthetic noise for any number of stations, over the
+seedlink protocol (version 3, multi-station mode), at real time or faster.
+The FDSN server serves the station service from StationXML files (the logger's .meta.xml/.resp.xml) and
+the dataselect service from the same data as the seedlink server.
+
+Both run on a simulated clock that is written to --clock-file. Setting "clock_file" in the logger's config.json
+to the same file makes the logger schedule its minutes on that clock, so at --speed 60 a day is replayed in 24 minutes.
+
+Usage:
+    python3 replay.py --synthetic 50 --network XX --speed 60 --start 2020-01-01
+    python3 replay.py --data "archive/*.mseed" --meta .meta.xml --resp .resp.xml --speed 10
+"""
+
+BLOCK_SECONDS = 60
+RECORD_LENGTH = 512
+
+
+"""
+Reads the start and end time of a miniSEED record from its fixed header.
+"""
+def record_times(record, sampling_rate):
+    year, julday, hour, minute, second, unused, fraction, sample_count = struct.unpack(">HHBBBBHH", record[20:32])
+    start = UTCDateTime(year=year, julday=julday, hour=hour, minute=minute, second=second) + fraction * 0.0001
+    return(start, start + sample_count / sampling_rate)
+
+
+"""
+Encodes a stream into 512 byte miniSEED records.
+
+Returns:
+    A list of (start, end, network, station, location, channel, record) sorted by end time.
+"""
+def encode_records(stream):
+    result = []
+
+    for trace in stream:
+        if(trace.stats.npts == 0):
+            continue
+
+        encoding = "STEIM2"
+        if(trace.data.dtype.kind == "f"):
+            encoding = "FLOAT32"
+            trace.data = trace.data.astype(numpy.float32)
+        else:
+            trace.data = trace.data.astype(numpy.int32)
+
+        buffer = io.BytesIO()
+        trace.write(buffer, format="MSEED", reclen=RECORD_LENGTH, encoding=encoding)
+        data = buffer.getvalue()
+
+        for offset in range(0, len(data), RECORD_LENGTH):
+            record = data[offset:offset + RECORD_LENGTH]
+            start, end = record_times(record, trace.stats.sampling_rate)
+            result.append((start, end, trace.stats.network, trace.stats.station, trace.stats.location, trace.stats.channel, record))
+
+    result.sort(key=lambda r: (r[1], r[3], r[5]))
+    return(result)
+
+
+"""
+Keeps the encoded records of the last few blocks, since every connection asks for the same minutes.
+"""
+class blockCache:
+    def __init__(self, make_block, size=30):
+        self.make_block = make_block
+        self.size = size
+        self.blocks = {}
+        self.lock = threading.Lock()
+
+
+    def get(self, block_start):
+        with self.lock:
+            if(block_start in self.blocks):
+                return(self.blocks[block_start])
+
+        records = encode_records(self.make_block(block_start))
+
+        with self.lock:
+            self.blocks[block_start] = records
+            while(len(self.blocks) > self.size):
+                self.blocks.pop(min(self.blocks))
+
+        return(records)
+
+
+"""
+Gaussian noise for a list of stations, the same every time for the same station, channel and minute.
+There is no end to it.
+"""
+class syntheticSource:
+    def __init__(self, network, stations, channels, sampling_rate=100.0, amplitude=1000.0, seed=0):
+        self.network = network
+        self.stations = stations
+        self.channels = channels
+        self.sampling_rate = sampling_rate
+        self.amplitude = amplitude
+        self.seed = seed
+        self.start = None
+        self.end = None
+        self.cache = blockCache(self.make_block)
+
+
+    def make_block(self, block_start):
+        traces = []
+        npts = int(BLOCK_SECONDS * self.sampling_rate)
+
+        for i in range(0, len(self.stations)):
+            for j in range(0, len(self.channels)):
+                rng = numpy.random.default_rng([self.seed, i, j, int(block_start) // BLOCK_SECONDS])
+                data = (rng.normal(size=npts) * self.amplitude).astype(numpy.int32)
+                header = {"network": self.network, "station": self.stations[i], "location": "", "channel": self.channels[j],
+                          "sampling_rate": self.sampling_rate, "starttime": UTCDateTime(block_start)}
+                traces.append(obspy.Trace(data, header=header))
+
+        return(obspy.Stream(traces))
+
+
+    def block(self, block_start):
+        return(self.cache.get(block_start))
+
+
+    """
+    The (network, station, location, channel) of every stream, for the INFO requests.
+    """
+    def streams(self):
+        result = []
+        for station in self.stations:
+            for channel in self.channels:
+                result.append((self.network, station, "", channel))
+
+        return(result)
+
+
+"""
+Recorded data, read from miniSEED files once at startup. Blocks after the end of the data are empty.
+"""
+class archiveSource:
+    def __init__(self, filenames):
+        self.stream = obspy.Stream()
+
+        for filename in filenames:
+            self.stream += obspy.read(filename)
+
+        if(len(self.stream) == 0):
+            raise Exception("No data found in " + str(len(filenames)) + " files.")
+
+        self.stream.merge(method=-1)
+        self.start = min([trace.stats.starttime for trace in self.stream]).timestamp
+        self.end = max([trace.stats.endtime for trace in self.stream]).timestamp
+        self.cache = blockCache(self.make_block)
+
+        logging.info("Loaded " + str(len(self.stream)) + " traces from " + str(UTCDateTime(self.start)) + " to " + str(UTCDateTime(self.end)) + ".")
+
+
+    def make_block(self, block_start):
+        result = obspy.Stream()
+
+        for trace in self.stream:
+            # The sample at the very end of the block belongs to the next one.
+            result += trace.slice(UTCDateTime(block_start), UTCDateTime(block_start + BLOCK_SECONDS - 0.5 / trace.stats.sampling_rate))
+
+        return(result.split())
+
+
+    def block(self, block_start):
+        return(self.cache.get(block_start))
+
+
+    def streams(self):
+        result = []
+        for trace in self.stream:
+            key = (trace.stats.network, trace.stats.station, trace.stats.location, trace.stats.channel)
+            if(key not in result):
+                result.append(key)
+
+        return(result)
+
+
+"""
+A seedlink selector ("HHZ", "??HHZ", "00HH?", optionally ending in ".D") matched against a location and channel.
+The location is padded to two characters, so "??" also matches the empty location like on a real server.
+"""
+def selector_matches(selector, location, channel):
+    selector = selector.split(".")[0]
+
+    if(len(selector) <= 3):
+        return(fnmatch.fnmatchcase(channel, selector))
+
+    return(fnmatch.fnmatchcase(location.ljust(2), selector[:-3].ljust(2)) and fnmatch.fnmatchcase(channel, selector[-3:]))
+
+
+"""
+Wraps an INFO response in 512 byte miniSEED log records with the SLINFO header.
+Every packet but the last one is marked with "*" as not being the end of the response.
+"""
+def info_packets(xml):
+    trace = obspy.Trace(numpy.frombuffer(xml.encode(), dtype="|S1"), header={"network": "SL", "station": "INFO", "channel": "LOG"})
+    buffer = io.BytesIO()
+    trace.write(buffer, format="MSEED", reclen=RECORD_LENGTH, encoding="ASCII")
+    data = buffer.getvalue()
+
+    packets = []
+    for offset in range(0, len(data), RECORD_LENGTH):
+        last = offset + RECORD_LENGTH >= len(data)
+        packets.append((b"SLINFO  " if last else b"SLINFO *") + data[offset:offset + RECORD_LENGTH])
+
+    return(packets)
+
+
+def info_xml(level, source, clock):
+    now = UTCDateTime(clock.time()).strftime("%Y/%m/%d %H:%M:%S")
+    lines = ["<?xml version=\"1.0\"?>", "<seedlink software=\"tremv replay v3.1\" organization=\"tremv\" started=\"" + now + "\">"]
+
+    if(level == "CAPABILITIES"):
+        for capability in ["dialup", "multistation", "window-extraction", "info:id", "info:capabilities", "info:stations", "info:streams"]:
+            lines.append("<capability name=\"" + capability + "\"/>")
+    elif(level in ["STATIONS", "STREAMS"]):
+        stations = {}
+        for network, station, location, channel in source.streams():
+            stations.setdefault((network, station), []).append((location, channel))
+
+        for network, station in sorted(stations):
+            attributes = "name=\"" + station + "\" network=\"" + network + "\" description=\"\" begin_seq=\"000001\" end_seq=\"FFFFFF\" stream_check=\"enabled\""
+
+            if(level == "STATIONS"):
+                lines.append("<station " + attributes + "/>")
+                continue
+
+            lines.append("<station " + attributes + ">")
+            for location, channel in stations[(network, station)]:
+                lines.append("<stream location=\"" + location + "\" seedname=\"" + channel + "\" type=\"D\" begin_time=\"" + now + "\" end_time=\"" + now + "\" begin_recno=\"1\" end_recno=\"1\" gap_check=\"enabled\" gap_treshold=\"0\" gap_count=\"0\"/>")
+            lines.append("</station>")
+
+    lines.append("</seedlink>")
+    return("\n".join(lines))
+
+
+"""
+One seedlink connection. Handles the commands the obspy clients send (HELLO, INFO, STATION, SELECT, DATA, FETCH,
+TIME, END and BYE) and then streams the selected records, each one once the clock has passed its end time.
+With an end time (TIME begin end), or when the replayed data runs out, the stream ends with END.
+"""
+class seedlinkHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.stations = []#[network pattern, station pattern, selectors, begin, end]
+        self.sequence = 0
+        buffer = b""
+
+        try:
+            while(True):
+                data = self.request.recv(4096)
+                if(not data):
+                    return
+
+                buffer += data.replace(b"\n", b"\r")
+
+                while(b"\r" in buffer):
+                    line, buffer = buffer.split(b"\r", 1)
+                    line = line.decode("ascii", "replace").strip()
+
+                    if(len(line) > 0 and not self.command(line)):
+                        return
+        except (ConnectionError, OSError):
+            pass
+
+
+    """
+    Returns False when the connection should be closed.
+    """
+    def command(self, line):
+        parts = line.split()
+        name = parts[0].upper()
+        server = self.server
+
+        if(name == "HELLO"):
+            self.request.sendall(b"SeedLink v3.1 (tremv replay) :: SLPROTO:3.1 CAP WS:13\r\ntremv replay\r\n")
+        elif(name == "INFO"):
+            level = parts[1].upper() if len(parts) > 1 else "ID"
+            self.request.sendall(b"".join(info_packets(info_xml(level, server.source, server.clock))))
+        elif(name == "STATION"):
+            network = parts[2] if len(parts) > 2 else "*"
+            self.stations.append([network, parts[1], [], None, None])
+            self.request.sendall(b"OK\r\n")
+        elif(name == "SELECT"):
+            if(len(self.stations) == 0 or len(parts) < 2):
+                self.request.sendall(b"ERROR\r\n")
+            else:
+                self.stations[-1][2].append(parts[1])
+                self.request.sendall(b"OK\r\n")
+        elif(name in ["DATA", "FETCH", "TIME"]):
+            if(len(self.stations) == 0):
+                self.request.sendall(b"ERROR\r\n")
+                return(True)
+
+            begin = server.clock.time()
+            end = None
+
+            try:
+                if(name == "TIME"):
+                    begin = parse_seedlink_time(parts[1])
+                    if(len(parts) > 2):
+                        end = parse_seedlink_time(parts[2])
+                elif(len(parts) > 2):
+                    # DATA seq time, resume from the time of the last packet.
+                    begin = parse_seedlink_time(parts[2])
+            except Exception:
+                self.request.sendall(b"ERROR\r\n")
+                return(True)
+
+            self.stations[-1][3] = begin
+            self.stations[-1][4] = end
+            self.request.sendall(b"OK\r\n")
+        elif(name == "END"):
+            self.stream()
+            return(False)
+        elif(name == "BYE"):
+            return(False)
+        else:
+            self.request.sendall(b"ERROR\r\n")
+
+        return(True)
+
+
+    def selected(self, record):
+        start, end, network, station, location, channel, data = record
+
+        for network_pattern, station_pattern, selectors, begin, window_end in self.stations:
+            if(begin is None):
+                continue
+            if(not fnmatch.fnmatchcase(network, network_pattern) or not fnmatch.fnmatchcase(station, station_pattern)):
+                continue
+            if(end <= begin or (window_end is not None and start > window_end)):
+                continue
+            if(len(selectors) > 0 and not any([selector_matches(s, location, channel) for s in selectors])):
+                continue
+
+            return(True)
+
+        return(False)
+
+
+    def stream(self):
+        server = self.server
+        begins = [s[3] for s in self.stations if s[3] is not None]
+        ends = [s[4] for s in self.stations if s[3] is not None]
+
+        if(len(begins) == 0):
+            return
+
+        window_end = None
+        if(None not in ends):
+            window_end = max(ends)
+
+        block = (int(min(begins)) // BLOCK_SECONDS) * BLOCK_SECONDS
+        started = time.monotonic()
+        packets = 0
+
+        while(True):
+            if(window_end is not None and block > window_end):
+                break
+            if(server.source.end is not None and block > server.source.end):
+                break
+
+            for record in server.source.block(block):
+                if(not self.selected(record)):
+                    continue
+
+                server.clock.wait_until(record[1].timestamp)
+                self.request.sendall(b"SL" + ("%06X" % (self.sequence % 0x1000000)).encode() + record[6])
+                self.sequence += 1
+                packets += 1
+
+            block += BLOCK_SECONDS
+
+        self.request.sendall(b"END")
+        server.record_connection(packets, time.monotonic() - started)
+
+
+def parse_seedlink_time(text):
+    parts = [int(p) for p in text.split(",")]
+    while(len(parts) < 6):
+        parts.append(0)
+
+    return(UTCDateTime(*parts[:6]).timestamp)
+
+
+class seedlinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, source, clock, address="127.0.0.1", port=18000):
+        super().__init__((address, port), seedlinkHandler)
+        self.source = source
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.packets = 0
+
+
+    def record_connection(self, packets, seconds):
+        with self.lock:
+            self.connections += 1
+            self.packets += packets
+
+        logging.info("Seedlink request done: %d packets in %.2fs (%d requests, %d packets in total)." % (packets, seconds, self.connections, self.packets))
+
+
+"""
+Builds a StationXML inventory with a flat response for every stream of a source,
+for when there are no .meta.xml/.resp.xml files to serve.
+"""
+def generate_inventory(source, sensitivity=1e9, start=UTCDateTime(2000, 1, 1)):
+    networks = {}
+
+    for network, station, location, channel in source.streams():
+        stations = networks.setdefault(network, {})
+        channels = stations.setdefault(station, [])
+
+        c = Channel(channel, location, 64.0, -19.0, 0.0, 0.0, sample_rate=100.0, start_date=start)
+        c.response = Response(instrument_sensitivity=InstrumentSensitivity(sensitivity, 1.0, "M/S", "COUNTS"))
+        channels.append(c)
+
+    result = []
+    for network in networks:
+        stations = []
+        for station in networks[network]:
+            stations.append(Station(station, 64.0, -19.0, 0.0, channels=networks[network][station], start_date=start))
+
+        result.append(Network(network, stations=stations))
+
+    return(Inventory(result, "tremv replay"))
+
+
+def wadl(service, parameters):
+    params = "".join(["<param name=\"" + p + "\" style=\"query\" type=\"xs:string\"/>" for p in parameters])
+    return(("<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
+            "<application xmlns=\"http://wadl.dev.java.net/2009/02\"><resources base=\"/fdsnws/" + service + "/1/\">"
+            "<resource path=\"query\"><method name=\"GET\" id=\"query\"><request>" + params + "</request></method></resource>"
+            "</resources></application>").encode())
+
+
+STATION_PARAMETERS = ["starttime", "endtime", "startbefore", "startafter", "endbefore", "endafter", "network", "station", "location", "channel",
+                      "minlatitude", "maxlatitude", "minlongitude", "maxlongitude", "latitude", "longitude", "minradius", "maxradius",
+                      "level", "includerestricted", "includeavailability", "updatedafter", "matchtimeseries", "format", "nodata"]
+DATASELECT_PARAMETERS = ["starttime", "endtime", "network", "station", "location", "channel", "quality", "minimumlength", "longestonly", "format", "nodata"]
+
+
+class fdsnRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {}
+        for key, values in parse_qs(url.query).items():
+            query[key] = values[0]
+
+        if(url.path == "/fdsnws/station/1/application.wadl"):
+            self.reply(200, wadl("station", STATION_PARAMETERS), "application/xml")
+        elif(url.path == "/fdsnws/dataselect/1/application.wadl"):
+            self.reply(200, wadl("dataselect", DATASELECT_PARAMETERS), "application/xml")
+        elif(url.path == "/fdsnws/station/1/query"):
+            self.station_query(query)
+        elif(url.path == "/fdsnws/dataselect/1/query"):
+            self.dataselect_query(query)
+        else:
+            self.reply(404, b"Not found", "text/plain")
+
+
+    def station_query(self, query):
+        inventory = self.server.metadata
+        if(query.get("level") == "response"):
+            inventory = self.server.response
+
+        selection = {}
+        for key in ["network", "station", "location", "channel"]:
+            if(key in query):
+                selection[key] = query[key]
+
+        inventory = inventory.select(**selection)
+
+        if(len(inventory) == 0):
+            self.reply(204, b"", "text/plain")
+            return
+
+        buffer = io.BytesIO()
+        inventory.write(buffer, format="STATIONXML")
+        self.reply(200, buffer.getvalue(), "application/xml")
+
+
+    def dataselect_query(self, query):
+        server = self.server
+        start = UTCDateTime(query["starttime"]).timestamp
+        end = min(UTCDateTime(query["endtime"]).timestamp, server.clock.time())
+        records = []
+
+        block = (int(start) // BLOCK_SECONDS) * BLOCK_SECONDS
+        while(block < end):
+            for record in server.source.block(block):
+                record_start, record_end, network, station, location, channel, data = record
+
+                if(record_end <= start or record_start >= end or record_end > server.clock.time()):
+                    continue
+                if(not fnmatch.fnmatchcase(network, query.get("network", "*")) or not fnmatch.fnmatchcase(station, query.get("station", "*"))):
+                    continue
+                if(not fnmatch.fnmatchcase(location.ljust(2), query.get("location", "*").replace("--", "  ").ljust(2)) or not fnmatch.fnmatchcase(channel, query.get("channel", "*"))):
+                    continue
+
+                records.append(data)
+
+            block += BLOCK_SECONDS
+
+        if(len(records) == 0):
+            self.reply(204, b"", "text/plain")
+        else:
+            self.reply(200, b"".join(records), "application/vnd.fdsn.mseed")
+
+
+    def reply(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        logging.debug("fdsn: " + (format % args))
+
+
+class fdsnServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, source, clock, metadata, response, address="127.0.0.1", port=8080):
+        super().__init__((address, port), fdsnRequestHandler)
+        self.source = source
+        self.clock = clock
+        self.metadata = metadata
+        self.response = response
+
+
+"""
+Three character station codes (A00, A01, ..., A0Z, A10, ...), so they match the usual "???" station wildcard.
+"""
+def synthetic_station_code(index):
+    digits = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    return(chr(ord("A") + index // 1296) + digits[(index // 36) % 36] + digits[index % 36])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay seedlink and FDSN servers for load testing the logger.")
+    parser.add_argument("--data", default=None, help="glob of miniSEED files to replay")
+    parser.add_argument("--synthetic", type=int, default=None, help="number of synthetic stations to generate instead")
+    parser.add_argument("--network", default="XX", help="network code of the synthetic stations")
+    parser.add_argument("--channels", default="HHZ", help="comma separated channels of the synthetic stations")
+    parser.add_argument("--start", default=None, help="time the clock starts at (default: start of the data, or now)")
+    parser.add_argument("--speed", type=float, default=1.0, help="how many times faster than real time the clock runs")
+    parser.add_argument("--meta", default=None, help="StationXML served for station requests (default: generated)")
+    parser.add_argument("--resp", default=None, help="StationXML served for level=response requests (default: --meta)")
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--seedlink-port", type=int, default=18000)
+    parser.add_argument("--fdsn-port", type=int, default=8080)
+    parser.add_argument("--clock-file", default=".replay_clock.json", help="where to write the clock for the logger (\"clock_file\" in config.json)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if(args.data is not None):
+        source = archiveSource(sorted(glob.glob(args.data)))
+    elif(args.synthetic is not None):
+        stations = [synthetic_station_code(i) for i in range(0, args.synthetic)]
+        source = syntheticSource(args.network, stations, args.channels.split(","))
+    else:
+        logging.error("Either --data or --synthetic is needed.")
+        sys.exit(1)
+
+    if(args.start is not None):
+        start = UTCDateTime(args.start).timestamp
+    elif(source.start is not None):
+        start = source.start
+    else:
+        start = time.time()
+
+    clock = pipeline.simulatedClock(start, args.speed)
+    clock.save(args.clock_file)
+
+    if(args.meta is not None):
+        metadata = obspy.read_inventory(args.meta)
+    else:
+        metadata = generate_inventory(source)
+
+    response = metadata
+    if(args.resp is not None):
+        response = obspy.read_inventory(args.resp)
+
+    seedlink = seedlinkServer(source, clock, args.address, args.seedlink_port)
+    fdsn = fdsnServer(source, clock, metadata, response, args.address, args.fdsn_port)
+
+    thread = threading.Thread(target=fdsn.serve_forever)
+    thread.name = "fdsn_server_thread"
+    thread.daemon = True
+    thread.start()
+
+    logging.info("Seedlink on " + args.address + ":" + str(args.seedlink_port) + ", FDSN on http://" + args.address + ":" + str(args.fdsn_port) +
+                 ", clock starts at " + str(UTCDateTime(start)) + " running " + str(args.speed) + "x, written to " + args.clock_file + ".")
+
+    try:
+        seedlink.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if(__name__ == "__main__"):
+    main()
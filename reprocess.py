@@ -0,0 +1,284 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import logging
+import multiprocessing
+import obspy
+from obspy import UTCDateTime
+from obspy.clients.filesystem.sds import Client as sdsClient
+import common
+import logger
+import metadata
+import daystore
+
+"""
+Regenerates the tremvlog files for past days from an archive of miniSEED day files, e.g. after a filter
+has been added to config.json or the processing has changed.
+Every minute goes through the same processing as in the live logger, and the files are written with the
+same writers, so the output is the same as what the live logger would have written.
+
+The work is split into (day, station shard) units that run on a process pool. Each day is marked as done
+in the state directory once all of its files have been written, so an interrupted run picks up where it stopped.
+
+Usage:
+    python3 reprocess.py 2020-11-01 2020-11-30 /path/to/archive --workers 8
+"""
+
+SECONDS_IN_DAY = 86400
+
+
+"""
+Reads the raw data for a day for a list of stations from the archive.
+
+Parameters:
+    archive: path of the archive.
+    layout: "sds" for a SeisComP data structure, "flat" for a directory of day files with YYYY.JJJ in their names.
+    day: UTCDateTime at the start of the day.
+    stations: station codes.
+    config: dictionary with network, location_wildcard and channels.
+"""
+def read_day(archive, layout, day, stations, config):
+    result = obspy.Stream()
+
+    location = config["location_wildcard"]
+    # "??" doesn't match the empty location code in fnmatch, which is what the seedlink wildcard means by it.
+    if(location.strip("?") == ""):
+        location = "*"
+
+    if(layout == "sds"):
+        client = sdsClient(archive)
+        for station in stations:
+            result += client.get_waveforms(config["network"], station, location, config["channels"], day, day + SECONDS_IN_DAY)
+    else:
+        pattern = os.path.join(archive, "*" + str(day.year) + "." + "%03d" % day.julday + "*")
+        for filename in sorted(glob.glob(pattern)):
+            st = obspy.read(filename, starttime=day, endtime=day + SECONDS_IN_DAY)
+            for station in stations:
+                result += st.select(network=config["network"], station=station, location=location, channel=config["channels"])
+
+    result.merge(method=-1)
+    return(result)
+
+
+"""
+Computes the rsam results of every minute of a day for a shard of stations. Runs on the process pool.
+
+Returns:
+    (day timestamp, shard index, list with one entry per minute of (dictionary of component -> list of dictionaries, one per filter,
+    dictionary of component -> sub minute rsam results))
+"""
+def process_day_shard(unit):
+    day_timestamp, shard_index, stations, archive, layout, config, sensitivity_table = unit
+    day = UTCDateTime(day_timestamp)
+    filters = config["filters"]
+    components = common.determine_components(config["channels"])
+    windows = common.valid_rsam_windows(config.get("rsam_windows", []))
+
+    dsp_function = logger.station_dsp
+    if(config.get("dsp_mode") == "float32"):
+        dsp_function = logger.station_dsp_float32
+
+    # The minutes of a unit are processed in order, so the streaming filters carry on through the day.
+    if(config.get("filter_mode") == "streaming"):
+        dsp_function = logger.station_dsp_streaming
+
+    data = read_day(archive, layout, day, stations, config)
+    minutes = []
+
+    for minute in range(0, 1440):
+        data_starttime = day + minute * 60
+        minute_data = data.slice(data_starttime, data_starttime + 60)
+
+        if(len(minute_data) == 0):
+            minutes.append(None)
+            continue
+
+        rsam_results, missing_responses, timings, window_results = logger.components_dsp(minute_data, filters, sensitivity_table, data_starttime + 60, components, dsp_function, windows)
+        minutes.append((rsam_results, window_results))
+
+    return(day_timestamp, shard_index, minutes)
+
+
+"""
+Writes a day from the merged shard results. Existing output for the day and the filters is replaced.
+"""
+def write_day(day, shard_minutes, station_cache, config, output_formats):
+    filters = config["filters"]
+    components = common.determine_components(config["channels"])
+    path = common.logger_output_path(day)
+
+    windows = common.valid_rsam_windows(config.get("rsam_windows", []))
+    window_writer = daystore.dayStoreWriter()
+
+    writers = []
+    if("csv" in output_formats):
+        writers.append(logger.tremvlogWriter())
+    if("binary" in output_formats):
+        writers.append(daystore.dayStoreWriter())
+
+    for f in filters:
+        for component in components:
+            filenames = [common.generate_tremvlog_filename(day, f, component), daystore.generate_filename(day, f, component)]
+            for window in windows:
+                filenames.append(daystore.generate_filename(day, f, component, window))
+
+            for filename in filenames:
+                if(os.path.exists(path + filename)):
+                    os.remove(path + filename)
+
+    blacklist = config.get("station_blacklist", [])
+
+    for minute in range(0, 1440):
+        data_starttime = day + minute * 60
+        stations_in_network = station_cache.stations_in_network(data_starttime, data_starttime + 60, blacklist)
+
+        for component in components:
+            shard_results = []
+            shard_windows = []
+            for minutes in shard_minutes:
+                if(minutes[minute] is not None):
+                    shard_results.append(minutes[minute][0][component])
+                    shard_windows.append(minutes[minute][1][component])
+
+            rsam_results = logger.merge_rsam_results(shard_results, len(filters), stations_in_network)
+
+            for writer in writers:
+                logger.write_tremvlog_file(rsam_results, filters, stations_in_network, data_starttime, component, writer)
+
+            window_writer.write_windows(logger.merge_window_results(shard_windows, len(filters), stations_in_network, windows), filters, stations_in_network, data_starttime, component)
+
+
+def state_filename(state_dir, day, config):
+    return(os.path.join(state_dir, str(day.year) + "." + str(day.month) + "." + str(day.day) + "_" + "".join(common.determine_components(config["channels"])) + ".json"))
+
+
+"""
+A day is done if its state file exists and was written with the same filters as we have now.
+"""
+def day_is_done(state_dir, day, config):
+    filename = state_filename(state_dir, day, config)
+
+    if(not os.path.exists(filename)):
+        return(False)
+
+    with open(filename, "r") as f:
+        state = json.load(f)
+
+    return(state["filters"] == config["filters"])
+
+
+def mark_day_done(state_dir, day, config, seconds):
+    with open(state_filename(state_dir, day, config), "w") as f:
+        json.dump({"filters": config["filters"], "channels": config["channels"], "seconds": seconds, "finished": str(UTCDateTime())}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate tremvlog files for a range of days from a miniSEED archive.")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", help="last day, YYYY-MM-DD")
+    parser.add_argument("archive", help="directory with the miniSEED day files")
+    parser.add_argument("--layout", choices=["sds", "flat"], default="sds", help="sds: SeisComP data structure, flat: a directory of day files named with YYYY.JJJ")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--shards", type=int, default=None, help="station shards per day (default: the number of workers)")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--state-dir", default=".reprocess", help="where to keep track of finished days")
+    parser.add_argument("--force", action="store_true", help="reprocess days that are already done")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    config = common.config(args.config).config
+    config.setdefault("response_filename", ".resp.xml")
+    config.setdefault("metadata_filename", ".meta.xml")
+    config.setdefault("location_wildcard", "??")
+    config.setdefault("channels", "HHZ")
+    config.setdefault("filters", [[0.5, 1.0], [1.0, 2.0], [2.0, 4.0]])
+    output_formats = config.get("output_formats", ["csv"])
+
+    if(not os.path.exists(config["response_filename"]) or not os.path.exists(config["metadata_filename"])):
+        logging.error("Reprocessing needs the cached response and metadata files (" + config["response_filename"] + ", " + config["metadata_filename"] + ").")
+        sys.exit(1)
+
+    sensitivity_table = logger.sensitivityTable(obspy.read_inventory(config["response_filename"]))
+    station_cache = metadata.metadataCache(None, config["network"], config["metadata_filename"])
+    station_cache.update(obspy.read_inventory(config["metadata_filename"]), False)
+
+    shard_count = args.shards
+    if(shard_count is None):
+        shard_count = args.workers
+
+    if(not os.path.exists(args.state_dir)):
+        os.makedirs(args.state_dir)
+
+    first_day = UTCDateTime(args.start)
+    last_day = UTCDateTime(args.end)
+    days = []
+    day = first_day
+
+    while(day <= last_day):
+        if(args.force or not day_is_done(args.state_dir, day, config)):
+            days.append(day)
+        else:
+            logging.info("Skipping " + str(day.date) + ", already done.")
+        day += SECONDS_IN_DAY
+
+    units = []
+    shards_per_day = {}
+    blacklist = config.get("station_blacklist", [])
+
+    for day in list(days):
+        stations = station_cache.stations_in_network(day, day + SECONDS_IN_DAY, blacklist)
+        shards = []
+
+        if(len(stations) == 0):
+            logging.info("No stations in the network on " + str(day.date) + ", skipping it.")
+            days.remove(day)
+            continue
+
+        for i in range(0, shard_count):
+            if(len(stations[i::shard_count]) > 0):
+                shards.append(stations[i::shard_count])
+
+        shards_per_day[day.timestamp] = [0, [None] * len(shards), len(stations)]
+
+        for i in range(0, len(shards)):
+            units.append((day.timestamp, i, shards[i], args.archive, args.layout, config, sensitivity_table))
+
+    logging.info("Reprocessing " + str(len(days)) + " days in " + str(len(units)) + " work units on " + str(args.workers) + " workers.")
+
+    start = time.monotonic()
+    days_done = 0
+    station_days = 0
+
+    with multiprocessing.Pool(args.workers) as pool:
+        for day_timestamp, shard_index, minutes in pool.imap_unordered(process_day_shard, units):
+            day_state = shards_per_day[day_timestamp]
+            day_state[0] += 1
+            day_state[1][shard_index] = minutes
+
+            if(day_state[0] < len(day_state[1])):
+                continue
+
+            day = UTCDateTime(day_timestamp)
+            write_day(day, day_state[1], station_cache, config, output_formats)
+            mark_day_done(args.state_dir, day, config, time.monotonic() - start)
+            shards_per_day.pop(day_timestamp)
+
+            days_done += 1
+            station_days += day_state[2]
+            elapsed = time.monotonic() - start
+            remaining = (len(days) - days_done) * elapsed / days_done
+
+            logging.info("Finished %s (%d/%d days), %.2f days/hour, %.1f station-days/minute, about %.0f minutes left." %
+                         (str(day.date), days_done, len(days), days_done * 3600 / elapsed, station_days * 60 / elapsed, remaining / 60))
+
+
+if(__name__ == "__main__"):
+    main()
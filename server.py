@@ -3,12 +3,13 @@
 import cherrypy
 import os
 import sys
-import csv
 import math
 import datetime
 import time
 import common
+import daystore
 import threading
+from catalog import catalogStore, FIELDS
 import urllib
 
 import schedule
@@ -29,6 +30,7 @@ class api(object):
         self.fdsn = fdsnClient(self.config["fdsn_address"])
         self.cached_station_metadata = {}
         self.exit = False
+        self.catalog = catalogStore(export_text=False)
 
         self.cacheStations()
 
@@ -76,6 +78,50 @@ class api(object):
     def sortedStationNames(self):
         return sorted(list(self.cached_station_metadata.keys()))
 
+    #The components the logger writes, e.g. ["z", "n", "e"] when it fetches "HH?".
+    def availableComponents(self):
+        if("channels" in self.config.config):
+            return common.determine_components(self.config["channels"])
+
+        return ["z"]
+
+    #The rsam window lengths in seconds that are stored, 60 and the sub minute "rsam_windows" of the logger.
+    def availableResolutions(self):
+        result = [60]
+        if("rsam_windows" in self.config.config):
+            result += common.valid_rsam_windows(self.config["rsam_windows"])
+
+        return result
+
+    #The error message for a day that has no rsam window data for a sub minute resolution.
+    def missingWindowsMessage(self, date, f, component, resolution):
+        return("No " + str(resolution) + " second rsam window data for " + date.strftime("%Y-%m-%d") + ", filter " + str(f) + ", component " + component + ".")
+
+    #The "resolution" of a query in seconds, 60 if it isn't given.
+    def queryResolution(self, query):
+        resolution = 60
+        if("resolution" in query):
+            try:
+                resolution = int(query["resolution"])
+            except (TypeError, ValueError):
+                raise cherrypy.HTTPError(406)#Not Acceptable
+
+            if(resolution not in self.availableResolutions()):
+                raise cherrypy.HTTPError(406)#Not Acceptable
+
+        return resolution
+
+    #The "component" of a query, "z" if it isn't given.
+    def queryComponent(self, query):
+        component = "z"
+        if("component" in query):
+            component = str(query["component"]).lower()
+
+            if(component not in self.availableComponents()):
+                raise cherrypy.HTTPError(406)#Not Acceptable
+
+        return component
+
     @cherrypy.expose
     @cherrypy.tools.json_out()
     def station_metadata(self):
@@ -96,13 +142,13 @@ class api(object):
         return self.getNetworkStations(date_start, date_end)
 
     """
-    returns list of available stations and filters
+    returns list of available stations, filters and components
     """
     @cherrypy.expose
     @cherrypy.tools.json_out()
     def current_configuration(self):
         self.config.reload()
-        return {"stations": self.sortedStationNames(), "filters": self.config["filters"]}
+        return {"stations": self.sortedStationNames(), "filters": self.config["filters"], "components": self.availableComponents(), "resolutions": self.availableResolutions()}
     
     #TODO:  þegar við erum ekki lengur að lesa úr csv skrá væri kannski hægt að gera eitthvað betra en að lesa
     #       alltaf skrána sem geymir öll gögnin bara til að ná í nýjustu mín?
@@ -147,6 +193,9 @@ class api(object):
         if("do_log_transform" in query):
             do_log_transform = query["do_log_transform"]
 
+        component = self.queryComponent(query)
+        resolution = self.queryResolution(query)
+
         result = self.dataResponse(filters)
 
         #NOTE: This is necessary because javascript interprets 1.0 an integer(client asks for available filters, )
@@ -164,14 +213,25 @@ class api(object):
         for i in range(0, len(filters)):
             f = filters[i]
             if(f in self.config["filters"]):
-                tremvlog_filename = common.generate_tremvlog_filename(date, f, "z")
-                path = folder_path + tremvlog_filename
-                rsam_data = common.read_tremvlog_file(path)
+                latest_data = daystore.read_tremvlog_latest(date, f, component, resolution)
+
+                #Sub minute resolutions are only in the binary store.
+                if(latest_data is None and resolution != 60):
+                    raise cherrypy.HTTPError(404, self.missingWindowsMessage(date, f, component, resolution))
+
+                if(latest_data is None):
+                    tremvlog_filename = common.generate_tremvlog_filename(date, f, component)
+                    path = folder_path + tremvlog_filename
+                    rsam_data = common.read_tremvlog_file(path)
+
+                    latest_data = {}
+                    for name in rsam_data:
+                        latest_data[name] = rsam_data[name][-1]
 
                 for name in stations:
                     latest_value = 0.0
-                    if(name in rsam_data):
-                        latest_value = rsam_data[name][-1]
+                    if(name in latest_data):
+                        latest_value = latest_data[name]
 
                         if(do_log_transform):
                             if(latest_value > 0.0):
@@ -203,6 +263,10 @@ class api(object):
         if("do_log_transform" in query):
             do_log_transform = query["do_log_transform"]
 
+        component = self.queryComponent(query)
+        resolution = self.queryResolution(query)
+        rows_per_minute = 60 // resolution
+
         result = self.dataResponse(filters)
 
         #NOTE: need to do this because javascript interprets 1.0 from the metadata response as an integer
@@ -253,17 +317,29 @@ class api(object):
             if(i == range_in_days-1):#end
                 file_minute_end = query_minute_end
 
+            #with a sub minute resolution there are rows_per_minute rows for every minute
+            file_minute_start *= rows_per_minute
+            file_minute_end *= rows_per_minute
+
             for j in range(0, len(filters)):
                 f = filters[j]
 
                 if(f in self.config["filters"]):
                     folder_path = common.logger_output_path(date)
-                    filename = folder_path + common.generate_tremvlog_filename(date, f, "z")
-                    rsam_data = {}
+                    filename = folder_path + common.generate_tremvlog_filename(date, f, component)
+                    rsam_data = daystore.read_tremvlog_day(date, f, component, resolution=resolution)
+
+                    #Sub minute resolutions are only in the binary store. A day with minute data but no window data wasn't logged with this resolution.
+                    if(rsam_data is None and resolution != 60):
+                        if(os.path.exists(filename) or os.path.exists(folder_path + daystore.generate_filename(date, f, component))):
+                            raise cherrypy.HTTPError(404, self.missingWindowsMessage(date, f, component, resolution))
+
+                    if(rsam_data is None):
+                        rsam_data = {}
 
-                    if(os.path.exists(filename)):
-                        rsam_data = common.read_tremvlog_file(filename)
-                        print(len(rsam_data[list(rsam_data.keys())[0]]))
+                        if(os.path.exists(filename)):
+                            rsam_data = common.read_tremvlog_file(filename)
+                            print(len(rsam_data[list(rsam_data.keys())[0]]))
 
                     if(do_log_transform):
                         for name in stations:
@@ -297,57 +373,26 @@ class api(object):
         result = []
 
         #TODO: make sure these are valid values...
-        #keep the dates without minute info, and just keep the minutes as integers, which is easier
         sd = common.parse_isoformat_to_datetime(query["range_start"])
         ed = common.parse_isoformat_to_datetime(query["range_end"])
 
-        year = sd.year
-        month = sd.month
-
-        print(year)
-        print(month)
-
-        while(year != ed.year or month <= ed.month):
-            if(month > 12):
-                month = 1
-                year += 1
-
-            path = "tremor_catalog/" + str(year) + "/" + str(year) + "." + str(month) + "_tremor_catalog.txt"
-
-            if(os.path.exists(path)):
-                with open(path) as catalog_file:
-                    catalog = csv.DictReader(catalog_file, delimiter="\t")
-
-                    for entry in catalog:
-                        timestamp = common.parse_isoformat_to_datetime(entry["TriggerTime"])
-                        if(timestamp > sd and timestamp < ed):
-                            entry["Stations"] = entry["Stations"].split(",")
-                            f0_str, f1_str = entry["Filter"].strip("[]").split(",")
-                            entry["Filter"] = [float(f0_str), float(f1_str)]
-                            result.append(entry)
-
-
-            month += 1
+        for entry in self.catalog.events_between(UTCDateTime(sd), UTCDateTime(ed)):
+            entry["Stations"] = entry["Stations"].split(",")
+            f0_str, f1_str = entry["Filter"].strip("[]").split(",")
+            entry["Filter"] = [float(f0_str), float(f1_str)]
+            result.append(entry)
 
         return result
 
-        """
-        for i in range(0, ed - sd):
-            path += str(year) + "/" + str(year) + "." + str(month) + "_tremor_catalog.txt"
-
-        with open(path) as f:
-            catalog = csv.DictReader(f, delimiter="\t")
-        """
-
 
 #TODO: templating?
 class catalog(object):
     def __init__(self):
         self.config = common.config("config.json")
+        self.catalog = catalogStore(export_text=False)
 
     @cherrypy.expose
     def default(self, *args):
-        path = "tremor_catalog/"
         date = datetime.date.today()
         year = date.year
         month = date.month
@@ -357,159 +402,151 @@ class catalog(object):
             year = int(args[0])
             month = int(args[1])
 
-        path += str(year) + "/" + str(year) + "." + str(month) + "_tremor_catalog.txt"
-
-        with open(path) as catalog_file:
-            catalog = csv.DictReader(catalog_file, delimiter="\t")
-
-            html = """
-            <html>
-            <head>
-                <title>Tremor Catalog</title>
-                <style>
-                body {
-                    font-family: arial;
-                    margin: 0 auto;
-                    max-width: 1024px;
-                }
-                table {
-                    table-layout: fixed;
-                    width: 100%;
-                    overflow-wrap: break-word;
-                    border-collapse: collapse;
-                    border: 2px solid;
-                    text-align: center;
-                }
-
-                thead th:nth-child(1) {
-                    width: 6%;
-                }
-
-                thead th:nth-child(2) {
-                    width: 24%;
-                }
-
-                thead th:nth-child(3) {
-                    width: 8%;
-                }
-
-                thead th:nth-child(5) {
-                    width: 4%;
-                }
-
-                tbody tr:nth-child(odd) {
-                    background-color: #EAEAEA;
-                }
-
-                td, th {
-                    padding: 10px;
-                }
-
-                .new_event {
-                    background-color: #FFC8C8 !important;
-                }
-
-                .plot_button_svg {
-                    display: none;
-                }
-
-                tr:hover .plot_button_svg {
-                    display: inline;
-                }
-
-                a {
-                    color: black;
-                    text-decoration: none;
-                }
-
-                </style>
-            </head>
-            <body>
-            """
-            html += "<table>"
-            html += "<thead>"
-            html += "<tr>"
-            for k in catalog.fieldnames:
-                html += "<th>" + k + "</th>"
-
-            html += "<th></th>"#tómt til að búa til pláss fyrir plot takkann
+        lines = self.catalog.month_events(year, month)
+
+        html = """
+        <html>
+        <head>
+            <title>Tremor Catalog</title>
+            <style>
+            body {
+                font-family: arial;
+                margin: 0 auto;
+                max-width: 1024px;
+            }
+            table {
+                table-layout: fixed;
+                width: 100%;
+                overflow-wrap: break-word;
+                border-collapse: collapse;
+                border: 2px solid;
+                text-align: center;
+            }
 
-            html += "</tr>"
-            html += "</thead>"
+            thead th:nth-child(1) {
+                width: 6%;
+            }
 
-            lines = []
+            thead th:nth-child(2) {
+                width: 24%;
+            }
 
-            for l in catalog:
-                lines.append(l)
+            thead th:nth-child(3) {
+                width: 8%;
+            }
 
-            for i in range(0, len(lines)):
-                index = len(lines) - i - 1
-                timestamp = common.parse_isoformat_to_datetime(lines[index]["TriggerTime"])
-                delta = datetime.datetime.now() - timestamp
+            thead th:nth-child(5) {
+                width: 4%;
+            }
 
-                if(int(delta.total_seconds()) // 60 <= 10):
-                    html += "<tr class='new_event'>"
-                else:
-                    html += "<tr>"
+            tbody tr:nth-child(odd) {
+                background-color: #EAEAEA;
+            }
+
+            td, th {
+                padding: 10px;
+            }
+
+            .new_event {
+                background-color: #FFC8C8 !important;
+            }
+
+            .plot_button_svg {
+                display: none;
+            }
+
+            tr:hover .plot_button_svg {
+                display: inline;
+            }
+
+            a {
+                color: black;
+                text-decoration: none;
+            }
 
-                for k in catalog.fieldnames:
-                    html += "<td>" + lines[index][k] + "</td>"
+            </style>
+        </head>
+        <body>
+        """
+        html += "<table>"
+        html += "<thead>"
+        html += "<tr>"
+        for k in FIELDS:
+            html += "<th>" + k + "</th>"
 
-                html += "<td><a href='" 
+        html += "<th></th>"#tómt til að búa til pláss fyrir plot takkann
 
-                url = "/plot/?"
-                url += "stations=" + urllib.parse.quote(lines[index]["Stations"])
-                date = datetime.date(timestamp.year, timestamp.month, timestamp.day)
+        html += "</tr>"
+        html += "</thead>"
 
-                url += "&date=" + date.isoformat()
+        for i in range(0, len(lines)):
+            index = len(lines) - i - 1
+            timestamp = common.parse_isoformat_to_datetime(lines[index]["TriggerTime"])
+            delta = datetime.datetime.now() - timestamp
 
-                f0_str, f1_str = lines[index]["Filter"].strip("[]").split(",")
-                filt = [float(f0_str), float(f1_str)]
+            if(int(delta.total_seconds()) // 60 <= 10):
+                html += "<tr class='new_event'>"
+            else:
+                html += "<tr>"
 
-                filt_query_state = []
+            for k in FIELDS:
+                html += "<td>" + lines[index][k] + "</td>"
 
-                for f in self.config["filters"]:
-                    if(f[0] == filt[0] and f[1] == filt[1]):
-                        filt_query_state.append("true")
-                    else:
-                        filt_query_state.append("false")
+            html += "<td><a href='" 
 
-                url += "&filters=" + urllib.parse.quote( ",".join(filt_query_state))
+            url = "/plot/?"
+            url += "stations=" + urllib.parse.quote(lines[index]["Stations"])
+            date = datetime.date(timestamp.year, timestamp.month, timestamp.day)
 
-                url += "&sidebar=false"
-                url += "&catalog=true"
+            url += "&date=" + date.isoformat()
 
-                html += url + "' title='Plot'>"
-                html += "<svg class='plot_button_svg' xmlns='http://www.w3.org/2000/svg' width='16' height='16' fill='currentColor' class='bi bi-bar-chart-line-fill' viewBox='0 0 16 16'><path d='M11 2a1 1 0 0 1 1-1h2a1 1 0 0 1 1 1v12h.5a.5.5 0 0 1 0 1H.5a.5.5 0 0 1 0-1H1v-3a1 1 0 0 1 1-1h2a1 1 0 0 1 1 1v3h1V7a1 1 0 0 1 1-1h2a1 1 0 0 1 1 1v7h1V2z'/></svg>"
-                html += "</a></td>"
-                html += "</tr>"
+            f0_str, f1_str = lines[index]["Filter"].strip("[]").split(",")
+            filt = [float(f0_str), float(f1_str)]
 
-            html += "</table>"
+            filt_query_state = []
 
-            html += "</body>"
+            for f in self.config["filters"]:
+                if(f[0] == filt[0] and f[1] == filt[1]):
+                    filt_query_state.append("true")
+                else:
+                    filt_query_state.append("false")
 
-            html += """
-            <script type="text/javascript">
-            function createReloadTimer(sec) {
-                return setInterval(function() {window.location.reload(true)}, 1000*sec);
-            }
+            url += "&filters=" + urllib.parse.quote( ",".join(filt_query_state))
 
-            let reload_timer = null;
-            if(window.location.pathname === "/catalog" || window.location.pathname === "/catalog/") {
-                let reload_timer = createReloadTimer(60);
+            url += "&sidebar=false"
+            url += "&catalog=true"
 
-                document.onscroll = function() {
-                    clearInterval(reload_timer);
-                    reload_timer = createReloadTimer(60);
-                    console.log("timer reset");
-                }
+            html += url + "' title='Plot'>"
+            html += "<svg class='plot_button_svg' xmlns='http://www.w3.org/2000/svg' width='16' height='16' fill='currentColor' class='bi bi-bar-chart-line-fill' viewBox='0 0 16 16'><path d='M11 2a1 1 0 0 1 1-1h2a1 1 0 0 1 1 1v12h.5a.5.5 0 0 1 0 1H.5a.5.5 0 0 1 0-1H1v-3a1 1 0 0 1 1-1h2a1 1 0 0 1 1 1v3h1V7a1 1 0 0 1 1-1h2a1 1 0 0 1 1 1v7h1V2z'/></svg>"
+            html += "</a></td>"
+            html += "</tr>"
+
+        html += "</table>"
+
+        html += "</body>"
+
+        html += """
+        <script type="text/javascript">
+        function createReloadTimer(sec) {
+            return setInterval(function() {window.location.reload(true)}, 1000*sec);
+        }
+
+        let reload_timer = null;
+        if(window.location.pathname === "/catalog" || window.location.pathname === "/catalog/") {
+            let reload_timer = createReloadTimer(60);
+
+            document.onscroll = function() {
+                clearInterval(reload_timer);
+                reload_timer = createReloadTimer(60);
+                console.log("timer reset");
             }
-            </script>
-            """
+        }
+        </script>
+        """
 
-            html += "</html>"
+        html += "</html>"
 
-            return html
+        return html
 
 class frontend(object):
     @cherrypy.expose
@@ -0,0 +1,424 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import os
+import csv
+import glob
+import json
+import time
+import argparse
+import itertools
+import logging
+import multiprocessing
+import numpy
+from obspy import UTCDateTime
+import common
+import daystore
+import alert
+import catalog
+
+"""
+Replays the alerts over the stored rsam of a range of days with many settings of alert_config.json, to see how each
+setting would have done without running it live.
+
+The rsam of the days is loaded into memory once, from the day files (the csv files if there are any, else the binary store).
+Every combination of the settings in the grid runs the STA/LTA, ramp and voting of alert.py (alert.alert_windows and
+alert.stat_voting) for every minute, as if the alerts had been on since the start of the first day, and the triggers become
+events the way write_catalog makes them: an event starts when enough stations vote, gets every station that triggers while
+it lasts, and an event that starts within minimum_min_between_events of the start of the previous one carries on the
+previous one. compare_sweep.py checks the catalogs of the sweep against the live alerts.
+
+The work is split into (filter, window settings) units on a process pool. The window averages and ramps of a unit are
+computed once, a week at a time, and all the thresholds (trigger_ratio, min_velocity, station_votes and
+minimum_min_between_events) of the grid are evaluated on them.
+Each combination gets a catalog in the format of the tremor catalog text files in the output directory, and summary.csv
+has its settings, the number of events and, with --reference, how many of the events in the reference catalog it found.
+
+The grid is a JSON file with a list of values for any of the settings, the others are taken from alert_config.json:
+    {"sta_length": [2, 3, 5], "lta_length": [10, 20], "trigger_ratio": [1.2, 1.3, 1.5], "station_votes": [3, 4]}
+
+Usage:
+    python3 sweep.py 2020-01-01 2020-12-31 --grid grid.json --reference tremor_catalog --workers 8
+"""
+
+SECONDS_IN_DAY = 86400
+CHUNK_MINUTES = 10080
+
+WINDOW_SETTINGS = ["sta_length", "lta_length", "percentage_data", "ramp_min_avg", "ramp_intervals"]
+THRESHOLD_SETTINGS = ["trigger_ratio", "min_velocity", "station_votes", "minimum_min_between_events"]
+
+# The rsam of the range, set in each worker of the pool by init_worker.
+rsam = None
+
+
+"""
+Reads the rsam of a filter for a day from the csv file, or from the binary store if there is no csv file.
+
+Returns:
+    Dictionary of station -> numpy array with the 1440 minutes of the day, 0.0 where there is no data, or None if there is no file.
+"""
+def read_day(date, f, component):
+    path = common.logger_output_path(date)
+    filename = path + common.generate_tremvlog_filename(date, f, component)
+
+    if(os.path.exists(filename)):
+        data = common.read_tremvlog_file(filename)
+        # The timestamps are written as str(UTCDateTime), e.g. 2020-01-01T00:02:00.000000Z
+        rows = [int(t[11:13]) * 60 + int(t[14:16]) for t in common.read_tremvlog_timestamps(filename)]
+        result = {}
+
+        for name in data:
+            result[name] = numpy.zeros(daystore.MINUTES_PER_DAY)
+            result[name][rows] = data[name]
+
+        return(result)
+
+    filename = path + daystore.generate_filename(date, f, component)
+
+    if(os.path.exists(filename)):
+        day_file = daystore.dayFile(filename)
+        data = numpy.where(day_file.valid_minutes()[:, None], day_file.read(), 0.0).astype(numpy.float64)
+        result = {}
+
+        for name in day_file.stations:
+            result[name] = data[:, day_file.station_index[name]]
+
+        return(result)
+
+    return(None)
+
+
+"""
+Loads the rsam of every filter for the days from first_day, leaving out the stations in remove_stations.
+
+Returns:
+    (list of stations, list with one array of stations x minutes per filter)
+"""
+def load_rsam(first_day, days, filters, component, remove_stations):
+    per_day = []
+    stations = set()
+
+    for d in range(0, days):
+        date = first_day + d * SECONDS_IN_DAY
+        per_filter = []
+
+        for f in filters:
+            data = read_day(date, f, component)
+            if(data is None):
+                data = {}
+
+            for name in remove_stations:
+                data.pop(name, None)
+
+            stations.update(data)
+            per_filter.append(data)
+
+        per_day.append(per_filter)
+
+    stations = sorted(stations)
+    station_index = {}
+    for i in range(0, len(stations)):
+        station_index[stations[i]] = i
+
+    values = [numpy.zeros((len(stations), days * daystore.MINUTES_PER_DAY)) for f in filters]
+
+    for d in range(0, days):
+        for i in range(0, len(filters)):
+            for name in per_day[d][i]:
+                values[i][station_index[name], d * daystore.MINUTES_PER_DAY:(d + 1) * daystore.MINUTES_PER_DAY] = per_day[d][i][name]
+
+        per_day[d] = None
+
+    return(stations, values)
+
+
+"""
+Turns the per minute triggers of one filter into events, the way alert.write_catalog does, a chunk at a time.
+"""
+class eventTracker:
+    def __init__(self, minimum_event_gap):
+        self.gap = minimum_event_gap * 60
+        self.events = []#[trigger time in seconds since the epoch, set of station rows]
+        self.current = None#event that is on at the end of the last chunk
+        self.previous = None#last event that was started
+
+    """
+    Parameters:
+        start: seconds since the epoch of the first minute of the chunk.
+        on: whether the filter is triggered, for every minute of the chunk.
+        triggered: stations x minutes, whether each station is triggered.
+    """
+    def add(self, start, on, triggered):
+        edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([0], on.astype(numpy.int8), [0]))))
+
+        if(len(edges) == 0 or edges[0] > 0):
+            self.current = None
+
+        for a, b in zip(edges[0::2], edges[1::2]):
+            if(self.current is None):
+                t = start + 60 * int(a)
+
+                # Accounts for the minimum minutes between tremor event starttimes, may append to previous event
+                if(self.previous is not None and t <= self.previous[0] + self.gap):
+                    self.current = self.previous
+                else:
+                    self.current = [t, set()]
+                    self.events.append(self.current)
+                    self.previous = self.current
+
+            self.current[1].update(numpy.flatnonzero(triggered[:, a:b].any(axis=1)).tolist())
+
+            if(b < len(on)):
+                self.current = None
+
+
+def init_worker(data):
+    global rsam
+    rsam = data
+
+
+"""
+Runs one unit on the pool: every threshold combination of a filter and a setting of the windows over the whole range.
+
+Returns:
+    (filter index, list of (combination index, list of (trigger time, stations))).
+"""
+def evaluate_unit(unit):
+    filter_index, settings, thresholds = unit
+    start, stations, values = rsam["start"], rsam["stations"], rsam["values"][filter_index]
+
+    window = alert.window_minutes(settings)
+    minutes = values.shape[1]
+
+    trackers = []
+    triggers = {}#(trigger_ratio, min_velocity) -> the thresholds that trigger the same stations, votes and gap differ
+    for i in range(0, len(thresholds)):
+        threshold = thresholds[i][1]
+        trackers.append(eventTracker(threshold["minimum_min_between_events"]))
+        triggers.setdefault((threshold["trigger_ratio"], threshold["min_velocity"]), []).append(i)
+
+    for first in range(0, minutes, CHUNK_MINUTES):
+        count = min(CHUNK_MINUTES, minutes - first)
+
+        # the window minutes before the chunk, 0.0 before the first day as in a window with no data
+        history = values[:, max(first - window, 0):first]
+        padded = numpy.concatenate([numpy.zeros((len(stations), window - history.shape[1])), history, values[:, first:first + count]], axis=1)
+        sta, sta_averaged, lta, lta_averaged, ratio, has_ratio, ramp, rising, velocity = alert.alert_windows(padded, count, settings)
+
+        for trigger_ratio, min_velocity in triggers:
+            triggered, decided = alert.stat_voting(ratio, has_ratio, rising, velocity, trigger_ratio, min_velocity)
+            votes = triggered.sum(axis=0)
+
+            for i in triggers[(trigger_ratio, min_velocity)]:
+                trackers[i].add(start + 60 * first, votes >= thresholds[i][1]["station_votes"], triggered)
+
+    result = []
+    for i in range(0, len(thresholds)):
+        events = []
+        for t, rows in trackers[i].events:
+            events.append((t, [stations[r] for r in sorted(rows)]))
+        result.append((thresholds[i][0], events))
+
+    return(filter_index, result)
+
+
+"""
+Every combination of the values in the grid, with the settings that are not in it taken from alert_config.
+"""
+def combinations(grid, alert_config):
+    names = WINDOW_SETTINGS + THRESHOLD_SETTINGS
+    values = []
+
+    for name in names:
+        if(name in grid):
+            values.append(grid[name])
+        else:
+            values.append([alert_config[name]])
+
+    result = []
+    for combination in itertools.product(*values):
+        result.append(dict(zip(names, combination)))
+
+    return(result)
+
+
+"""
+Splits the combinations into units of a filter and a setting of the windows, with all of the thresholds that go with it.
+"""
+def make_units(combos, filter_count):
+    groups = {}
+
+    for i in range(0, len(combos)):
+        key = tuple([combos[i][name] for name in WINDOW_SETTINGS])
+        groups.setdefault(key, []).append((i, dict([(name, combos[i][name]) for name in THRESHOLD_SETTINGS])))
+
+    units = []
+    for key in groups:
+        for f in range(0, filter_count):
+            units.append((f, dict(zip(WINDOW_SETTINGS, key)), groups[key]))
+
+    return(units)
+
+
+"""
+Reads the events of a reference catalog between start and end: a catalog directory with catalog.db,
+or a glob of tremor catalog text files.
+
+Returns:
+    list of (trigger time in seconds since the epoch, filter as written in the catalog).
+"""
+def read_reference(path, start, end):
+    if(os.path.exists(os.path.join(path, catalog.DATABASE_FILENAME))):
+        entries = catalog.catalogStore(path, export_text=False).events_between(start, end)
+    else:
+        entries = []
+        for filename in sorted(glob.glob(path)):
+            with open(filename) as catalog_file:
+                for entry in csv.DictReader(catalog_file, delimiter=catalog.DELIMITER):
+                    if(start < UTCDateTime(entry["TriggerTime"]) < end):
+                        entries.append(entry)
+
+    return([(UTCDateTime(entry["TriggerTime"]).timestamp, entry["Filter"]) for entry in entries])
+
+
+"""
+Counts the reference events that an event of the same filter starts within tolerance seconds of, each event matching at most one.
+"""
+def count_matches(events, reference, tolerance):
+    matched = 0
+
+    for f in set([r[1] for r in reference]):
+        times = sorted([e[0] for e in events if e[1] == f])
+        used = 0
+
+        for t in sorted([r[0] for r in reference if r[1] == f]):
+            while(used < len(times) and times[used] < t - tolerance):
+                used += 1
+
+            if(used < len(times) and times[used] <= t + tolerance):
+                matched += 1
+                used += 1
+
+    return(matched)
+
+
+"""
+Writes the events of a combination as a tremor catalog text file, with the EventIDs starting at 1 every month.
+"""
+def write_catalog(filename, events):
+    lines = [catalog.DELIMITER.join(catalog.FIELDS) + "\n"]
+    event_ids = {}
+
+    for t, f, stations in events:
+        trigger_time = UTCDateTime(t)
+        month = (trigger_time.year, trigger_time.month)
+        event_ids[month] = event_ids.get(month, 0) + 1
+        lines.append(catalog.DELIMITER.join([str(event_ids[month]), str(trigger_time), f, ",".join(stations)]) + "\n")
+
+    with open(filename, "w") as catalog_file:
+        catalog_file.writelines(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the alerts over stored rsam with a grid of alert settings.")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", help="last day, YYYY-MM-DD")
+    parser.add_argument("--grid", required=True, help="JSON file with a list of values for each setting to sweep")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--alert-config", default="alert_config.json", help="the settings that are not in the grid")
+    parser.add_argument("--component", default=None, help="component to run the alerts on (default: the first one of the channels, as in the logger)")
+    parser.add_argument("--reference", default=None, help="catalog directory with catalog.db, or a glob of tremor catalog text files")
+    parser.add_argument("--tolerance", type=float, default=30, help="minutes between the trigger times of a matching event and reference event")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--output", default="sweep_output", help="directory for the catalogs and summary.csv")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    config = common.config(args.config).config
+    config.setdefault("channels", "HHZ")
+    config.setdefault("filters", [[0.5, 1.0], [1.0, 2.0], [2.0, 4.0]])
+    filters = config["filters"]
+    alert_config = common.config(args.alert_config).config
+
+    with open(args.grid, "r") as f:
+        grid = json.load(f)
+
+    for name in grid:
+        if(name not in WINDOW_SETTINGS + THRESHOLD_SETTINGS):
+            logging.error("The grid has " + name + ", which is not a setting that can be swept.")
+            return
+
+    component = args.component
+    if(component is None):
+        component = common.determine_components(config["channels"])[0]
+
+    first_day = UTCDateTime(args.start)
+    days = int((UTCDateTime(args.end) - first_day) // SECONDS_IN_DAY) + 1
+
+    start = time.monotonic()
+    stations, values = load_rsam(first_day, days, filters, component, alert_config["remove_stations"])
+    logging.info("Loaded %d days of %d stations and %d filters in %.1f seconds." % (days, len(stations), len(filters), time.monotonic() - start))
+
+    combos = combinations(grid, alert_config)
+    units = make_units(combos, len(filters))
+    events = [[] for c in combos]
+    logging.info("Running " + str(len(combos)) + " combinations in " + str(len(units)) + " work units on " + str(args.workers) + " workers.")
+
+    start = time.monotonic()
+    data = {"start": first_day.timestamp, "stations": stations, "values": values}
+
+    with multiprocessing.Pool(args.workers, init_worker, (data,)) as pool:
+        done = 0
+        for filter_index, result in pool.imap_unordered(evaluate_unit, units):
+            for combination, combination_events in result:
+                for t, event_stations in combination_events:
+                    events[combination].append((t, filter_index, catalog.filter_string(filters[filter_index]), event_stations))
+
+            done += 1
+            logging.info("Finished %d/%d work units." % (done, len(units)))
+
+    logging.info("Ran %d combinations in %.1f seconds." % (len(combos), time.monotonic() - start))
+
+    reference = None
+    if(args.reference is not None):
+        reference = read_reference(args.reference, first_day - 1, first_day + days * SECONDS_IN_DAY)
+        logging.info("The reference catalog has " + str(len(reference)) + " events in the range.")
+
+    if(not os.path.exists(args.output)):
+        os.makedirs(args.output)
+
+    fields = ["combination"] + WINDOW_SETTINGS + THRESHOLD_SETTINGS + ["events"]
+    if(reference is not None):
+        fields += ["reference_events", "matched", "precision", "recall"]
+
+    rows = []
+    for i in range(0, len(combos)):
+        # in order of the trigger time, and of the filters for events of the same minute, as the live catalog has them
+        events[i].sort(key=lambda e: (e[0], e[1]))
+        write_catalog(os.path.join(args.output, "catalog_%04d.txt" % i), [(e[0], e[2], e[3]) for e in events[i]])
+
+        row = dict(combos[i])
+        row["combination"] = i
+        row["events"] = len(events[i])
+
+        if(reference is not None):
+            matched = count_matches([(e[0], e[2]) for e in events[i]], reference, args.tolerance * 60)
+            row["reference_events"] = len(reference)
+            row["matched"] = matched
+            row["precision"] = matched / len(events[i]) if len(events[i]) > 0 else 0.0
+            row["recall"] = matched / len(reference) if len(reference) > 0 else 0.0
+
+        rows.append(row)
+
+    with open(os.path.join(args.output, "summary.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    logging.info("Wrote the catalogs and summary.csv to " + args.output + ".")
+
+
+if(__name__ == "__main__"):
+    main()
@@ -0,0 +1,177 @@
+#Authors:
+#Bethany Erin Vanderhoof
+#Þórður Ágúst Karlsson
+
+import zlib
+import queue
+import threading
+import traceback
+import multiprocessing
+import logging
+
+
+"""
+Loop that each worker runs until it gets None from its task queue.
+Tasks are (job_id, shard_index, kwargs) and the result is put on the shared result queue
+as (job_id, shard_index, ok, result), where result is a traceback string if the task raised.
+A task (None, name, value) sets the keyword argument name to value for every task after it (see workerPool.set_shared).
+"""
+def worker_loop(target, tasks, results):
+    shared = {}
+
+    while(True):
+        task = tasks.get()
+
+        if(task is None):
+            break
+
+        job_id, shard_index, kwargs = task
+
+        if(job_id is None):
+            shared[shard_index] = kwargs
+            continue
+
+        try:
+            results.put((job_id, shard_index, True, target(**shared, **kwargs)))
+        except Exception:
+            results.put((job_id, shard_index, False, traceback.format_exc()))
+
+
+"""
+Splits traces into count shards by station name. The same station always lands in the same shard
+as long as the number of shards doesn't change.
+
+Returns:
+    A list of count lists of traces. Some of them may be empty.
+"""
+def shard_traces(traces, count):
+    shards = []
+    for i in range(0, count):
+        shards.append([])
+
+    for trace in traces:
+        shards[zlib.crc32(trace.stats.station.encode()) % count].append(trace)
+
+    return(shards)
+
+
+"""
+A fixed set of long lived workers, either processes or threads, that all run the same function.
+Every worker has its own task queue so shard i always goes to worker i, which keeps any
+per process caches (like filter coefficients) warm from one minute to the next.
+Dead workers are restarted the next time work is handed out.
+Process workers are started with forkserver (spawn where there is no forkserver) and not forked from the logger,
+which has threads running that may hold locks (e.g. of the logging handlers) at the moment of the fork.
+"""
+class workerPool:
+    def __init__(self, target, worker_count, worker_type="process", timeout=50):
+        self.target = target
+        self.worker_count = worker_count
+        self.worker_type = worker_type
+        self.timeout = timeout
+        self.job_id = 0
+        self.shared = {}#keyword argument name -> value passed to every task
+        self.context = None
+
+        if(worker_type == "process"):
+            start_method = "spawn"
+            if("forkserver" in multiprocessing.get_all_start_methods()):
+                start_method = "forkserver"
+
+            self.context = multiprocessing.get_context(start_method)
+            self.results = self.context.Queue()
+        elif(worker_type == "thread"):
+            self.results = queue.Queue()
+        else:
+            raise Exception("Unknown worker type \"" + str(worker_type) + "\", it should be \"process\" or \"thread\".")
+
+        self.tasks = [None] * worker_count
+        self.workers = [None] * worker_count
+        self.worker_shared = [None] * worker_count#the shared values each worker has been sent
+
+        for i in range(0, worker_count):
+            self.start_worker(i)
+
+
+    def start_worker(self, index):
+        if(self.worker_type == "process"):
+            self.tasks[index] = self.context.Queue()
+            worker = self.context.Process(target=worker_loop, args=(self.target, self.tasks[index], self.results))
+        else:
+            self.tasks[index] = queue.Queue()
+            worker = threading.Thread(target=worker_loop, args=(self.target, self.tasks[index], self.results))
+
+        worker.name = "dsp_worker_" + str(index)
+        worker.daemon = True
+        worker.start()
+        self.workers[index] = worker
+        self.worker_shared[index] = {}
+
+
+    """
+    Sets a keyword argument that is passed to target in every task, e.g. a big table that rarely changes.
+    It is sent to each worker once, and again only when value is replaced by another object.
+    """
+    def set_shared(self, name, value):
+        self.shared[name] = value
+
+
+    """
+    Sends the shared keyword arguments that worker index doesn't have yet.
+    """
+    def send_shared(self, index):
+        for name in self.shared:
+            if(name not in self.worker_shared[index] or self.worker_shared[index][name] is not self.shared[name]):
+                self.tasks[index].put((None, name, self.shared[name]))
+                self.worker_shared[index][name] = self.shared[name]
+
+
+    """
+    Runs target once per shard, shard i on worker i, and waits for all of them.
+
+    Parameters:
+        shard_args: A list with one dictionary of keyword arguments per shard, on top of the shared ones. None entries are skipped.
+
+    Returns:
+        A list with the result of each shard, in shard order (None for skipped shards).
+    """
+    def run(self, shard_args):
+        self.job_id += 1
+        pending = 0
+
+        for i in range(0, len(shard_args)):
+            if(shard_args[i] is None):
+                continue
+
+            if(not self.workers[i].is_alive()):
+                logging.error(self.workers[i].name + " has died, restarting it.")
+                self.start_worker(i)
+
+            self.send_shared(i)
+            self.tasks[i].put((self.job_id, i, shard_args[i]))
+            pending += 1
+
+        result = [None] * len(shard_args)
+
+        while(pending > 0):
+            try:
+                job_id, shard_index, ok, value = self.results.get(timeout=self.timeout)
+            except queue.Empty:
+                raise Exception("Timed out waiting for " + str(pending) + " dsp worker(s).")
+
+            # Results from a job that timed out earlier are thrown away.
+            if(job_id != self.job_id):
+                continue
+
+            if(not ok):
+                raise Exception("dsp worker " + str(shard_index) + " failed:\n" + value)
+
+            result[shard_index] = value
+            pending -= 1
+
+        return(result)
+
+
+    def stop(self):
+        for tasks in self.tasks:
+            tasks.put(None)